@@ -0,0 +1,32 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pytest
+
+from workflow_parser import synthetic
+from workflow_parser.drivers import ceph_writefull_aio
+
+
+@pytest.fixture(scope="session")
+def driver():
+    return ceph_writefull_aio.CephRadosWriteoperation
+
+
+@pytest.fixture(scope="session")
+def trace_folder(tmp_path_factory, driver):
+    # a small generated trace with dropped lines and branches
+    folder = str(tmp_path_factory.mktemp("trace"))
+    synthetic.generate(driver, folder, 80, seed=7, drop=0.01, branch=0.1,
+                       concurrency=4)
+    return folder
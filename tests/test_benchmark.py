@@ -0,0 +1,44 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import importlib
+import multiprocessing
+import pkgutil
+
+import pytest
+
+from workflow_parser import drivers
+from workflow_parser.benchmark import benchmark
+from workflow_parser.synthetic import DRIVER_FORMATS
+
+
+def _drivers_byname():
+    ret = {}
+    for _, name, _ in pkgutil.iter_modules(drivers.__path__):
+        module = importlib.import_module(drivers.__name__ + "." + name)
+        driver = getattr(module, module.__all__[0])
+        ret[driver.name] = driver
+    return ret
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                    reason="the benchmark forks")
+@pytest.mark.parametrize("name", sorted(DRIVER_FORMATS))
+def test_benchmark_generated(tmp_path, name):
+    driver = _drivers_byname()[name]
+    result, = benchmark(driver, str(tmp_path), sizes=(20,), seed=1,
+                        branch=0.3)
+    steps = dict((step["name"], step) for step in result["steps"])
+    assert result["generate"]["lines"] > 0
+    assert steps["build_r"]["request"] > 0
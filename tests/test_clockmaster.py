@@ -0,0 +1,78 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import random
+
+import pytest
+
+from workflow_parser.clockmaster.relation_engine import CausalEngine
+from workflow_parser.clockmaster.relation_engine import MatrixCausalEngine
+
+
+def _register(engine, relations):
+    for from_host, to_host, from_seconds, to_seconds in relations:
+        engine.register(from_host, to_host, from_seconds, to_seconds)
+
+
+def _offsets(engine):
+    ret = {}
+    for name, hostc in engine.hosts.items():
+        assert hostc.determined is not None, hostc
+        ret[name] = hostc.determined
+    return ret
+
+
+def _random_relations(seed, len_hosts=5, len_msgs=40):
+    # messages between hosts with skewed clocks and positive latencies
+    rand = random.Random(seed)
+    hosts = ["host%d" % i for i in range(len_hosts)]
+    skews = dict((host, rand.uniform(-0.001, 0.001)) for host in hosts)
+    relations = []
+    for _ in range(len_msgs):
+        from_host, to_host = rand.sample(hosts, 2)
+        seconds = rand.uniform(0, 1)
+        latency = rand.uniform(0.0001, 0.0005)
+        relations.append((from_host, to_host,
+                          seconds + skews[from_host],
+                          seconds + latency + skews[to_host]))
+    return relations
+
+
+@pytest.mark.parametrize("engine_cls", [CausalEngine, MatrixCausalEngine])
+def test_relax_determined_by_relations(engine_cls):
+    # the exact offset of b is found while relaxing a, then b is neither
+    # ready nor sided and must not fall to adjust_none()
+    engine = engine_cls()
+    _register(engine, [("a", "b", 1.0, 1.5),
+                       ("b", "a", 2.0, 1.5)])
+    assert engine.relax()
+    offsets = _offsets(engine)
+    assert offsets["a"] - offsets["b"] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matrix_as_relax(seed):
+    relations = _random_relations(seed)
+    relax = CausalEngine()
+    _register(relax, relations)
+    assert relax.relax()
+    matrix = MatrixCausalEngine()
+    _register(matrix, relations)
+    assert matrix.relax()
+
+    relax_offsets = _offsets(relax)
+    matrix_offsets = _offsets(matrix)
+    assert sorted(matrix_offsets) == sorted(relax_offsets)
+    for host, offset in relax_offsets.items():
+        assert matrix_offsets[host] == pytest.approx(offset, abs=1e-9)
@@ -0,0 +1,50 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import multiprocessing
+import os
+
+import pandas as pd
+import pytest
+
+from workflow_parser.analyst.draw_engine import DrawEngine
+
+
+@pytest.mark.parametrize("processes", [
+    None,
+    pytest.param(2, marks=pytest.mark.skipif(
+        "fork" not in multiprocessing.get_all_start_methods(),
+        reason="the parallel render forks")),
+])
+def test_deferred_failed_figure(tmp_path, capsys, processes):
+    out_path = str(tmp_path) + os.sep
+    draw_engine = DrawEngine(out_path, processes=processes)
+    with draw_engine.deferred():
+        draw_engine.draw_boxplot(
+                pd.DataFrame({"x": ["a", "a", "b"], "y": [1., 2., 3.]}),
+                "first", "x", "y")
+        draw_engine.draw_boxplot(
+                pd.DataFrame({"x": ["a"], "y": [1.]}),
+                "broken", "x", "missing")
+        draw_engine.draw_boxplot(
+                pd.DataFrame({"x": ["c", "d"], "y": [4., 5.]}),
+                "last", "x", "y")
+        # not rendered until the block exits
+        assert not os.listdir(out_path)
+
+    out = capsys.readouterr().out
+    assert "draw_boxplot broken: FAILED KeyError" in out
+    assert "1/3 figures failed: draw_boxplot broken" in out
+    assert sorted(os.listdir(out_path)) == \
+        ["first_boxplot.png", "last_boxplot.png"]
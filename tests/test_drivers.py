@@ -0,0 +1,114 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from ast import literal_eval
+
+import pytest
+
+from workflow_parser import reserved_vars as rv
+from workflow_parser.datasource.exc import LogError
+from workflow_parser.datasource.log_engine import DriverPlugin
+from workflow_parser.drivers import ceph_rbdimagereq_aio
+from workflow_parser.drivers import ceph_rbdobjectreq_aio
+from workflow_parser.drivers import ceph_writefull_aio
+
+
+# the split-based filter_logline the drivers had before LineFormat
+def _legacy_filter_logline(line, var_dict, marker, components,
+                           sep, eq, key_alias):
+    if marker not in line:
+        return False
+
+    lines = line.split(" ", 1)
+    line = lines[1]
+    time = lines[0][1:-1]
+    var_dict[rv.TIME] = time
+    _time_s = time.split(":")
+    var_dict[rv.SECONDS] = int(_time_s[0]) * 3600 + int(_time_s[1]) * 60\
+            + float(_time_s[2])
+
+    lines = line.split(" ", 2)
+    line = lines[2]
+    _comp = lines[1].split(":")
+    var_dict[rv.COMPONENT] = components[_comp[1]]
+    var_dict[rv.TARGET] = _comp[1] + ":" + _comp[2]
+
+    lines = line.split(" ", 1)
+    line = lines[1]
+    var_dict[rv.KEYWORD] = lines[0].split(":", 1)[1][:-1]
+
+    def _convert(dict_str):
+        ret = {}
+        dict_str = dict_str.strip()
+        if dict_str:
+            for item in dict_str.split(sep):
+                k, v = item.strip().split(eq, 1)
+                k = k.strip()
+                ret[key_alias.get(k, k)] = literal_eval(v.strip())
+        return ret
+
+    lines = line.split(" }, { ")
+    var_dict.update(_convert(lines[1]))
+    var_dict.update(_convert(lines[2].strip()[:-1]))
+    var_dict[rv.THREAD] = str(var_dict["pthread_id"])
+    return True
+
+
+_SAMPLES = [
+    "[12:00:00.001000] host1 ust:fio:100 %s:kw_entry: { cpu_id = 1 }, "
+    "{ pthread_id = 5 }, { a = 'x y', b = -2, c = 1.5 }\n",
+    # empty payload, as babeltrace prints it
+    "[12:00:00.001000] host1 ust:fio:100 %s:kw_entry: { cpu_id = 1 }, "
+    "{ pthread_id = 5 }, { }\n",
+    "[12:00:00.001000] host1 ust:fio:100 %s:kw_entry: { cpu_id = 1 }, "
+    "{ pthread_id = 5 }, {  }\n",
+    # extra context field
+    "[12:00:00.001000] host1 ust:fio:100 %s:kw_entry: { cpu_id = 1 }, "
+    "{ pthread_id = 5, vtid = 9 }, { a = 1 }\n",
+    # unterminated last line
+    "[23:59:59.999999] host1 ust:fio:100 %s:kw_exit: { cpu_id = 0 }, "
+    "{ pthread_id = 7 }, { target = 'obj', d = 3 }",
+    "[12:00:00.001000] host1 ust:fio:100 other:kw_entry: { }, { }, { }\n",
+]
+
+
+@pytest.mark.parametrize("module, marker, sep, eq, key_alias", [
+    (ceph_writefull_aio, "radoswrite", ",", "=", {"target": "target_a"}),
+    (ceph_rbdimagereq_aio, "rbdimagereq", ", ", " = ", {}),
+    (ceph_rbdobjectreq_aio, "rbdobjectreq", ", ", " = ", {}),
+])
+def test_line_format_as_legacy(module, marker, sep, eq, key_alias):
+    line_format = module.line_format
+    for sample in _SAMPLES:
+        line = sample.replace("%s", marker)
+        expected = {}
+        is_line = _legacy_filter_logline(
+                line, expected, " %s:" % marker, line_format.components,
+                sep, eq, key_alias)
+        var_dict = {}
+        assert line_format(line, var_dict) == is_line, line
+        assert var_dict == expected, line
+
+
+def test_line_format_unmatched_marked_line():
+    line_format = ceph_writefull_aio.line_format
+    plugin = DriverPlugin(None, line_format, [".log"])
+    line = "[12:00:00.001000] host1 radoswrite:kw_entry: { }\n"
+    with pytest.raises(LogError) as info:
+        plugin.do_filter_logline(line, 42, "host1.log")
+    assert "host1.log@42" in str(info.value)
+    assert isinstance(info.value.e, LogError)
+    # lines without markers are not errors
+    assert plugin.do_filter_logline(
+            line.replace("radoswrite", "other"), 43, "host1.log")[0] is False
@@ -0,0 +1,188 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from collections import defaultdict
+import multiprocessing
+import os
+
+import pytest
+
+from workflow_parser.datasource.log_engine import proceed as l_proceed
+from workflow_parser.datasource.parse_cache import hash_driver
+from workflow_parser.loader import _load_data
+from workflow_parser.loader import save
+from workflow_parser.loader import stream
+from workflow_parser.utils import Report
+from workflow_parser.workflow.engine.request import _iter_thread_activities
+from workflow_parser.workflow.engine.request import group_threads
+from workflow_parser.workflow.engine.schema import SchemaEngine
+from workflow_parser.workflow.engine.serialize import load_requests
+from workflow_parser.workflow.engine.threadins import build_thread_instances
+from workflow_parser.workflow.entities.join import RequestjoinActivity
+
+
+def _summary(requestinss):
+    # request names are numbered across loads and host clocks are adjusted
+    # in place, so they are left out
+    ret = []
+    for requestins in requestinss.values():
+        activities = []
+        for threadins in requestins.threadinss:
+            for activity in _iter_thread_activities(threadins):
+                activities.append((str(activity.path), activity.order,
+                                   activity.is_main))
+        for join in requestins.iter_joins():
+            activities.append((str(join.path), join.order, join.is_main))
+        ret.append((requestins.request_state, requestins.len_paces,
+                    requestins.len_main_paces, len(requestins.threadinss),
+                    sorted(activities)))
+    return sorted(ret)
+
+
+@pytest.mark.skipif("fork" not in multiprocessing.get_all_start_methods(),
+                    reason="the parallel build forks")
+def test_parallel_build_as_serial(driver, trace_folder):
+    serial = _load_data(trace_folder, driver)
+    parallel = _load_data(trace_folder, driver, processes=2)
+    assert serial
+    assert _summary(parallel) == _summary(serial)
+
+
+def test_hash_indexer_as_pandas(driver, trace_folder):
+    by_pandas = _load_data(trace_folder, driver, indexer="pandas")
+    by_hash = _load_data(trace_folder, driver, indexer="hash")
+    assert by_pandas
+    assert _summary(by_hash) == _summary(by_pandas)
+
+
+def test_stream_as_load(driver, trace_folder, tmp_path):
+    contents = {}
+    for name in sorted(os.listdir(trace_folder)):
+        with open(os.path.join(trace_folder, name), "rb") as reader:
+            contents[name] = reader.read()
+    follow_folder = str(tmp_path)
+    for name in contents:
+        open(os.path.join(follow_folder, name), "wb").close()
+
+    session = stream(follow_folder, driver, window=0.002)
+    streamed = {}
+    polls = 7
+    for i in range(1, polls + 1):
+        # append a part of every file, cutting lines mid-way
+        for name, content in contents.items():
+            begin = len(content) * (i - 1) // polls
+            end = len(content) * i // polls
+            with open(os.path.join(follow_folder, name), "ab") as writer:
+                writer.write(content[begin:end])
+        requestinss = session.poll()
+        assert not set(requestinss) & set(streamed)
+        streamed.update(requestinss)
+    assert streamed
+    streamed.update(session.close())
+
+    loaded = _load_data(trace_folder, driver)
+    assert _summary(streamed) == _summary(loaded)
+
+
+def _detail(requestinss):
+    # in one load, names, times and lines are kept by a round trip
+    def line_key(activity):
+        pace = activity.from_pace or activity.to_pace
+        line_obj = pace.line_obj
+        return (line_obj.source_obj.name, line_obj.lino)
+
+    ret = {}
+    for name, requestins in requestinss.items():
+        activities = []
+        for threadins in requestins.threadinss:
+            for activity in _iter_thread_activities(threadins):
+                activities.append((str(activity.path), activity.order,
+                                   activity.is_main, line_key(activity)))
+        for join in requestins.iter_joins():
+            activities.append((str(join.path), join.order, join.is_main,
+                               line_key(join)))
+        ret[name] = (requestins.request, requestins.request_state,
+                     requestins.from_seconds, requestins.to_seconds,
+                     requestins.len_paces, requestins.len_main_paces,
+                     sorted((k, sorted(map(str, v))) for k, v
+                            in requestins.request_vars.items()),
+                     sorted(activities))
+    return ret
+
+
+def test_saved_as_built(driver, trace_folder, tmp_path):
+    requestinss = _load_data(trace_folder, driver)
+    f_dir = str(tmp_path / "requests.wfr")
+    save(requestinss, f_dir, driver)
+    loaded = load_requests(f_dir, driver.graph, driver.services,
+                           hash_driver(driver), Report())
+    assert requestinss
+    assert _detail(loaded) == _detail(requestinss)
+
+
+def _legacy_group_threads(threadinss, joininfo):
+    # the recursive grouping before the union-find
+    seen_threadinss = set()
+    def group(threadins, threadins_group, requests):
+        if threadins in seen_threadinss:
+            return
+        seen_threadinss.add(threadins)
+        threadins_group.add(threadins)
+        if threadins.request:
+            requests.add(threadins.request)
+
+        for joins in joininfo.iter_innerjoins(threadins):
+            if isinstance(joins, RequestjoinActivity):
+                to_threadins = joins.to_pace_unnested.threadins
+            else:
+                to_threadins = joins.to_threadins
+            group(to_threadins, threadins_group, requests)
+        for joined in joininfo.iter_innerjoined(threadins):
+            if isinstance(joined, RequestjoinActivity):
+                from_threadins = joined.from_pace_unnested.threadins
+            else:
+                from_threadins = joined.from_threadins
+            group(from_threadins, threadins_group, requests)
+
+    threadgroup_by_request = defaultdict(set)
+    threadgroups_without_request = []
+    for threadins in threadinss:
+        if threadins not in seen_threadinss:
+            threadins_group = set()
+            requests = set()
+            group(threadins, threadins_group, requests)
+            assert len(requests) <= 1
+            if requests:
+                threadgroup_by_request[requests.pop()].update(
+                        threadins_group)
+            else:
+                threadgroups_without_request.append(threadins_group)
+
+    ret = list(threadgroup_by_request.items())
+    for tgroup in threadgroups_without_request:
+        ret.append((None, tgroup))
+    return ret
+
+
+def test_group_threads_as_legacy(driver, trace_folder):
+    report = Report()
+    target_byname = l_proceed(trace_folder, driver.services, driver, report)
+    schema_engine = SchemaEngine(driver.graph)
+    threadinss = build_thread_instances(set(target_byname.values()),
+                                        driver.graph, schema_engine, report)
+    joininfo = schema_engine.proceed(report, target_byname)
+
+    groups = group_threads(threadinss, joininfo, report)
+    assert groups
+    assert groups == _legacy_group_threads(threadinss, joininfo)
@@ -0,0 +1,153 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import numpy as np
+import pandas as pd
+
+from workflow_parser import synthetic
+from workflow_parser.analyst.statistic_helper import IntGroup
+from workflow_parser.analyst.statistic_helper import IntervalIndex
+from workflow_parser.analyst.statistic_helper import Workflow
+from workflow_parser.analyst.statistics_engine import entities_of
+from workflow_parser.analyst.statistics_engine import generate_dataframes
+from workflow_parser.loader import _load_data
+
+
+def test_entity_ids_as_objects(driver, trace_folder):
+    requestinss = _load_data(trace_folder, driver)
+    by_objects = generate_dataframes(requestinss)
+    entities = []
+    by_ids = generate_dataframes(requestinss, entities)
+    assert len(by_ids) == len(by_objects)
+
+    for df_objects, df_ids in zip(by_objects[4:], by_ids[4:]):
+        assert df_ids["_entity"].dtype.kind == "i"
+        pd.testing.assert_frame_equal(df_objects.drop(columns="_entity"),
+                                      df_ids.drop(columns="_entity"))
+        objects = entities_of(df_objects["_entity"])
+        resolved = entities_of(df_ids["_entity"], entities)
+        assert all(a is b for a, b in zip(objects, resolved))
+
+    request_df = by_ids[6]
+    assert list(request_df["int_type"].unique()) == ["RequestInstance"]
+    assert (request_df["len_threadinss"] ==
+            [len(r.threadinss) for r in
+             entities_of(request_df["_entity"], entities)]).all()
+
+
+def _legacy_reduce(workflow):
+    # the reduce before the online topological order, it sorts the whole
+    # workflow again for every pair of groups
+    path_weights = sorted(workflow.paths.items(),
+                          key=lambda s:s[1],
+                          reverse=True)
+    for path, _ in path_weights:
+        groups = workflow.sort_topologically()
+        assert groups
+
+        groups = [group for group in groups if group.path == path]
+        while groups:
+            group = groups[0]
+            groups = groups[1:]
+            nxt_groups = []
+            for to_merge in groups:
+                group.try_merge(to_merge)
+                workflow.groups.remove(to_merge)
+                if workflow.sort_topologically() is not None:
+                    group.apply_merge()
+                else:
+                    group.abort_merge()
+                    workflow.groups.add(to_merge)
+                    nxt_groups.append(to_merge)
+            groups = nxt_groups
+
+
+def _reduced(requestinss, f_reduce):
+    ret = {}
+    for r_type in sorted(set(r.request_type for r in requestinss.values())):
+        workflow = Workflow(r_type)
+        for r in requestinss.values():
+            if r.request_type == r_type:
+                workflow.build(r.iter_mainints())
+        f_reduce(workflow)
+
+        def key(interval):
+            return (interval.request, interval.path, interval.from_seconds)
+        def group_key(group):
+            return (group.path, min(key(i) for i in group.intervals))
+        groups = {}
+        for group in workflow.groups:
+            groups[group_key(group)] = (
+                sorted(key(i) for i in group.intervals),
+                sorted(group_key(g) for g in group._nxt_groups),
+                sorted(group_key(g) for g in group._prv_groups
+                       if g is not workflow.start_group))
+        ret[r_type] = groups
+    return ret
+
+
+def test_reduce_as_legacy(driver, tmp_path, monkeypatch):
+    # more branches, so that some merges would make cycles
+    folder = str(tmp_path)
+    synthetic.generate(driver, folder, 80, seed=7, drop=0.01, branch=0.3,
+                       concurrency=4)
+    requestinss = _load_data(folder, driver)
+    # groups are sorted by id(), order them by build instead, so that both
+    # reduces try the same pairs
+    rank = {}
+    build = Workflow.build
+    def ranked_build(workflow, intervals):
+        build(workflow, intervals)
+        for group in workflow.groups:
+            rank.setdefault(group, len(rank))
+    monkeypatch.setattr(Workflow, "build", ranked_build)
+    monkeypatch.setattr(IntGroup, "__lt__",
+                        lambda self, other: rank[self] < rank[other])
+
+    built = _reduced(requestinss, lambda workflow: None)
+    reduced = _reduced(requestinss, Workflow.reduce)
+    assert reduced == _reduced(requestinss, _legacy_reduce)
+    assert sum(map(len, reduced.values())) < sum(map(len, built.values()))
+
+
+def test_interval_index_as_brute_force(driver, trace_folder):
+    requestinss = _load_data(trace_folder, driver)
+    df_ints_thread = generate_dataframes(requestinss)[5]
+    froms = df_ints_thread["from_seconds"].to_numpy()
+    tos = df_ints_thread["to_seconds"].to_numpy()
+    # and some violated intervals, indexed by their covered range
+    froms = np.append(froms, tos[:20])
+    tos = np.append(tos, froms[:20])
+    index = IntervalIndex(froms, tos)
+    assert len(froms) > IntervalIndex.LEAF_SIZE * 4
+
+    lows = np.minimum(froms, tos)
+    highs = np.maximum(froms, tos)
+    def brute_force(start, end):
+        return np.flatnonzero((lows <= end) & (highs >= start))
+
+    rand = np.random.RandomState(0)
+    first, last = lows.min(), highs.max()
+    edges = np.concatenate((lows[:50], highs[:50], [first, last]))
+    windows = [(first - 1, first - 0.5), (last + 0.5, last + 1),
+               (first - 1, last + 1)]
+    windows.extend((s, s) for s in edges)
+    windows.extend(zip(edges[:-1], edges[1:]))
+    for _ in range(200):
+        s, e = sorted(rand.uniform(first, last, 2))
+        windows.append((s, e))
+    for start, end in windows:
+        start, end = min(start, end), max(start, end)
+        assert list(index.window(start, end)) == \
+            list(brute_force(start, end)), (start, end)
@@ -25,7 +25,8 @@ from ..workflow.entities.join import CrossjoinActivity
 from ..workflow.entities.join import InnerjoinActivity
 from ..workflow.entities.join import RequestjoinActivity
 from .draw_engine import DrawEngine
-from .statistic_helper import projection_time
+from .statistic_helper import union_seconds
+from .statistics_engine import entities_of
 from .statistics_engine import generate_dataframes
 from .draw_engine import (REMOTE_C,
                           LOCALREMOTE_C,
@@ -36,17 +37,10 @@ from .draw_engine import (REMOTE_C,
 from .report import Report
 
 
-def f_dist(iterable, lim=None):
-    i_list = list(iterable)
-    if not i_list:
-        return "=0"
-    i_min = np.min(i_list)
-    i_max = np.max(i_list)
+def _format_dist(i_min, i_25, i_50, i_75, i_max, lim=None):
     if i_min == i_max:
         return "=%s" % i_min
 
-    i_25, i_50, i_75 = np.percentile(i_list, [25, 50, 75])
-
     if lim is not None:
         i_min = round(i_min, lim)
         i_max = round(i_max, lim)
@@ -57,6 +51,56 @@ def f_dist(iterable, lim=None):
     return "%s[%s|%s|%s]%s" % (i_min, i_25, i_50, i_75, i_max)
 
 
+def f_dist(iterable, lim=None):
+    i_list = list(iterable)
+    if not i_list:
+        return "=0"
+    i_min = np.min(i_list)
+    i_max = np.max(i_list)
+    if i_min == i_max:
+        return "=%s" % i_min
+
+    i_25, i_50, i_75 = np.percentile(i_list, [25, 50, 75])
+    return _format_dist(i_min, i_25, i_50, i_75, i_max, lim)
+
+
+def _quartiles(values, codes, len_groups):
+    # min, 25%, 50%, 75% and max of each group, interpolated linearly as
+    # np.percentile() does, in one sort of all values
+    order = np.lexsort((values, codes))
+    values = values[order]
+    counts = np.bincount(codes, minlength=len_groups)
+    starts = np.cumsum(counts) - counts
+    lasts = counts - 1
+
+    ret = [values[starts]]
+    for q in (0.25, 0.5, 0.75):
+        virtual = lasts * q
+        lower = np.floor(virtual)
+        gamma = virtual - lower
+        lower = starts + lower.astype(np.int64)
+        upper = np.minimum(lower + 1, starts + lasts)
+        a = values[lower]
+        diff = values[upper] - a
+        ret.append(np.where(gamma >= 0.5,
+                            values[upper] - diff * (1 - gamma),
+                            a + diff * gamma))
+    ret.append(values[starts + lasts])
+    return ret
+
+
+def dist_bygroup(df, key, column="lapse", lim=None):
+    """ Return {group: (sum, f_dist())} of df[column] grouped by df[key]. """
+    if not len(df):
+        return {}
+    codes, groups = pd.factorize(df[key])
+    values = df[column].to_numpy()
+    sums = np.bincount(codes, weights=values, minlength=len(groups))
+    stats = _quartiles(values, codes, len(groups))
+    return {group: (sums[i], _format_dist(*[s[i] for s in stats], lim=lim))
+            for i, group in enumerate(groups)}
+
+
 def generate_reports(name, master_graph,
                      requestinss_byrtype,
                      targetobjs_by_target,
@@ -64,7 +108,8 @@ def generate_reports(name, master_graph,
                      start_end,
                      join_intervals_df, td_intervals_df,
                      request_df, targets_df,
-                     request_vars_df):
+                     request_vars_df,
+                     entities=None):
     assert isinstance(name, str)
     assert isinstance(master_graph, Master)
 
@@ -89,7 +134,8 @@ def generate_reports(name, master_graph,
                         targetobjs_by_component.get(comp, []))))
 
     report_r.register("threads",
-            sum(len(t.thread_objs) for t in targets_df._entity))
+            sum(len(t.thread_objs)
+                for t in entities_of(targets_df._entity, entities)))
 
     for comp in comps:
         report_r.register("threads %s dist" % comp,
@@ -97,10 +143,12 @@ def generate_reports(name, master_graph,
                         targetobjs_by_component.get(comp, [])]))
 
     report_r.register("threadinss",
-            sum(len(r.threadinss) for r in request_df._entity))
+            sum(len(r.threadinss)
+                for r in entities_of(request_df._entity, entities)))
 
     report_r.register("paces",
-            sum(r.len_paces for r in request_df._entity))
+            sum(r.len_paces
+                for r in entities_of(request_df._entity, entities)))
 
     lapse_total = start_end["seconds"]["end"] - start_end["seconds"]["start"]
     report_r.register("lapse", lapse_total)
@@ -150,6 +198,14 @@ def generate_reports(name, master_graph,
     mainremoteljoins_df = mainjoins_df[mainjoins_df["remote_type"]=="local_remote"]
     mainremotejoins_df = mainjoins_df[mainjoins_df["remote_type"]=="remote"]
 
+    maintdints_df = td_intervals_df[td_intervals_df["is_main"]==True]
+    dist_bymaincomp = dist_bygroup(maintdints_df, "component", lim=9)
+    dists_byjtype = [(j_type, dist_bygroup(df, "request_type", lim=9))
+                     for j_type, df in (("local", mainlocaljoins_df),
+                                        ("remote_l", mainremoteljoins_df),
+                                        ("remote_r", mainremotejoins_df),
+                                        ("nest", mainnested_df))]
+
     for r_type in r_types:
         report_r.register("%s td_ints" % r_type,
                 td_intervals_df["request_type"].value_counts().get(r_type, 0))
@@ -170,32 +226,15 @@ def generate_reports(name, master_graph,
 
         cumulated = sum(r.lapse for r in requestinss_byrtype.get(r_type, []))
 
-        maintdints_df = td_intervals_df[td_intervals_df["is_main"]==True]
         for comp in comps:
-            _df = maintdints_df[maintdints_df["component"] == comp]["lapse"]
+            _sum, _dist = dist_bymaincomp.get(comp, (0, "=0"))
             report_r.register("%s %s dist:" % (r_type, comp),
-                    ("%6.2f%% " % (_df.sum()/cumulated*100))
-                    + f_dist([v for v in _df], 9))
-
-        _df = mainlocaljoins_df[mainlocaljoins_df["request_type"]==r_type]["lapse"]
-        report_r.register("%s local" % r_type,
-                ("%6.2f%% " % (_df.sum()/cumulated*100))
-                + f_dist([v for v in _df], 9))
+                    ("%6.2f%% " % (_sum/cumulated*100)) + _dist)
 
-        _df = mainremoteljoins_df[mainremoteljoins_df["request_type"]==r_type]["lapse"]
-        report_r.register("%s remote_l" % r_type,
-                ("%6.2f%% " % (_df.sum()/cumulated*100))
-                + f_dist([v for v in _df], 9))
-
-        _df = mainremotejoins_df[mainremotejoins_df["request_type"]==r_type]["lapse"]
-        report_r.register("%s remote_r" % r_type,
-                ("%6.2f%% " % (_df.sum()/cumulated*100))
-                + f_dist([v for v in _df], 9))
-
-        _df = mainnested_df[mainnested_df["request_type"]==r_type]["lapse"]
-        report_r.register("%s nest" % r_type,
-                ("%6.2f%% " % (_df.sum()/cumulated*100))
-                + f_dist([v for v in _df], 9))
+        for j_type, dist_byrtype in dists_byjtype:
+            _sum, _dist = dist_byrtype.get(r_type, (0, "=0"))
+            report_r.register("%s %s" % (r_type, j_type),
+                    ("%6.2f%% " % (_sum/cumulated*100)) + _dist)
 
     #####  interval statistics  #####
     report_i = Report("Intervals")
@@ -203,7 +242,7 @@ def generate_reports(name, master_graph,
     all_intervals_df = pd.concat([td_intervals_df, join_intervals_df],
                                  join="inner", ignore_index=True)
     main_intervals_df = all_intervals_df[all_intervals_df["is_main"]==True]
-    intsbypath_df = main_intervals_df.groupby("path")
+    intsbypath_df = main_intervals_df.groupby("path", observed=True)
     desc_bypath = {}
     for p_type, e_df in intsbypath_df:
         if len(e_df):
@@ -237,11 +276,10 @@ def generate_reports(name, master_graph,
 
     report_i.register("Projection", None)
     projection_result = []
-    for p_type, e_df in intsbypath_df:
-        from_tos = [(r[1]["from_seconds"],
-                     r[1]["to_seconds"])
-                    for r in e_df.iterrows()]
-        p_t = projection_time(from_tos)
+    from_seconds = main_intervals_df["from_seconds"].to_numpy()
+    to_seconds = main_intervals_df["to_seconds"].to_numpy()
+    for p_type, indexes in intsbypath_df.indices.items():
+        p_t = union_seconds(from_seconds[indexes], to_seconds[indexes])
         concurrent_ratio = addedup_by_ptype[p_type]/p_t
         projection_result.append((concurrent_ratio, p_t, p_type))
     projection_result.sort(reverse=True)
@@ -259,7 +297,8 @@ def generate_graph(d_engine,
                    start_end,
                    join_intervals_df, td_intervals_df,
                    request_df, targets_df,
-                   request_vars_df):
+                   request_vars_df,
+                   entities=None):
     alljoins_df = join_intervals_df[join_intervals_df["int_type"]!=RequestjoinActivity.__name__]
     all_intervals_df = pd.concat([td_intervals_df, join_intervals_df],
                                  join="inner", ignore_index=True)
@@ -267,7 +306,7 @@ def generate_graph(d_engine,
     # 1. host remote relations heatmap
     crosshost_relations_df = alljoins_df\
             .loc[alljoins_df["remote_type"] != "local"]\
-            .groupby(["from_host", "to_host"])\
+            .groupby(["from_host", "to_host"], observed=True)\
             .size()\
             .unstack()\
             .fillna(0)\
@@ -280,13 +319,13 @@ def generate_graph(d_engine,
     # 2. component local relations per target heatmap
     componentlocal_relations_df = alljoins_df\
             [alljoins_df["remote_type"]=="local"]\
-            .groupby(["from_target", "to_target"])\
+            .groupby(["from_target", "to_target"], observed=True)\
             .size()\
             .reset_index()\
             .join(targets_df, on="from_target")\
             .join(targets_df, on="to_target",
                   lsuffix="_from", rsuffix="_to")\
-            .groupby(["component_from", "component_to"])\
+            .groupby(["component_from", "component_to"], observed=True)\
             .mean()\
             .unstack()
     componentlocal_relations_df.index.name = "from_component"
@@ -299,13 +338,13 @@ def generate_graph(d_engine,
     # 3. component remote relations per target heatmap
     componentremote_relations_df = alljoins_df\
             [alljoins_df["remote_type"]!="locol"]\
-            .groupby(["from_target", "to_target"])\
+            .groupby(["from_target", "to_target"], observed=True)\
             .size()\
             .reset_index()\
             .join(targets_df, on="from_target")\
             .join(targets_df, on="to_target",
                     lsuffix="_from", rsuffix="_to")\
-            .groupby(["component_from", "component_to"])\
+            .groupby(["component_from", "component_to"], observed=True)\
             .mean()\
             .unstack()
     componentremote_relations_df.index.name = "from_component"
@@ -333,16 +372,16 @@ def generate_graph(d_engine,
                 "request_threadinss")
 
     # 8. longest lapse requestins plot
-    longestlapse_req = request_df\
+    longestlapse_req, = entities_of([request_df\
             .loc[request_df["lapse"].idxmax()]\
-            ["_entity"]
+            ["_entity"]], entities)
     d_engine.draw_requestins(longestlapse_req,
             "longest_lapse_requestins", start_end)
 
     # 9. longest paces requestins plot
-    longestpaces_req = request_df\
+    longestpaces_req, = entities_of([request_df\
             .loc[request_df["len_paces"].idxmax()]\
-            ["_entity"]
+            ["_entity"]], entities)
     d_engine.draw_requestins(longestpaces_req,
             "longest_paces_requestins", start_end)
 
@@ -357,7 +396,7 @@ def generate_graph(d_engine,
                 "path", "lapse", hue="remote_type", palette=palette)
 
     # 11. top 5 slowest thread intervals by host boxplot
-    ordered_x = td_intervals_df.groupby("path")["lapse"].median()
+    ordered_x = td_intervals_df.groupby("path", observed=True)["lapse"].median()
     ordered_x.sort_values(ascending=False, inplace=True)
     ordered_x = ordered_x.keys()
     lim = min(len(ordered_x), 5)
@@ -368,11 +407,12 @@ def generate_graph(d_engine,
                               color=to_draw.iloc[0]["component"].color)
 
     palette_path = {}
-    for r in chain(td_intervals_df.iterrows(),
-                   join_intervals_df.iterrows()):
-        r = r[1]
-        palette_path[r["path"]] = getcolor_byint(r["_entity"],
-                ignore_lr=True)
+    for df in (td_intervals_df, join_intervals_df):
+        lasts = df.drop_duplicates("path", keep="last")
+        for path, entity in zip(lasts["path"],
+                                entities_of(lasts["_entity"], entities)):
+            palette_path[path] = getcolor_byint(entity,
+                    ignore_lr=True)
     # 12. thread intervals lapse by path box/violinplot
     d_engine.draw_boxplot(td_intervals_df, "tdints_lapse_bypath",
             "path", "lapse", palette=palette_path)
@@ -402,11 +442,12 @@ def do_statistics(name, master_graph, requestinss, d_engine, out_file):
         return
 
     print("Preparing dataframes...")
-    ret = generate_dataframes(requestinss)
+    entities = []
+    ret = generate_dataframes(requestinss, entities)
 
     print("Generate reports...")
     report_r, report_i = generate_reports(
-            name, master_graph, *ret)
+            name, master_graph, *ret, entities=entities)
     if out_file:
         report_r.set_outfile(out_file, True)
     print()
@@ -419,4 +460,5 @@ def do_statistics(name, master_graph, requestinss, d_engine, out_file):
 
     #####  visualization  #####
     if d_engine:
-        generate_graph(d_engine, *ret)
+        with d_engine.deferred():
+            generate_graph(d_engine, *ret, entities=entities)
@@ -17,11 +17,18 @@ from __future__ import print_function
 from collections import defaultdict
 from collections import OrderedDict
 from contextlib import contextmanager
+from functools import wraps
 import heapq
+import inspect
 from itertools import chain
+import multiprocessing
+import time
+import traceback
 import matplotlib
 matplotlib.use('Agg')
+from matplotlib import colors as mcolors
 from matplotlib import patches as mpatches
+from matplotlib.collections import LineCollection
 from matplotlib import pyplot as plt
 import numpy as np
 import pandas as pd
@@ -43,6 +50,11 @@ LOCAL_C = "#fade00"
 INTERFACE_C = "#a82511"
 NESTED_C = "#ff3719"
 
+# draw_intervalvisual() draws every interval only for small windows,
+# otherwise the occupancy of thread rows is aggregated by pixels
+DETAIL_MAX_INTS = 2000
+DETAIL_MAX_ROWS = 200
+
 
 def getcolor_byint(interval, ignore_lr=False):
     if isinstance(interval, ThreadActivity) or \
@@ -193,13 +205,143 @@ def _prepare_thread_indexes(thread_objs, plot_main=False):
     return y_indexes_l, y_indexes_r, threadobjs_y, targets_y
 
 
+def _bin_occupancy(rows, froms, tos, len_rows, len_bins):
+    # the covered ratio of each bin, froms and tos are in bins; the ramps
+    # of interval ends are summed as impulses, then integrated by cumsum
+    froms = np.clip(froms, 0, len_bins)
+    tos = np.clip(tos, froms, len_bins)
+    width = len_bins + 2
+    impulses = np.zeros(len_rows * width)
+    for ends, sign in ((froms, 1), (tos, -1)):
+        bins = np.floor(ends).astype(np.int64)
+        ratios = ends - bins
+        base = rows * width + bins
+        impulses += np.bincount(base, weights=sign * (1 - ratios),
+                                minlength=len(impulses))
+        impulses += np.bincount(base + 1, weights=sign * ratios,
+                                minlength=len(impulses))
+    occupancy = np.cumsum(impulses.reshape(len_rows, width), axis=1)
+    return np.clip(occupancy[:, :len_bins], 0, 1)
+
+
+def _deferrable(func):
+    # queue the figure while the engine is deferred
+    @wraps(func)
+    def _draw(self, *args, **kwds):
+        if self._jobs is not None:
+            self._jobs.append((func, args, kwds))
+        else:
+            func(self, *args, **kwds)
+    return _draw
+
+
+def _job_name(job):
+    func, args, kwds = job
+    try:
+        name = inspect.signature(func).bind(None, *args, **kwds)\
+                .arguments.get("name")
+    except TypeError:
+        name = None
+    if name is None:
+        return func.__name__
+    return "%s %s" % (func.__name__, name)
+
+
+def _render(engine, job):
+    func, args, kwds = job
+    start = time.time()
+    try:
+        func(engine, *args, **kwds)
+    except Exception as e:
+        traceback.print_exc()
+        plt.close("all")
+        return time.time() - start, "%s: %s" % (e.__class__.__name__, e)
+    return time.time() - start, None
+
+# parallel render: each worker saves its figures to out_path by itself, so
+# nothing drawn is sent back, only the time and the error of each figure.
+# Workers are forked after _pool_jobs is set, the jobs are bound to request
+# and interval entities which are inherited rather than pickled.
+_pool_engine = None
+_pool_jobs = None
+
+def _render_inpool(index):
+    _pool_engine._jobs = None
+    return (index,) + _render(_pool_engine, _pool_jobs[index])
+
+def _use_pool(processes, jobs):
+    return processes and processes > 1 and len(jobs) > 1 \
+        and "fork" in multiprocessing.get_all_start_methods()
+
+def _yield_rendered_parallel(engine, jobs, processes):
+    global _pool_engine
+    global _pool_jobs
+    ctx = multiprocessing.get_context("fork")
+    _pool_engine = engine
+    _pool_jobs = jobs
+    pool = ctx.Pool(min(processes, len(jobs)))
+    try:
+        for ret in pool.imap_unordered(_render_inpool, range(len(jobs))):
+            yield ret
+    finally:
+        pool.terminate()
+        pool.join()
+        _pool_engine = None
+        _pool_jobs = None
+
+
 class DrawEngine(object):
-    def __init__(self, out_path):
+    def __init__(self, out_path, processes=None):
         if not out_path:
             self.out_path = None
         else:
             assert isinstance(out_path, str)
             self.out_path = out_path
+        self.processes = processes
+        self._jobs = None
+
+    @contextmanager
+    def deferred(self):
+        """ Queue the figures drawn inside, then render them together,
+        in a pool of processes if there are several. A failed figure is
+        reported without stopping the others. """
+        if not self.out_path or self._jobs is not None:
+            yield
+            return
+
+        self._jobs = []
+        try:
+            yield
+            jobs = self._jobs
+        finally:
+            self._jobs = None
+        if not jobs:
+            return
+
+        if _use_pool(self.processes, jobs):
+            print("(DrawEngine) render %d figures (%d processes)..."
+                    % (len(jobs), min(self.processes, len(jobs))))
+            rendered = _yield_rendered_parallel(self, jobs, self.processes)
+        else:
+            print("(DrawEngine) render %d figures..." % len(jobs))
+            rendered = ((i,) + _render(self, job)
+                        for i, job in enumerate(jobs))
+
+        failed = []
+        for cnt, (index, lapse, error) in enumerate(rendered):
+            name = _job_name(jobs[index])
+            if error is None:
+                print("(DrawEngine) %d/%d %s: %.2fs"
+                        % (cnt+1, len(jobs), name, lapse))
+            else:
+                print("(DrawEngine) %d/%d %s: FAILED %s"
+                        % (cnt+1, len(jobs), name, error))
+                failed.append(name)
+        if failed:
+            print("! WARN !")
+            print("%d/%d figures failed: %s" % (
+                len(failed), len(jobs), ", ".join(failed)))
+            print()
 
     @contextmanager
     def _build_fig(self, figtype, figname,
@@ -238,6 +380,7 @@ class DrawEngine(object):
             print("ok")
 
 
+    @_deferrable
     def draw_relation_heatmap(self, relation_df, name, fmt="d"):
         assert isinstance(relation_df, pd.DataFrame)
         assert isinstance(name, str)
@@ -296,11 +439,12 @@ class DrawEngine(object):
             ax_l.set_xticklabels([""]*l_col)
             ax_l.set_xlabel("")
 
+    @_deferrable
     def draw_boxplot(self, to_draw, name, x, y,
                      hue=None,
                      palette=None, color=None,
                      violin=True):
-        x_groups = to_draw.groupby(x)[y]
+        x_groups = to_draw.groupby(x, observed=True)[y]
         ordered_x = x_groups.median().sort_values(ascending=False).index
         desc_max = 0
         for _x in ordered_x:
@@ -318,7 +462,7 @@ class DrawEngine(object):
 
         fig_wid = len(ordered_x)*0.3
         if hue is not None:
-            fig_wid *= len(to_draw.groupby(hue))
+            fig_wid *= len(to_draw.groupby(hue, observed=True))
 
         def _interact(x, draw_violin):
             with self._build_fig("boxplot", name,
@@ -371,12 +515,14 @@ class DrawEngine(object):
             display(w_box, out)
 
 
+    @_deferrable
     def draw_distplot(self, to_draw, name):
         with self._build_fig("distplot", name) as fig:
             ax = fig.add_subplot(1,1,1)
             ax.set_ylabel("count")
             sns.distplot(to_draw, ax=ax, kde=False, color="#86d7f5")
 
+    @_deferrable
     def draw_countplot(self, to_draw, name):
         with self._build_fig("countplot", name) as fig:
             ax = sns.countplot(to_draw, color="#86d7f5")
@@ -388,6 +534,7 @@ class DrawEngine(object):
                         '{:.2f}%'.format(height/total*100),
                         ha="center")
 
+    @_deferrable
     def draw_kdeplot(self, s_x, s_y, name):
         with self._build_fig("kdeplot", name, figsize=(15, 7)) as fig:
             cmap = sns.cubehelix_palette(
@@ -396,6 +543,7 @@ class DrawEngine(object):
             ax.set_xlim(s_x.min(), s_x.max())
             ax.set_ylim(0, s_y.max())
 
+    @_deferrable
     def draw_requestins(self, requestins, name, start_end=None):
         assert isinstance(requestins, RequestInstance)
 
@@ -413,8 +561,11 @@ class DrawEngine(object):
                                  plot_main=True,
                                  title=repr(requestins))
 
+    @_deferrable
     def draw_intervalvisual(self, threadinss, joinints, name, start_end,
-                            plot_main=False, title=None):
+                            plot_main=False, title=None, detail=None):
+        """ Draw the intervals by thread rows. If detail is None, every
+        interval is drawn and annotated only if the window is small. """
         # prepare requests
         start = start_end["seconds"]["start"]
         last = start_end["seconds"]["last"]
@@ -435,6 +586,17 @@ class DrawEngine(object):
         y_indexes_l, y_indexes_r, tos_y, targets_y =\
                 _prepare_thread_indexes(thread_objs, plot_main)
 
+        if detail is None:
+            len_ints = len(joinints)\
+                    + sum(ti.len_activities for ti in threadinss)
+            detail = len_ints <= DETAIL_MAX_INTS\
+                    and len(y_indexes_l) <= DETAIL_MAX_ROWS
+        if not detail:
+            self._draw_intervalbins(threadinss, joinints, name, start_end,
+                                    plot_main, title,
+                                    y_indexes_l, tos_y, targets_y)
+            return
+
         #### settings ####
         annot_off_x_lim = 0.005
         annot_off_y = 0.18
@@ -630,6 +792,97 @@ class DrawEngine(object):
             ax.plot([start, last], [.5, .5], 'r*')
 
 
+    def _draw_intervalbins(self, threadinss, joinints, name, start_end,
+                           plot_main, title, y_indexes_l, tos_y, targets_y):
+        start = start_end["seconds"]["start"]
+        last = start_end["seconds"]["last"]
+        start_t = start_end["time"]["start"]
+        last_t = start_end["time"]["last"]
+        last_plot = last + (last - start) * 0.05
+        len_rows = len(y_indexes_l)
+
+        rows = []
+        froms = []
+        tos = []
+        main_segs = []
+        main_colors = []
+        for ti in threadinss:
+            plot_y = tos_y[ti.thread_obj]
+            for int_ in ti.iter_ints():
+                rows.append(plot_y)
+                froms.append(int_.from_seconds)
+                tos.append(int_.to_seconds)
+                if plot_main and int_.is_main:
+                    main_segs.append([(int_.from_seconds, 1),
+                                      (int_.to_seconds, 1)])
+                    main_colors.append(getcolor_byint(int_))
+        join_segs = []
+        join_colors = []
+        for int_ in joinints:
+            join_segs.append([(int_.from_seconds, tos_y[int_.from_threadobj]),
+                              (int_.to_seconds, tos_y[int_.to_threadobj])])
+            join_colors.append(getcolor_byint(int_))
+            if plot_main and int_.is_main:
+                main_segs.append([(int_.from_seconds, 1),
+                                  (int_.to_seconds, 1)])
+                main_colors.append(getcolor_byint(int_))
+
+        # rows are at least a pixel high
+        figsize = (30, min(.5*len_rows, max(10., len_rows/50.)))
+        with self._build_fig("intplot", name,
+                figsize=figsize, title=title) as fig:
+            ax = fig.add_subplot(1,1,1)
+            ax.set_xlabel("lapse (seconds)")
+            ax.set_ylabel("target")
+            ax.set_xlim(start, last_plot)
+            ax.set_ylim(.5, len_rows-0.5)
+
+            # label targets rather than threads
+            ticks = []
+            labels = []
+            lower = 1 + int(bool(plot_main))
+            for t_y in targets_y:
+                ticks.append((lower + t_y - .5) / 2.)
+                labels.append(y_indexes_l[int(t_y - .5)].rsplit("|td", 1)[0])
+                lower = t_y + .5
+            ax.set_yticks(ticks)
+            ax.set_yticklabels(labels)
+            for t_y in targets_y:
+                ax.axhline(t_y, linestyle=":", color="#d0d0d0", linewidth=1)
+
+            # 1. thread occupancy, an image of pixel bins
+            len_bins = max(1, int(fig.get_figwidth() * fig.dpi))
+            bin_lapse = (last_plot - start) / len_bins
+            if rows and bin_lapse > 0:
+                occupancy = _bin_occupancy(
+                        np.array(rows),
+                        (np.array(froms) - start) / bin_lapse,
+                        (np.array(tos) - start) / bin_lapse,
+                        len_rows, len_bins)
+                image = np.zeros((len_rows, len_bins, 4))
+                for to, plot_y in tos_y.items():
+                    image[plot_y, :, :3] = mcolors.to_rgb(to.component.color)
+                image[:, :, 3] = occupancy
+                ax.imshow(image, aspect="auto", origin="lower",
+                          interpolation="nearest", zorder=2,
+                          extent=(start, last_plot, -.5, len_rows-.5))
+
+            # 2. join intervals under the rows, fainter if there are more
+            if join_segs:
+                ax.add_collection(LineCollection(
+                    join_segs, colors=join_colors, linewidths=.5,
+                    alpha=min(.5, 100./len(join_segs)), zorder=1))
+            # 3. main intervals
+            if main_segs:
+                ax.axhline(1.5, color="#d0d0d0", linewidth=1)
+                ax.add_collection(LineCollection(
+                    main_segs, colors=main_colors, linewidths=3, zorder=3))
+
+            ax.annotate(start_t, xy=(start, .5), xytext=(start, 0.5))
+            ax.annotate(last_t, xy=(last, .5), xytext=(last, 0.5))
+            ax.plot([start, last], [.5, .5], 'r*')
+
+    @_deferrable
     def draw_workflow(self, start_end, workflow, name):
         assert isinstance(workflow, Workflow)
 
@@ -751,6 +1004,7 @@ class DrawEngine(object):
             display(w_tab, out)
 
 
+    @_deferrable
     def draw_profiling(self, start_end, reqinss, name):
         start_s = start_end["seconds"]["start"]
         last_s = start_end["seconds"]["last"]
@@ -844,6 +1098,7 @@ class DrawEngine(object):
             ax.set_xlabel("lapse (seconds)")
 
     #### others ####
+    @_deferrable
     def draw_threadobj(self, thread_obj):
         print("(DrawEngine) drawing %s..." % thread_obj.name)
 
@@ -890,6 +1145,7 @@ class DrawEngine(object):
         print("ok")
 
 
+    @_deferrable
     def draw_debug_groups(self, requests, threadgroup):
         print("(DrawEngine) drawing %s..." % requests)
 
@@ -1087,6 +1343,7 @@ class DrawEngine(object):
         fig.savefig(self.out_path + "debuggroupplot.png")
         print("ok")
 
+    @_deferrable
     def draw_target(self, target_obj):
         assert isinstance(target_obj, Target)
 
@@ -9,7 +9,9 @@ from ..workflow.entities.join import RequestjoinActivity
 from ..workflow.entities.request import RequestInstance
 
 from .automated_suite import generate_reports
+from .statistics_engine import entities_of
 from .statistics_engine import generate_dataframes
+from .statistic_helper import IntervalIndex
 from .draw_engine import DrawEngine
 from .draw_engine import getcolor_byint
 from .draw_engine import (REMOTE_C, LOCALREMOTE_C, LOCAL_C)
@@ -22,7 +24,9 @@ class Requests_D(object):
         self._draw_engine = DrawEngine(None)
         self._requestins_byreq = requestins_byreq
 
-        ret = generate_dataframes(requestins_byreq)
+        # "_entity" columns are ids in _entities
+        self._entities = []
+        ret = generate_dataframes(requestins_byreq, self._entities)
         (requestinss_bytype,
          targetobjs_bytarget,
          self._workflow_bytype,
@@ -62,7 +66,25 @@ class Requests_D(object):
         df_ints_join = df_ints_join_all[df_ints_join_all["int_type"]!=RequestjoinActivity.__name__]
         self._intervals_d = Intervals_D(
                 "Ints<<"+self.name, self, None, df_ints_thread, df_ints_join)
-        (self._report_r, self._report_i) = generate_reports(name, graph, *ret)
+        (self._report_r, self._report_i) = generate_reports(
+                name, graph, *ret, entities=self._entities)
+
+        # time indexes for window queries, in the reset seconds
+        self._df_ints_thread = df_ints_thread
+        self._df_ints_join = df_ints_join
+        self._index_requests = IntervalIndex(
+                self.df_requests["from_seconds"],
+                np.maximum(self.df_requests["to_seconds"],
+                           self.df_requests["last_seconds"]))
+        self._index_ints_thread = IntervalIndex(
+                df_ints_thread["from_seconds"], df_ints_thread["to_seconds"])
+        self._index_ints_join = IntervalIndex(
+                df_ints_join["from_seconds"], df_ints_join["to_seconds"])
+        self._threadinss = [ti for req in self._requestins_byreq.values()
+                               for ti in req.threadinss]
+        self._index_threadinss = IntervalIndex(
+                [ti.from_seconds for ti in self._threadinss],
+                [ti.to_seconds for ti in self._threadinss])
 
     @property
     def Intervals(self):
@@ -155,33 +177,33 @@ class Requests_D(object):
 
     def find_req_byname(self, name):
         try:
-            req = self.df_requests.loc[name]["_entity"]
+            req = self._entities[self.df_requests.loc[name]["_entity"]]
         except KeyError:
             raise KeyError("Cannot find request %s in %s" % (name, self.name))
         return Request_D(req, "%s<<%s" % (name, self.name))
 
     def find_req_longest(self):
-        req = self.df_requests\
+        req = self._entities[self.df_requests\
                 .loc[self.df_requests["lapse"].idxmax()]\
-                ["_entity"]
+                ["_entity"]]
         return Request_D(req, "longest<<%s" % self.name)
 
     def find_req_shortest(self):
-        req = self.df_requests\
+        req = self._entities[self.df_requests\
                 .loc[self.df_requests["lapse"].idxmin()]\
-                ["_entity"]
+                ["_entity"]]
         return Request_D(req, "shortest<<%s" % self.name)
 
     def find_req_mostcomplex(self):
-        req = self.df_requests\
+        req = self._entities[self.df_requests\
                 .loc[self.df_requests["len_paces"].idxmax()]\
-                ["_entity"]
+                ["_entity"]]
         return Request_D(req, "mostcomplex<<%s" % self.name)
 
     def find_req_simplest(self):
-        req = self.df_requests\
+        req = self._entities[self.df_requests\
                 .loc[self.df_requests["len_paces"].idxmin()]\
-                ["_entity"]
+                ["_entity"]]
         return Request_D(req, "simplest<<%s" % self.name)
 
     def list_req_names(self):
@@ -198,6 +220,67 @@ class Requests_D(object):
             return
         return sorted(self.df_request_vars[key].unique())
 
+    def window(self, start, end=None):
+        """ Find the requests, intervals and thread instances running in
+        [start, end] seconds, or at start if end is None. """
+        if end is None:
+            end = start
+        if start > end:
+            raise ValueError("Window start %s is after end %s" % (start, end))
+        return Window_D(
+                "window(%s, %s)<<%s" % (start, end, self.name),
+                self, start, end,
+                self.df_requests.iloc[self._index_requests.window(start, end)],
+                self._df_ints_thread.iloc[
+                    self._index_ints_thread.window(start, end)],
+                self._df_ints_join.iloc[
+                    self._index_ints_join.window(start, end)],
+                [self._threadinss[i]
+                 for i in self._index_threadinss.window(start, end)])
+
+
+class Window_D(object):
+    def __init__(self, name, requests_d, start, end,
+                 df_requests, df_ints_thread, df_ints_join, threadinss):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.df_requests = df_requests
+        self.threadinss = threadinss
+        self._requests_d = requests_d
+        self._df_ints_join = df_ints_join
+        self._intervals_d = Intervals_D(
+                "Ints<<"+self.name, requests_d, requests_d.Intervals._palettes,
+                df_ints_thread, df_ints_join)
+
+    @property
+    def Intervals(self):
+        return self._intervals_d
+
+    def list_req_names(self):
+        return self.df_requests.index
+
+    def __repr__(self):
+        return "<Window %s: num_reqs=%d, num_ints=%d, num_threadinss=%d>" % (
+                self.name, len(self.df_requests),
+                len(self._intervals_d.df_ints), len(self.threadinss))
+
+    def _ipython_display_(self):
+        print(repr(self))
+        self.display_intervals()
+
+    def display_intervals(self):
+        joinints = entities_of(self._df_ints_join["_entity"],
+                               self._requests_d._entities)
+        start_end = {"seconds": {"start": self.start,
+                                 "end": self.end,
+                                 "last": self.end},
+                     "time":    {"start": "%.6f" % self.start,
+                                 "end": "%.6f" % self.end,
+                                 "last": "%.6f" % self.end}}
+        self._requests_d._draw_engine.draw_intervalvisual(
+                self.threadinss, joinints, self.name, start_end)
+
 
 class Request_D(object):
     def __init__(self, requestins, name):
@@ -239,16 +322,19 @@ class BaseIntervals_D(object):
         if palettes is None:
             palettes = {}
             palettes_desc = {}
-            for r in df_ints.iterrows():
-                row = r[1]
-                palettes_desc[row["desc"]] = getcolor_byint(
-                        row["_entity"], ignore_lr=True)
+            # the last interval of each kind decides the color
+            lasts = df_ints.drop_duplicates("desc", keep="last")
+            for desc, entity in zip(lasts["desc"], entities_of(
+                    lasts["_entity"], requests_d._entities)):
+                palettes_desc[desc] = getcolor_byint(
+                        entity, ignore_lr=True)
             palettes["desc"] = palettes_desc
             palettes_iname = {}
-            for r in df_ints.iterrows():
-                row = r[1]
-                palettes_iname[row["int_name"]] = getcolor_byint(
-                        row["_entity"], ignore_lr=True)
+            lasts = df_ints.drop_duplicates("int_name", keep="last")
+            for int_name, entity in zip(lasts["int_name"], entities_of(
+                    lasts["_entity"], requests_d._entities)):
+                palettes_iname[int_name] = getcolor_byint(
+                        entity, ignore_lr=True)
             palettes["iname"] = palettes_iname
             palettes_rtype = {}
             palettes_rtype["local"] = LOCAL_C
@@ -476,7 +562,7 @@ class JoinIntervals_D(BaseIntervals_D):
     def __init__(self, name, requests_d, palettes, df_ints_join):
         self._df_rel_host = df_ints_join\
                 .loc[df_ints_join["remote_type"] != "local"]\
-                .groupby(["from_host", "to_host"])\
+                .groupby(["from_host", "to_host"], observed=True)\
                 .size()\
                 .unstack()\
                 .fillna(0)\
@@ -486,13 +572,13 @@ class JoinIntervals_D(BaseIntervals_D):
 
         self._df_rel_component = df_ints_join\
                 [df_ints_join["remote_type"]!="locol"]\
-                .groupby(["from_target", "to_target"])\
+                .groupby(["from_target", "to_target"], observed=True)\
                 .size()\
                 .reset_index()\
                 .join(requests_d.df_targets, on="from_target")\
                 .join(requests_d.df_targets, on="to_target",
                         lsuffix="_from", rsuffix="_to")\
-                .groupby(["component_from", "component_to"])\
+                .groupby(["component_from", "component_to"], observed=True)\
                 .mean()\
                 .unstack()
         self._df_rel_component.index.name = "from_component"
@@ -15,6 +15,7 @@
 from __future__ import print_function
 
 from collections import defaultdict
+from collections import OrderedDict
 from functools import total_ordering
 import numpy as np
 from itertools import chain
@@ -25,25 +26,30 @@ from ..workflow.entities.join import JoinActivityBase
 from ..workflow.entities.request import ExtendedInterval
 
 
+def union_seconds(from_seconds, to_seconds):
+    """ The length of the union of intervals, as arrays of seconds. """
+    from_seconds = np.asarray(from_seconds, dtype=np.float64)
+    to_seconds = np.asarray(to_seconds, dtype=np.float64)
+    if not from_seconds.size:
+        return 0
+    order = np.lexsort((to_seconds, from_seconds))
+    from_seconds = from_seconds[order]
+    ends = np.maximum.accumulate(to_seconds[order])
+
+    # a new span starts after the end of all previous intervals
+    is_start = np.empty(len(from_seconds), dtype=bool)
+    is_start[0] = True
+    np.greater(from_seconds[1:], ends[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    lasts = np.append(starts[1:] - 1, len(ends) - 1)
+    return sum((ends[lasts] - from_seconds[starts]).tolist())
+
+
 def projection_time(from_tos):
-    from_tos.sort()
-
-    total = 0
-    start = None
-    end = None
-    for from_, to_ in from_tos:
-        if start is None:
-            start = from_
-            end = to_
-        elif from_ <= end:
-            end = max(end, to_)
-        else:
-            total += (end-start)
-            start = from_
-            end = to_
-    if start is not None:
-        total += (end-start)
-    return total
+    if not from_tos:
+        return 0
+    from_tos = np.asarray(from_tos, dtype=np.float64)
+    return union_seconds(from_tos[:, 0], from_tos[:, 1])
 
 
 @total_ordering
@@ -99,8 +105,8 @@ class IntGroup(object):
     def projection_seconds(self):
         if not self.intervals:
             return 0
-        from_tos = [(c.from_seconds, c.to_seconds) for c in self.intervals]
-        return projection_time(from_tos)
+        return union_seconds([c.from_seconds for c in self.intervals],
+                             [c.to_seconds for c in self.intervals])
 
     @property
     def is_inlink(self):
@@ -198,8 +204,10 @@ class Workflow(object):
         self.len_intervals = 0
         self.reqs = []
 
-        # for build
-        self._group_byreq = {}
+        # for build, groups are a trie of (from_group, to_edgename)
+        self._group_bytransition = {}
+        # (depth, first request) of groups, the order of the lock-step build
+        self._rank_bygroup = {}
 
         # for reduce
         self.paths = {}
@@ -208,17 +216,42 @@ class Workflow(object):
     def len_reqs(self):
         return len(self.reqs)
 
+    def _new_group(self, interval):
+        if isinstance(interval, ThreadActivity):
+            weight = interval.state.vis_weight
+        elif isinstance(interval, JoinActivityBase):
+            weight = interval.join_obj.vis_weight
+        elif isinstance(interval, ExtendedInterval):
+            weight = interval.component.vis_weight
+        else:
+            raise RuntimeError("Illegal interval %r" % interval)
+        desc = "%s: %s -> %s" % (
+                interval.path,
+                interval.from_keyword,
+                interval.to_keyword)
+        return IntGroup(interval.int_name,
+                        interval.from_edgename,
+                        interval.to_edgename,
+                        weight,
+                        desc)
+
+    def _add_group(self, from_group, group, rank):
+        from_group.append_group(group)
+        self._group_bytransition[(from_group, group.to_edgename)] = group
+        self._rank_bygroup[group] = rank
+        self.groups.add(group)
+        self.paths[group.path] = group.vis_weight
+
     def build(self, intervals):
-        group_by_fromgroup_toedgename = {}
-        newgroup_byreq = {}
-        for interval in intervals:
-            if interval is None:
-                continue
+        """ Fold the main intervals of a request into the workflow. """
+        first = len(self.reqs)
+        from_group = None
+        for depth, interval in enumerate(intervals):
             assert isinstance(interval, IntervalBase)
             assert interval.is_interval
             assert interval.request
 
-            if not self._group_byreq:
+            if from_group is None:
                 if not self.start_group:
                     self.start_group = IntGroup("START",
                                                 None,
@@ -226,39 +259,15 @@ class Workflow(object):
                                                 None,
                                                 "None")
                 from_group = self.start_group
-            else:
-                from_group = self._group_byreq[interval.request]
-            group_key = (from_group, interval.to_edgename)
-            group = group_by_fromgroup_toedgename.get(group_key)
+                self.reqs.append(interval.request)
+            group = self._group_bytransition.get(
+                    (from_group, interval.to_edgename))
             if not group:
-                if isinstance(interval, ThreadActivity):
-                    weight = interval.state.vis_weight
-                elif isinstance(interval, JoinActivityBase):
-                    weight = interval.join_obj.vis_weight
-                elif isinstance(interval, ExtendedInterval):
-                    weight = interval.component.vis_weight
-                else:
-                    raise RuntimeError("Illegal interval %r" % interval)
-                desc = "%s: %s -> %s" % (
-                        interval.path,
-                        interval.from_keyword,
-                        interval.to_keyword)
-
-                group = IntGroup(interval.int_name,
-                                 interval.from_edgename,
-                                 interval.to_edgename,
-                                 weight,
-                                 desc)
-                from_group.append_group(group)
-                group_by_fromgroup_toedgename[group_key] = group
-                self.groups.add(group)
-                self.paths[group.path] = group.vis_weight
+                group = self._new_group(interval)
+                self._add_group(from_group, group, (depth, first))
             group.append_interval(interval)
             self.len_intervals += 1
-            newgroup_byreq[interval.request] = group
-        if not self.reqs:
-            self.reqs = newgroup_byreq.keys()
-        self._group_byreq = newgroup_byreq
+            from_group = group
 
     # NOTE: Depth first
     def sort_topologically(self):
@@ -282,30 +291,92 @@ class Workflow(object):
 
     def reduce(self):
         print("Workflow: built %d groups" % len(self.groups))
+        # Keep a topological order of groups online (Pearce-Kelly), so that a
+        # merge is checked by searching only the groups ordered in between.
+        topo = self.sort_topologically()
+        assert topo is not None
+        order = {self.start_group: 0}
+        for i, group in enumerate(topo):
+            order[group] = i + 1
+        len_bypath = defaultdict(int)
+        for group in self.groups:
+            len_bypath[group.path] += 1
+
+        def _reaches(from_group, to_group):
+            bound = order[to_group]
+            if order[from_group] >= bound:
+                return False
+            visited = {from_group}
+            stack = [from_group]
+            while stack:
+                for nxt_group in stack.pop()._nxt_groups:
+                    if nxt_group is to_group:
+                        return True
+                    if nxt_group not in visited\
+                            and order[nxt_group] < bound:
+                        visited.add(nxt_group)
+                        stack.append(nxt_group)
+            return False
+
+        def _collect(group, attr, is_in):
+            visited = {group}
+            stack = [group]
+            while stack:
+                for g in getattr(stack.pop(), attr):
+                    if g not in visited and is_in(order[g]):
+                        visited.add(g)
+                        stack.append(g)
+            return visited
+
+        def _add_edge(from_group, to_group):
+            lower = order[to_group]
+            upper = order[from_group]
+            if lower > upper:
+                return
+            forward = _collect(to_group, "_nxt_groups", lambda o: o < upper)
+            backward = _collect(from_group, "_prv_groups", lambda o: o > lower)
+            moved = sorted(backward, key=order.get)\
+                    + sorted(forward, key=order.get)
+            slots = sorted(order[g] for g in moved)
+            for group, slot in zip(moved, slots):
+                order[group] = slot
+
         #1 sort states
-        path_weights = sorted(self.paths.items(),
+        path_weights = OrderedDict()
+        for group in sorted(self.groups, key=self._rank_bygroup.get):
+            path_weights[group.path] = self.paths[group.path]
+        path_weights = sorted(path_weights.items(),
                               key=lambda s:s[1],
                               reverse=True)
         for path, _ in path_weights:
+            if len_bypath[path] < 2:
+                continue
             #2 sort groups of the same path
-            groups = self.sort_topologically()
-            assert groups
+            if topo is None:
+                topo = self.sort_topologically()
+                assert topo is not None
 
-            groups = [group for group in groups if group.path == path]
+            groups = [group for group in topo if group.path == path]
             while groups:
                 group = groups[0]
                 groups = groups[1:]
                 nxt_groups = []
                 for to_merge in groups:
-                    #3 try merge group pairs
+                    #3 try merge group pairs, unless one reaches the other
+                    if _reaches(group, to_merge) or _reaches(to_merge, group):
+                        nxt_groups.append(to_merge)
+                        continue
+                    from_groups = to_merge._prv_groups
+                    to_groups = to_merge._nxt_groups
                     group.try_merge(to_merge)
                     self.groups.remove(to_merge)
-                    if self.sort_topologically() is not None:
-                        group.apply_merge()
-                    else:
-                        group.abort_merge()
-                        self.groups.add(to_merge)
-                        nxt_groups.append(to_merge)
+                    group.apply_merge()
+                    del order[to_merge]
+                    for from_group in from_groups:
+                        _add_edge(from_group, group)
+                    for to_group in to_groups:
+                        _add_edge(group, to_group)
+                    topo = None
                 groups = nxt_groups
         print("Workflow: reduced to %d groups" % len(self.groups))
 
@@ -347,3 +418,101 @@ class Workflow(object):
             ret += format_str % (
                     line, len_ints, proj, added, lapse, avg*1000, ratio*1000, desc)
         return ret
+
+
+class _IndexNode(object):
+    __slots__ = ("center", "byfrom", "froms", "byto", "tos",
+                 "left", "right")
+
+    def __init__(self, center, byfrom, froms, byto, tos, left, right):
+        self.center = center
+        # ids sorted by from_seconds ascending
+        self.byfrom = byfrom
+        self.froms = froms
+        # ids sorted by to_seconds descending
+        self.byto = byto
+        self.tos = tos
+        self.left = left
+        self.right = right
+
+
+class IntervalIndex(object):
+    """ A centered interval tree over from_seconds and to_seconds.
+
+    Queries return the positions of the overlapping intervals in
+    O(log n + k), the tree is built once in O(n log n).
+    """
+    LEAF_SIZE = 64
+
+    def __init__(self, from_seconds, to_seconds):
+        self.froms = np.asarray(from_seconds, dtype=float)
+        self.tos = np.asarray(to_seconds, dtype=float)
+        assert self.froms.shape == self.tos.shape
+        assert self.froms.ndim == 1
+        # violated intervals are indexed by their covered range
+        self._lows = np.minimum(self.froms, self.tos)
+        self._highs = np.maximum(self.froms, self.tos)
+        self._root = self._build(np.arange(len(self.froms)))
+
+    def __len__(self):
+        return len(self.froms)
+
+    def _build(self, ids):
+        if not len(ids):
+            return None
+        lows = self._lows[ids]
+        highs = self._highs[ids]
+        if len(ids) <= self.LEAF_SIZE:
+            # leaf, scanned linearly
+            return _IndexNode(None, ids, lows, None, highs, None, None)
+
+        center = np.median(np.concatenate((lows, highs)))
+        is_left = highs < center
+        is_right = lows > center
+        is_here = ~(is_left | is_right)
+
+        here = ids[is_here]
+        order = np.argsort(lows[is_here], kind="stable")
+        byfrom = here[order]
+        froms = lows[is_here][order]
+        order = np.argsort(-highs[is_here], kind="stable")
+        byto = here[order]
+        tos = highs[is_here][order]
+        return _IndexNode(center, byfrom, froms, byto, tos,
+                          self._build(ids[is_left]),
+                          self._build(ids[is_right]))
+
+    def window(self, start, end):
+        """ Return the sorted positions of intervals overlapping
+        [start, end]. """
+        assert start <= end
+        found = []
+        to_visit = [self._root]
+        while to_visit:
+            node = to_visit.pop()
+            if node is None:
+                continue
+            if node.center is None:
+                found.append(node.byfrom[(node.froms <= end)
+                                         & (node.tos >= start)])
+            elif end < node.center:
+                # all contain center, overlap if starting before end
+                found.append(node.byfrom[
+                    :np.searchsorted(node.froms, end, side="right")])
+                to_visit.append(node.left)
+            elif start > node.center:
+                # all contain center, overlap if ending after start
+                found.append(node.byto[
+                    :np.searchsorted(-node.tos, -start, side="right")])
+                to_visit.append(node.right)
+            else:
+                found.append(node.byfrom)
+                to_visit.append(node.left)
+                to_visit.append(node.right)
+        if not found:
+            return np.empty(0, dtype=int)
+        return np.sort(np.concatenate(found))
+
+    def at(self, seconds):
+        """ Return the sorted positions of intervals covering seconds. """
+        return self.window(seconds, seconds)
@@ -15,8 +15,10 @@
 from __future__ import print_function
 
 from collections import defaultdict
+from collections import OrderedDict
 from itertools import chain
-from itertools import zip_longest
+from operator import attrgetter
+import numpy as np
 import pandas as pd
 
 from ..workflow.entities.request import RequestInstance
@@ -74,39 +76,120 @@ def _reset_starttime(requestinss, targetobjs_by_target, do_reset=True):
                         "last":  last_t}}
 
 
-def _convert_to_dataframe(objs, index, columns):
+def _object_column(values):
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+def _to_column(values, is_category):
+    if is_category:
+        return pd.Categorical(values)
+    column = np.asarray(values)
+    if column.ndim != 1:
+        column = _object_column(values)
+    elif column.dtype.kind in "US":
+        # keep python strings
+        column = column.astype(object)
+    return column
+
+
+class _ClassNames(dict):
+    # the per-class table of class names
+    def __missing__(self, cls):
+        name = self[cls] = cls.__name__
+        return name
+
+_class_names = _ClassNames()
+_INT_TYPE_COLUMN = ("int_type", _class_names.__getitem__, "__class__")
+
+
+def entities_of(ids, entities=None):
+    # "_entity" values to objects, ids are looked up in the entities list
+    if entities is None:
+        return list(ids)
+    return [entities[i] for i in ids]
+
+
+def _convert_to_dataframe(objs, index, columns, categories=(),
+                          entities=None):
     # objs: objs to be converted
     # index: the index attr
-    # columns: appended "_entity" column
-    if index is None:
-        index_vals = None
-    else:
-        objs = [obj for obj in objs]
-        index_vals = [getattr(obj, index) for obj in objs]
-    f_getvals = []
-    cols = []
+    # columns: attr names, (name, f_getval) tuples, (name, values) tuples,
+    #          (name, fmt, attrs) tuples formatted from the attrs,
+    #          or (name, f_map, attr) tuples mapped from the attr
+    # categories: columns stored as categorical codes
+    # entities: if a list, objs are appended to it and "_entity" holds
+    #           their ids, otherwise "_entity" holds objs
+    objs = list(objs)
+    columns = list(columns)
+    attrs = []
     for col in columns:
         if isinstance(col, str):
-            def _make_getattr(col):
-                return lambda o: getattr(o, col)
-            cols.append(col)
-            f_getvals.append(_make_getattr(col))
+            attrs.append(col)
+        elif len(col) == 3:
+            col_attrs = (col[2],) if callable(col[1]) else col[2]
+            attrs.extend(a for a in col_attrs if a not in attrs)
+    if index is not None:
+        attrs.append(index)
+
+    # one pass over objs for all the attrs
+    values_byattr = {attr: () for attr in attrs}
+    if attrs and objs:
+        f_getattrs = attrgetter(*attrs)
+        rows = [f_getattrs(o) for o in objs]
+        if len(attrs) == 1:
+            rows = [(row,) for row in rows]
+        for attr, values in zip(attrs, zip(*rows)):
+            values_byattr[attr] = values
+
+    data = OrderedDict()
+    for col in columns:
+        if isinstance(col, str):
+            values = values_byattr[col]
+        elif len(col) == 2:
+            col, values = col
+            if callable(values):
+                f_getval = values
+                values = [f_getval(o) for o in objs]
+        elif callable(col[1]):
+            col, f_map, attr = col
+            values = list(map(f_map, values_byattr[attr]))
         else:
-            assert isinstance(col, tuple)
-            assert len(col) == 2
-            assert isinstance(col[0], str)
-            cols.append(col[0])
-            f_getvals.append(col[1])
-    f_getvals.append(lambda e:e)
-    cols.append("_entity")
+            assert len(col) == 3
+            col, fmt, col_attrs = col
+            # format each combination once
+            formatted = {}
+            values = []
+            for vals in zip(*(values_byattr[a] for a in col_attrs)):
+                value = formatted.get(vals)
+                if value is None:
+                    value = formatted[vals] = fmt % vals
+                values.append(value)
+        assert isinstance(col, str)
+        data[col] = _to_column(values, col in categories)
+    if entities is None:
+        data["_entity"] = _object_column(objs)
+    else:
+        data["_entity"] = np.arange(len(entities), len(entities) + len(objs))
+        entities.extend(objs)
+
+    if index is None:
+        index_vals = None
+    else:
+        index_vals = pd.Index(values_byattr[index])
+    return pd.DataFrame(data, index=index_vals)
 
-    df = pd.DataFrame((tuple(f(o) for f in f_getvals) for o in objs),
-                       index=index_vals,
-                       columns=cols)
-    return df
 
+_INTERVAL_CATEGORIES = ("request", "request_type", "int_name", "path",
+                        "from_keyword", "to_keyword", "int_type", "desc")
+_DESC_COLUMN = ("desc", "%s: %s -> %s", ("path", "from_keyword", "to_keyword"))
 
-def generate_dataframes(requestinss):
+
+def generate_dataframes(requestinss, entities=None):
+    # entities: a list to collect the objects, then the "_entity" columns
+    #           hold ids into it instead of the objects
     targetobjs_by_target = {t.target: t
                             for r in requestinss.values()
                             for t in r.target_objs}
@@ -120,10 +203,9 @@ def generate_dataframes(requestinss):
 
     workflow_by_type = {}
     for r_type, reqinss in requestinss_by_type.items():
-        requestins_iters = [r.iter_mainints() for r in reqinss]
         workflow = Workflow(r_type)
-        for intervals in zip_longest(*requestins_iters):
-            workflow.build(intervals)
+        for r in reqinss:
+            workflow.build(r.iter_mainints())
         workflow.reduce()
         workflow.ready()
         workflow_by_type[r_type] = workflow
@@ -133,7 +215,9 @@ def generate_dataframes(requestinss):
             targetobjs_by_target.values(),
             "target",
             ("component",
-             "host"))
+             "host"),
+            ("component", "host"),
+            entities=entities)
 
     join_intervals_df = _convert_to_dataframe(
             chain(chain.from_iterable(req.iter_joins() for req in requestinss.values())),
@@ -149,11 +233,8 @@ def generate_dataframes(requestinss):
              "to_time",
              "from_keyword",
              "to_keyword",
-             ("int_type", lambda i: i.__class__.__name__),
-
-             ("desc", lambda i: "%s: %s -> %s" % (i.path,
-                                                  i.from_keyword,
-                                                  i.to_keyword)),
+             _INT_TYPE_COLUMN,
+             _DESC_COLUMN,
              "order",
              "is_main",
              "remote_type",
@@ -161,12 +242,17 @@ def generate_dataframes(requestinss):
              "to_target",
              "from_host",
              "to_host",
-             ("hosts", lambda i: "%s -> %s" % (i.from_host,
-                                               i.to_host)),
+             ("hosts", "%s -> %s", ("from_host", "to_host")),
              "from_component",
              "to_component",
              "from_thread",
-             "to_thread"))
+             "to_thread"),
+            _INTERVAL_CATEGORIES + ("remote_type",
+                                    "from_target", "to_target",
+                                    "from_host", "to_host", "hosts",
+                                    "from_component", "to_component",
+                                    "from_thread", "to_thread"),
+            entities=entities)
 
     td_intervals_df = _convert_to_dataframe(
             chain.from_iterable(req.iter_threadints() for req in requestinss.values()),
@@ -182,17 +268,16 @@ def generate_dataframes(requestinss):
              "to_time",
              "from_keyword",
              "to_keyword",
-             ("int_type", lambda i: i.__class__.__name__),
-
-             ("desc", lambda i: "%s: %s -> %s" % (i.path,
-                                                  i.from_keyword,
-                                                  i.to_keyword)),
+             _INT_TYPE_COLUMN,
+             _DESC_COLUMN,
              "order",
              "is_main",
              "target",
              "host",
              "component",
-             "thread"))
+             "thread"),
+            _INTERVAL_CATEGORIES + ("target", "host", "component", "thread"),
+            entities=entities)
 
     request_df = _convert_to_dataframe(
             requestinss.values(),
@@ -207,22 +292,27 @@ def generate_dataframes(requestinss):
              "to_time",
              "from_keyword",
              "to_keyword",
-             ("int_type", lambda i: i.__class__.__name__),
+             _INT_TYPE_COLUMN,
 
              "request_state",
              "last_seconds",
              "last_time",
              "len_paces",
              "len_main_paces",
-             ("len_threads", lambda r: len(r.thread_objs)),
-             ("len_threadinss", lambda r: len(r.threadinss)),
-             ("len_targets", lambda r: len(r.target_objs)),
-             ("len_hosts", lambda r: len(r.hosts))))
+             ("len_threads", len, "thread_objs"),
+             ("len_threadinss", len, "threadinss"),
+             ("len_targets", len, "target_objs"),
+             ("len_hosts", len, "hosts")),
+            ("request_type", "int_name", "path", "from_keyword",
+             "to_keyword", "int_type", "request_state"),
+            entities=entities)
 
     #vars
     invalid_keys = set()
     valid_keys = set()
-    for req in requestinss.values():
+    # the single value of each key by request position
+    vals_bykey = defaultdict(dict)
+    for i, req in enumerate(requestinss.values()):
         for k, v in req.request_vars.items():
             if len(v) > 1:
                 valid_keys.discard(k)
@@ -230,13 +320,18 @@ def generate_dataframes(requestinss):
             elif len(v) == 1:
                 if k not in invalid_keys:
                     valid_keys.add(k)
+                    vals_bykey[k][i] = next(iter(v))
 
-    def _get_val(k):
-        return lambda r: list(r.request_vars.get(k, [None]))[0]
+    def _get_vals(k):
+        values = [None] * len(requestinss)
+        for i, val in vals_bykey[k].items():
+            values[i] = val
+        return values
     request_vars_df = _convert_to_dataframe(
             requestinss.values(),
             "request",
-            ((k, _get_val(k)) for k in valid_keys))
+            ((k, _get_vals(k)) for k in valid_keys),
+            entities=entities)
 
     return (requestinss_by_type,
             targetobjs_by_target,
@@ -0,0 +1,236 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+import importlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from .clockmaster import adjust_clock
+from .datasource.log_engine import proceed as l_proceed
+from .driver import Driver
+from .synthetic import generate
+from .utils import Report
+from .utils import peak_rss
+from .workflow.engine import proceed
+
+
+SIZES = (10000, 100000, 1000000)
+
+
+def run_pipeline(data_path, driver, processes=None, indexer="hash",
+                 clock_solver="relax"):
+    """ Run the stages of loading data_path, return the per-stage report. """
+    assert isinstance(driver, Driver)
+    report = Report()
+    targets_byname = l_proceed(data_path, driver.services, driver, report,
+                               processes)
+    requestinss = proceed(targets_byname, driver.graph, report, indexer,
+                          processes)
+    adjust_clock(requestinss, clock_solver)
+    report.step("adjust", request=len(requestinss))
+    return report
+
+
+def _generate_inchild(driver, data_path, requests, gen_kwds):
+    start = time.time()
+    generator = generate(driver, data_path, requests, **gen_kwds)
+    return {"wall": time.time() - start,
+            "lines": generator.len_lines,
+            "threadins": generator.len_threadinss}
+
+
+def _parse_inchild(driver, data_path, processes, indexer, clock_solver):
+    report = run_pipeline(data_path, driver, processes, indexer,
+                          clock_solver)
+    return {"steps": report.to_dict(),
+            "peak_rss_kb": peak_rss(),
+            "child_peak_rss_kb": peak_rss(children=True)}
+
+
+def _child_main(conn, log_path, func, args):
+    # the parse logs are verbose, keep them out of the summary
+    with open(log_path, "a") as log:
+        sys.stdout = log
+        try:
+            conn.send((True, func(*args)))
+        except Exception as e:
+            conn.send((False, "%s: %s" % (e.__class__.__name__, e)))
+            raise
+        finally:
+            sys.stdout.flush()
+            sys.stdout = sys.__stdout__
+            conn.close()
+
+
+def _run_forked(log_path, func, *args):
+    # a fresh process for each run, so that peak RSS is not inherited
+    ctx = multiprocessing.get_context("fork")
+    reader, writer = ctx.Pipe(False)
+    process = ctx.Process(target=_child_main,
+                          args=(writer, log_path, func, args))
+    process.start()
+    writer.close()
+    try:
+        is_ok, ret = reader.recv()
+    except EOFError:
+        is_ok, ret = False, "exit code %s" % process.exitcode
+    process.join()
+    if not is_ok:
+        raise RuntimeError("Benchmark failed, see %s: %s" % (log_path, ret))
+    return ret
+
+
+def _print_result(result):
+    fmt = "%9s,%8s" + ",%9s"*7
+    gen = result.get("generate")
+    if gen:
+        print(fmt % (result["requests"], "generate", "%.3f" % gen["wall"],
+                     "x", "x", "x", int(gen["lines"] / gen["wall"]),
+                     "x", "x"))
+    for step in result["steps"]:
+        print(fmt % (result["requests"], step["name"],
+                     "%.3f" % step["wall"], "%.3f" % step["cpu"],
+                     "%.1f" % (step["rss_kb"] / 1024.),
+                     "%.1f" % (step["child_rss_kb"] / 1024.),
+                     step.get("lines_per_s", "x"),
+                     step.get("paces_per_s", "x"),
+                     step.get("joins_per_s", "x")))
+    print(fmt % (result["requests"], "total",
+                 "%.3f" % sum(s["wall"] for s in result["steps"]),
+                 "%.3f" % sum(s["cpu"] for s in result["steps"]),
+                 "%.1f" % (result["peak_rss_kb"] / 1024.),
+                 "%.1f" % (result["child_peak_rss_kb"] / 1024.), "x",
+                 "x", "x"))
+
+
+def benchmark(driver, work_dir, sizes=SIZES, processes=None,
+              indexer="hash", clock_solver="relax", **gen_kwds):
+    """ Generate a log folder of each size under work_dir, then load it and
+    report the wall time, cpu time and memory of each stage.
+
+    Existing folders are reused, gen_kwds are passed to TraceGenerator.
+    """
+    assert isinstance(driver, Driver)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    print("%9s,%8s,%9s,%9s,%9s,%9s,%9s,%9s,%9s" % (
+        "requests", "stage", "wall(s)", "cpu(s)", "rss(MB)", "c_rss(MB)",
+        "line/s", "pace/s", "join/s"))
+    results = []
+    for requests in sizes:
+        data_path = os.path.join(work_dir, "%s-%d" % (driver.name, requests))
+        log_path = data_path + ".log"
+        result = {"requests": requests, "folder": data_path}
+        if not os.path.isdir(data_path):
+            result["generate"] = _run_forked(
+                    log_path, _generate_inchild,
+                    driver, data_path, requests, gen_kwds)
+        result.update(_run_forked(log_path, _parse_inchild,
+                                  driver, data_path, processes, indexer,
+                                  clock_solver))
+        _print_result(result)
+        results.append(result)
+    return results
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+            description="Benchmark the stages on generated logs.")
+    parser.add_argument('--driver',
+                        default="ceph_writefull_aio",
+                        help="The module name under workflow_parser.drivers.")
+    parser.add_argument('--work-dir',
+                        default="wf-benchmark",
+                        help="The folder to keep generated logs.")
+    parser.add_argument('--sizes',
+                        type=int,
+                        nargs="+",
+                        default=list(SIZES),
+                        help="The request counts to benchmark.")
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help="Read logs and build requests with a pool "
+                             "of processes.")
+    parser.add_argument('--indexer',
+                        choices=["hash", "pandas"],
+                        default="hash",
+                        help="The engine to join paces.")
+    parser.add_argument('--clock-solver',
+                        choices=["relax", "matrix"],
+                        default="relax",
+                        help="The engine to solve host clock offsets.")
+    parser.add_argument('--hosts',
+                        type=int,
+                        default=2,
+                        help="Hosts of each component.")
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=8,
+                        help="Requests issued concurrently.")
+    parser.add_argument('--skew',
+                        type=float,
+                        default=0.0005,
+                        help="The max clock skew of a host in seconds.")
+    parser.add_argument('--noise',
+                        type=float,
+                        default=0.0,
+                        help="The ratio of unrelated lines.")
+    parser.add_argument('--drop',
+                        type=float,
+                        default=0.0,
+                        help="The ratio of lost lines.")
+    parser.add_argument('--branch',
+                        type=float,
+                        default=0.0,
+                        help="The ratio of randomly chosen branches.")
+    parser.add_argument('--seed',
+                        type=int,
+                        default=0,
+                        help="The random seed of the generator.")
+    parser.add_argument('--json',
+                        default=None,
+                        help="Export the results to a JSON file.")
+    args = parser.parse_args()
+
+    module = importlib.import_module(
+            "workflow_parser.drivers." + args.driver)
+    driver = getattr(module, module.__all__[0])
+    gen_kwds = {"hosts": args.hosts,
+                "concurrency": args.concurrency,
+                "skew": args.skew,
+                "noise": args.noise,
+                "drop": args.drop,
+                "branch": args.branch,
+                "seed": args.seed}
+    results = benchmark(driver, args.work_dir, args.sizes,
+                        args.processes, args.indexer, args.clock_solver,
+                        **gen_kwds)
+    if args.json:
+        with open(args.json, "w") as writer:
+            json.dump({"driver": driver.name,
+                       "options": gen_kwds,
+                       "results": results}, writer, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -18,10 +18,14 @@ from collections import defaultdict
 
 from ..workflow.entities.request import RequestInstance
 from ..workflow.entities.join import JoinActivityBase
-from .relation_engine import CausalEngine
+from .relation_engine import Solvers
 
 
-def adjust_clock(requestinss):
+def adjust_clock(requestinss, solver="relax"):
+    if solver not in Solvers:
+        raise RuntimeError("Invalid clock solver %s, choose from %s" % (
+            solver, ",".join(Solvers.keys())))
+
     remote_relations = set()
     targetobjs_by_host = defaultdict(set)
     for requestins in requestinss.values():
@@ -38,7 +42,7 @@ def adjust_clock(requestinss):
 
     print("Preparing constraints...")
     violated_joinints = set()
-    causal_engine = CausalEngine()
+    causal_engine = Solvers[solver]()
     for relation in remote_relations:
         assert isinstance(relation, JoinActivityBase)
         causal_engine.register(relation.from_host,
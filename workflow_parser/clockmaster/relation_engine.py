@@ -15,6 +15,8 @@
 from collections import OrderedDict
 from numbers import Real
 
+import numpy as np
+
 
 class HostConstraint(object):
     def __init__(self, name):
@@ -273,7 +275,7 @@ class CausalEngine(object):
         relationcon.setoffset(from_hostc, to_hostc,
                               from_seconds, to_seconds)
 
-    def relax(self):
+    def _prepare(self):
         self.unknown_hostcs.sort(key=lambda hc: -len(hc.relationcons))
         h_odict = OrderedDict()
         for hc in self.unknown_hostcs:
@@ -287,13 +289,19 @@ class CausalEngine(object):
         if self.distance == float("inf"):
             self.distance = 0.0
 
-        if not self.unknown_hostcs:
+        return bool(self.unknown_hostcs)
+
+    def relax(self):
+        if not self._prepare():
             return False
         while True:
             next_hostc = None
             # ready hostc first
             for hostc in self.unknown_hostcs.keys():
-                if hostc.adjust(self.distance):
+                # already determined by the relaxed relations, such a hostc
+                # is neither ready nor sided, and adjust_none() would fail
+                if hostc.determined is not None\
+                        or hostc.adjust(self.distance):
                     next_hostc = hostc
                     break
             # sided hostc second
@@ -323,3 +331,78 @@ class CausalEngine(object):
                         self.relax_counter += 1
                 changed_hostcs = next_changed_hostcs
         return True
+
+
+class MatrixCausalEngine(CausalEngine):
+    """ Pick host offsets in the same order and policy as CausalEngine, but
+    bound the hosts by the shortest paths between them.
+
+    The offset differences of all host pairs are solved once with
+    Floyd-Warshall, so fixing an offset updates every host bound in one
+    vectorized step instead of relaxing the relations one by one.
+    """
+    def relax(self):
+        if not self._prepare():
+            return False
+
+        hostcs = list(self.unknown_hostcs.keys())
+        index_byhostc = {hostc: i for i, hostc in enumerate(hostcs)}
+        len_hosts = len(hostcs)
+
+        # diffs[i, j] is the upper bound of offset_j - offset_i
+        diffs = np.full((len_hosts, len_hosts), np.inf)
+        np.fill_diagonal(diffs, 0)
+        for relationcon in self.relationcons:
+            from_i = index_byhostc[relationcon.from_hostc]
+            to_i = index_byhostc[relationcon.to_hostc]
+            # offset_from - offset_to is in [low, high]
+            diffs[to_i, from_i] = min(diffs[to_i, from_i], relationcon.high)
+            diffs[from_i, to_i] = min(diffs[from_i, to_i], -relationcon.low)
+        for k in range(len_hosts):
+            np.minimum(diffs, diffs[:, k, None] + diffs[None, k, :], out=diffs)
+        violated = np.flatnonzero(np.diag(diffs) < 0)
+        if len(violated):
+            raise RuntimeError("Relation constraints violated in a cycle "
+                    "through hosts: %s" % ",".join(
+                        hostcs[i].hostname for i in violated))
+
+        lows = np.array([hostc.low for hostc in hostcs])
+        highs = np.array([hostc.high for hostc in hostcs])
+        unknowns = np.ones(len_hosts, dtype=bool)
+        while unknowns.any():
+            is_low = np.isfinite(lows)
+            is_high = np.isfinite(highs)
+            # ready or already determined hostc first
+            candidates = np.flatnonzero(unknowns & is_low & is_high)
+            if len(candidates):
+                i = candidates[0]
+                hostc = hostcs[i]
+                hostc.low, hostc.high = float(lows[i]), float(highs[i])
+                if hostc.determined is None:
+                    hostc.adjust(self.distance)
+            else:
+                # sided hostc second
+                candidates = np.flatnonzero(unknowns & (is_low | is_high))
+                if len(candidates):
+                    i = candidates[0]
+                    hostc = hostcs[i]
+                    hostc.low, hostc.high = float(lows[i]), float(highs[i])
+                    hostc.adjust_side(self.distance)
+                # isolated hostc
+                else:
+                    i = np.flatnonzero(unknowns)[0]
+                    hostc = hostcs[i]
+                    hostc.adjust_none()
+
+            offset = hostc.low
+            unknowns[i] = False
+            self.unknown_hostcs.pop(hostc)
+            self.determined_hostcs.add(hostc)
+            np.minimum(highs, offset + diffs[i], out=highs)
+            np.maximum(lows, offset - diffs[:, i], out=lows)
+            self.relax_counter += 1
+        return True
+
+
+Solvers = {"relax": CausalEngine,
+           "matrix": MatrixCausalEngine}
@@ -14,12 +14,20 @@
 
 from abc import ABCMeta
 from abc import abstractproperty
+from collections import OrderedDict
 from functools import total_ordering
+import mmap
 import numbers
+import os
+import sys
+
+import numpy as np
 
 from .. import reserved_vars as rv
 from ..service_registry import Component
 from .exc import LogError
+from .timestamps import format_time
+from .timestamps import is_derivable
 
 
 class LineStateBase(object):
@@ -38,50 +46,309 @@ class LineStateBase(object):
         return "?"
 
 
+class Interner(object):
+    """ Canonical objects of repeated values, and their integer ids.
+
+    Equal values passed through the table come back as the same object, so
+    that comparing and hashing them downstream hit the identity fast path.
+    Each load has its own table, shared by its sources and released with
+    them.
+    """
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+        self._canonicals = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, id_):
+        return self.values[id_]
+
+    def id_of(self, value):
+        id_ = self._ids.get(value)
+        if id_ is None:
+            value = self.intern(value)
+            id_ = len(self.values)
+            self.values.append(value)
+            self._ids[value] = id_
+        return id_
+
+    def intern(self, value):
+        return self._canonicals.setdefault(value, value)
+
+
+class SpanMaps(object):
+    """ Read-only maps of the source files shared by all the line stores.
+
+    At most capacity files are mapped, the least recently used map is
+    closed to open another one. A file is checked when it is mapped, not
+    at each read.
+    """
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self._maps = OrderedDict()
+
+    def __len__(self):
+        return len(self._maps)
+
+    def get(self, f_dir, file_stat, end):
+        # file_stat: (ino, size, mtime_ns) of the file when its spans are read
+        ino, size, mtime = file_stat
+        key = (f_dir, ino)
+        entry = self._maps.pop(key, None)
+        if entry is not None:
+            buf, mapped_size = entry
+            if mapped_size < size or len(buf) < end:
+                # the file has grown since it is mapped
+                buf.close()
+                entry = None
+        if entry is None:
+            while len(self._maps) >= self.capacity:
+                self._maps.popitem(last=False)[1][0].close()
+            with open(f_dir, "rb") as reader:
+                stat = os.fstat(reader.fileno())
+                # the file can only be appended after its spans are read
+                if stat.st_ino != ino or stat.st_size < size or \
+                        (stat.st_size == size and stat.st_mtime_ns != mtime):
+                    raise LogError("%s is changed since it was read, "
+                                   "cannot read its lines!" % f_dir)
+                buf = mmap.mmap(reader.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+            entry = (buf, stat.st_size)
+        self._maps[key] = entry
+        return entry[0]
+
+    def clear(self):
+        while self._maps:
+            self._maps.popitem()[1][0].close()
+
+
+span_maps = SpanMaps(16)
+
+
+class LineStore(object):
+    """ Columnar storage of the lines from one source.
+
+    Lines are addressed by their index in the source, links are stored as
+    index arrays with -1 as None, and Line objects are views created on
+    demand. Lines read from the source file keep only their byte span, the
+    text is read back from the file when it is needed. Times are formatted
+    from seconds, unless they are not in the canonical format.
+    """
+    _init_capacity = 1024
+
+    def __init__(self, source_obj, interner):
+        assert isinstance(interner, Interner)
+        self.source_obj = source_obj
+        self.interner = interner
+        self.size = 0
+        self.capacity = 0
+
+        self.seconds = None
+        self.lino = None
+        self.thread_id = None
+        self.keyword_id = None
+        self.prv_thread = None
+        self.nxt_thread = None
+        self.prv_target = None
+        self.nxt_target = None
+        self.line_offset = None
+        self.line_length = None
+        self._grow(self._init_capacity)
+
+        # texts of the lines without a span in the source file
+        self.texts = {}
+        # (inode, size, mtime) of the source file when the spans are read
+        self.file_stat = None
+        # times not derivable from seconds
+        self.times = {}
+        self.requests = []
+        self.schema_vars = []
+        self.line_states = []
+
+        self.thread_objs = []
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, capacity):
+        def _resize(array, dtype, fill=None):
+            new = np.empty(capacity, dtype=dtype)
+            if fill is not None:
+                new.fill(fill)
+            if array is not None:
+                new[:self.size] = array[:self.size]
+            return new
+
+        self.seconds = _resize(self.seconds, np.float64)
+        self.lino = _resize(self.lino, np.int64)
+        self.thread_id = _resize(self.thread_id, np.int32)
+        self.keyword_id = _resize(self.keyword_id, np.int32)
+        self.prv_thread = _resize(self.prv_thread, np.int64, -1)
+        self.nxt_thread = _resize(self.nxt_thread, np.int64, -1)
+        self.prv_target = _resize(self.prv_target, np.int64, -1)
+        self.nxt_target = _resize(self.nxt_target, np.int64, -1)
+        self.line_offset = _resize(self.line_offset, np.int64, -1)
+        self.line_length = _resize(self.line_length, np.int64, 0)
+        self.capacity = capacity
+
+    def _stat_file(self):
+        stat = os.stat(self.source_obj.where)
+        self.file_stat = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def read_span(self, offset, length):
+        if self.file_stat is None:
+            self._stat_file()
+        buf = span_maps.get(self.source_obj.where, self.file_stat,
+                            offset + length)
+        return buf[offset:offset+length].decode().strip()
+
+    def text(self, index):
+        offset = self.line_offset[index]
+        if offset < 0:
+            return self.texts[index]
+        return self.read_span(int(offset), int(self.line_length[index]))
+
+    def time(self, index):
+        time = self.times.get(index)
+        if time is None:
+            time = format_time(float(self.seconds[index]))
+        return time
+
+    def add_thread(self, thread_obj):
+        self.thread_objs.append(thread_obj)
+        return len(self.thread_objs) - 1
+
+    def append(self, thread_id, lino, line, vs, time, seconds, keyword,
+               request):
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        index = self.size
+        assert index == 0 or self.lino[index - 1] < lino
+        self.seconds[index] = seconds
+        self.lino[index] = lino
+        self.thread_id[index] = thread_id
+        self.keyword_id[index] = self.interner.id_of(keyword)
+        if isinstance(line, tuple):
+            self.line_offset[index], self.line_length[index] = line
+            if self.file_stat is None or \
+                    line[0] + line[1] > self.file_stat[1]:
+                # spans read beyond the recorded size
+                self._stat_file()
+        else:
+            self.texts[index] = line.strip()
+        if not is_derivable(time, seconds):
+            self.times[index] = time
+        self.requests.append(request)
+        self.schema_vars.append(vs)
+        self.line_states.append(None)
+        self.size += 1
+        return index
+
+    def link_thread(self, prv, nxt):
+        self.nxt_thread[prv] = nxt
+        self.prv_thread[nxt] = prv
+
+    def link_target(self, prv, nxt):
+        self.nxt_target[prv] = nxt
+        self.prv_target[nxt] = prv
+
+    def line(self, index):
+        if index < 0 or index >= self.size:
+            return None
+        return Line(self, index)
+
+
 @total_ordering
 class Line(object):
+    __slots__ = ("_store", "_index")
+
     _str_lines_nxtlim = 10
     _str_lines_prvlim = 10
 
-    def __init__(self, source_obj,
-                       lino,
-                       line,
-                       vs,
-                       thread_obj,
-                       time,
-                       seconds,
-                       keyword,
-                       request=None):
-        assert isinstance(source_obj, Source)
-        assert isinstance(lino, int)
-        assert isinstance(line, str)
-        assert isinstance(vs, dict)
-        assert not rv.ALL_VARS & vs.keys()
-        assert isinstance(thread_obj, Thread)
-        assert isinstance(time, str)
-        assert isinstance(seconds, numbers.Real)
-        assert isinstance(keyword, str)
-        if request is not None:
-            assert isinstance(request, str)
+    def __init__(self, store, index):
+        assert isinstance(store, LineStore)
+        assert 0 <= index < store.size
 
-        self.source_obj = source_obj
-        self.lino = lino
-        self.line = line.strip()
-        self._schema_vars = vs
-        self.thread_obj = thread_obj
-        self._line_state = None
+        self._store = store
+        self._index = index
+
+    @property
+    def source_obj(self):
+        return self._store.source_obj
 
-        self.time = time
-        self._seconds = seconds
-        self.keyword = keyword
-        self.request = request
+    @property
+    def lino(self):
+        return int(self._store.lino[self._index])
 
-        self.prv_source_line = None
-        self.nxt_source_line = None
-        self.prv_thread_line = None
-        self.nxt_thread_line = None
-        self.prv_target_line = None
-        self.nxt_target_line = None
+    @property
+    def line(self):
+        return self._store.text(self._index)
+
+    @property
+    def _schema_vars(self):
+        return self._store.schema_vars[self._index]
+
+    @property
+    def thread_obj(self):
+        store = self._store
+        return store.thread_objs[store.thread_id[self._index]]
+
+    @property
+    def _line_state(self):
+        return self._store.line_states[self._index]
+
+    @property
+    def time(self):
+        return self._store.time(self._index)
+
+    @property
+    def _seconds(self):
+        return float(self._store.seconds[self._index])
+
+    @property
+    def keyword(self):
+        store = self._store
+        return store.interner[store.keyword_id[self._index]]
+
+    @property
+    def keyword_id(self):
+        return int(self._store.keyword_id[self._index])
+
+    @property
+    def request(self):
+        return self._store.requests[self._index]
+
+    @property
+    def prv_source_line(self):
+        return self._store.line(self._index - 1)
+
+    @property
+    def nxt_source_line(self):
+        return self._store.line(self._index + 1)
+
+    @property
+    def prv_thread_line(self):
+        return self._store.line(self._store.prv_thread[self._index])
+
+    @property
+    def nxt_thread_line(self):
+        return self._store.line(self._store.nxt_thread[self._index])
+
+    @property
+    def prv_target_line(self):
+        return self._store.line(self._store.prv_target[self._index])
+
+    @property
+    def nxt_target_line(self):
+        return self._store.line(self._store.nxt_target[self._index])
+
+    def is_line(self, other):
+        return other is not None\
+                and self._store is other._store\
+                and self._index == other._index
 
     @property
     def name(self):
@@ -200,7 +467,7 @@ class Line(object):
         ret += "\n------- end -----"
         if line is not None and line.nxt_thread_line is not None:
             ret += "\n "+self.thread_obj.last_lineobj.__repr_thread__()
-            if line.nxt_thread_line is not self.thread_obj.last_lineobj:
+            if not line.nxt_thread_line.is_line(self.thread_obj.last_lineobj):
                 ret += "\n . ......"
 
         while cnt_nxt > 0:
@@ -220,7 +487,8 @@ class Line(object):
                 break
 
         if line is not None and line.prv_thread_line is not None:
-            if line.prv_thread_line is not self.thread_obj.start_lineobj:
+            if not line.prv_thread_line.is_line(
+                    self.thread_obj.start_lineobj):
                 ret += "\n . ......"
             ret += "\n "+self.thread_obj.start_lineobj.__repr_thread__()
         ret += "\n------- start ---"
@@ -229,7 +497,7 @@ class Line(object):
     def set_linestate(self, ls):
         assert isinstance(ls, LineStateBase)
         assert self._line_state is None
-        self._line_state = ls
+        self._store.line_states[self._index] = ls
 
 
 class Thread(object):
@@ -244,8 +512,10 @@ class Thread(object):
         self.thread = thread
         self.target_obj = target_obj
 
-        self.start_lineobj = None
-        self.last_lineobj = None
+        self._store = None
+        self._store_id = None
+        self._start_index = -1
+        self._last_index = -1
         self.len_lineobjs = 0
 
         # after thread instances are built
@@ -274,6 +544,18 @@ class Thread(object):
         assert self.threadinss
         return sum(ti.lapse for ti in self.threadinss)
 
+    @property
+    def start_lineobj(self):
+        if self._store is None:
+            return None
+        return self._store.line(self._start_index)
+
+    @property
+    def last_lineobj(self):
+        if self._store is None:
+            return None
+        return self._store.line(self._last_index)
+
     def __repr__(self):
         return "<Thread#%s-%s: %d lines, %d threadinss, comp=%s, host=%s>" %\
                 (self.name,
@@ -298,7 +580,7 @@ class Thread(object):
 
         if line is None:
             pass
-        elif line is self.start_lineobj:
+        elif line.is_line(self.start_lineobj):
             ret += "\n%s" % line.__repr_thread__()
         else:
             ret += "\n. ......"
@@ -307,28 +589,59 @@ class Thread(object):
 
         return ret
 
-    def _append_line(self, **kwds):
-        line_obj = Line(thread_obj=self,
-                        **kwds)
+    def _append_line(self, source_obj,
+                           lino,
+                           line,
+                           vs,
+                           time,
+                           seconds,
+                           keyword,
+                           request=None):
+        assert isinstance(source_obj, Source)
+        assert isinstance(lino, int)
+        assert isinstance(line, (str, tuple))
+        assert isinstance(vs, dict)
+        assert not rv.ALL_VARS & vs.keys()
+        assert isinstance(time, str)
+        assert isinstance(seconds, numbers.Real)
+        assert isinstance(keyword, str)
+        if request is not None:
+            assert isinstance(request, str)
+
+        store = source_obj.store
+        if self._store is None:
+            self._store = store
+            self._store_id = store.add_thread(self)
+        else:
+            assert self._store is store
 
-        if self.start_lineobj is None:
-            self.start_lineobj = line_obj
-            assert self.last_lineobj is None
+        index = store.append(self._store_id, lino, line, vs,
+                             time, seconds, keyword, request)
+        if self._start_index < 0:
+            self._start_index = index
+            assert self._last_index < 0
             assert self.len_lineobjs == 0
         else:
-            assert self.last_lineobj.lino < line_obj.lino
-            self.last_lineobj.nxt_thread_line = line_obj
-            line_obj.prv_thread_line = self.last_lineobj
-        self.last_lineobj = line_obj
+            assert store.lino[self._last_index] < lino
+            store.link_thread(self._last_index, index)
+        self._last_index = index
         self.len_lineobjs += 1
 
-        return line_obj
+        return index
 
-    def iter_lineobjs(self):
-        line = self.start_lineobj
-        while line is not None:
-            yield line
-            line = line.nxt_thread_line
+    def iter_lineobjs(self, after=None):
+        # from the start, or from the line next to `after`
+        if self._store is None:
+            return
+        store = self._store
+        if after is None:
+            index = self._start_index
+        else:
+            assert isinstance(after, Line)
+            index = store.nxt_thread[after._index]
+        while index >= 0:
+            yield Line(store, index)
+            index = store.nxt_thread[index]
 
 
 class Target(object):
@@ -342,8 +655,9 @@ class Target(object):
         self._offset = 0
         self.thread_objs = {}
 
-        self.start_lineobj = None
-        self.last_lineobj = None
+        self._store = None
+        self._start_index = -1
+        self._last_index = -1
         self.len_lineobjs = 0
 
         self._index_thread = 0
@@ -361,6 +675,18 @@ class Target(object):
     def target(self):
         return self._target_alias
 
+    @property
+    def start_lineobj(self):
+        if self._store is None:
+            return None
+        return self._store.line(self._start_index)
+
+    @property
+    def last_lineobj(self):
+        if self._store is None:
+            return None
+        return self._store.line(self._last_index)
+
     def __repr__(self):
         str_target = self.target
         return "<%s#%s: comp=%s, host=%s, off=%d, %d threads>" % (
@@ -415,33 +741,50 @@ class Target(object):
             thread_obj = Thread(self._index_thread, self, thread)
             self.thread_objs[thread] = thread_obj
 
-        line_obj = thread_obj._append_line(**kwds)
+        index = thread_obj._append_line(**kwds)
 
-        if self.start_lineobj is None:
-            self.start_lineobj = line_obj
-            assert self.last_lineobj is None
+        store = thread_obj._store
+        if self._store is None:
+            self._store = store
+        else:
+            assert self._store is store
+        if self._start_index < 0:
+            self._start_index = index
+            assert self._last_index < 0
             assert self.len_lineobjs == 0
         else:
-            assert self.last_lineobj.lino < line_obj.lino
-            self.last_lineobj.nxt_target_line = line_obj
-            line_obj.prv_target_line = self.last_lineobj
-        self.last_lineobj = line_obj
+            assert store.lino[self._last_index] < store.lino[index]
+            store.link_target(self._last_index, index)
+        self._last_index = index
         self.len_lineobjs += 1
 
-        return line_obj
+        return index
 
-    def iter_lineobjs(self):
-        line = self.start_lineobj
-        while line is not None:
-            yield line
-            line = line.nxt_target_line
+    def iter_lineobjs(self, after=None):
+        # from the start, or from the line next to `after`
+        if self._store is None:
+            return
+        store = self._store
+        if after is None:
+            index = self._start_index
+        else:
+            assert isinstance(after, Line)
+            index = store.nxt_target[after._index]
+        while index >= 0:
+            yield Line(store, index)
+            index = store.nxt_target[index]
+
+
+# values of schema vars are interned by sys.intern() instead, they are
+# released with the lines
+_INTERNED_VARS = {rv.THREAD, rv.TARGET, rv.HOST}
 
 
 # granularity: target, host
 class Source(object):
     _str_lines_lim = 10
 
-    def __init__(self, name, f_dir, vs):
+    def __init__(self, name, f_dir, vs, interner=None):
         assert isinstance(name, str)
         assert isinstance(f_dir, str)
         assert isinstance(vs, dict)
@@ -456,9 +799,11 @@ class Source(object):
         self.name = name
         self.where = f_dir
 
-        self.start_lineobj = None
-        self.last_lineobj = None
-        self.len_lineobjs = 0
+        # keywords, threads, targets, hosts and var keys, shared by the
+        # sources of the same load
+        if interner is None:
+            interner = Interner()
+        self.store = LineStore(self, interner)
 
         self.targets_byalias = {}
         self.if_alias_required = None
@@ -479,6 +824,59 @@ class Source(object):
                self.where,
                marks)
 
+    @property
+    def len_lineobjs(self):
+        return self.store.size
+
+    @property
+    def start_lineobj(self):
+        return self.store.line(0)
+
+    @property
+    def last_lineobj(self):
+        return self.store.line(self.store.size - 1)
+
+    def iter_lineobjs(self):
+        for index in range(self.store.size):
+            yield Line(self.store, index)
+
+    def iter_records(self):
+        """ Yield (lino, line, vs) that append_line() rebuilds lines from. """
+        store = self.store
+        seen_targets = set()
+        names_bytarget = {}
+        for index in range(store.size):
+            line_obj = Line(store, index)
+            thread_obj = line_obj.thread_obj
+            target_obj = thread_obj.target_obj
+
+            vs = dict(line_obj._schema_vars)
+            vs[rv.THREAD] = thread_obj.thread
+            vs[rv.KEYWORD] = line_obj.keyword
+            vs[rv.TIME] = line_obj.time
+            vs[rv.SECONDS] = line_obj._seconds
+            if line_obj.request is not None:
+                vs[rv.REQUEST] = line_obj.request
+            if self.if_alias_required:
+                vs[rv.TARGET_ALIAS] = target_obj._target_alias
+                names = names_bytarget.get(target_obj)
+                if names is None:
+                    names = sorted(target_obj.target_names, reverse=True)
+                    names_bytarget[target_obj] = names
+                if names:
+                    vs[rv.TARGET] = names.pop()
+            else:
+                vs[rv.TARGET] = target_obj._target_alias
+            if target_obj not in seen_targets:
+                seen_targets.add(target_obj)
+                if target_obj.host is not None:
+                    vs[rv.HOST] = target_obj.host
+                if target_obj.component is not None:
+                    vs[rv.COMPONENT] = target_obj.component
+            for key in self.vars_:
+                vs.pop(key, None)
+            yield int(store.lino[index]), line_obj.line, vs
+
     def __str__(self):
         ret = repr(self)
         lim = self._str_lines_lim
@@ -494,7 +892,7 @@ class Source(object):
 
         if line is None:
             pass
-        elif line is self.start_lineobj:
+        elif line.is_line(self.start_lineobj):
             ret += "\n%r" % self.start_lineobj
         else:
             ret += "\n ......"
@@ -503,9 +901,15 @@ class Source(object):
 
         return ret
 
+    def line_text(self, line):
+        # line is the text, or the (offset, length) span in the source file
+        if isinstance(line, tuple):
+            return self.store.read_span(*line)
+        return line
+
     def append_line(self, lino, line, vs, targets_byname):
         assert isinstance(lino, int)
-        assert isinstance(line, str)
+        assert isinstance(line, (str, tuple))
         assert isinstance(vs, dict)
         assert isinstance(targets_byname, dict)
 
@@ -517,27 +921,34 @@ class Source(object):
                 raise LogError(
                         "Error in %s@%d %s: line var %s conflict with"
                         "source var, %s vs %s!" % (
-                            self.name, lino, line,
+                            self.name, lino, self.line_text(line),
                             k, vs[k], self.vars_[k]))
         vs.update(self.vars_)
 
-        #2. split reserved vars
+        #2. split reserved vars, intern the repeated strings
         resv = {}
         vars_ = {}
+        intern = self.store.interner.intern
         for k,v in vs.items():
             if k in rv.ALL_VARS:
+                if k in _INTERNED_VARS and v.__class__ is str:
+                    v = intern(v)
                 resv[k] = v
             elif k == rv.TARGET_ALIAS:
+                if v.__class__ is str:
+                    v = intern(v)
                 resv[k] = v
             else:
-                vars_[k] = v
+                if v.__class__ is str:
+                    v = sys.intern(v)
+                vars_[intern(k)] = v
 
         #3. check required line vars
         required = {rv.THREAD, rv.KEYWORD, rv.TIME, rv.SECONDS} - resv.keys()
         if required:
             raise LogError(
                     "Error in %s@%d %s: cannot identify vars %s!" % (
-                        self.name, lino, line, required))
+                        self.name, lino, self.line_text(line), required))
 
         #4 process target_alias required
         target_alias = None
@@ -556,18 +967,18 @@ class Source(object):
             if not isinstance(target_alias, str):
                 raise LogError(
                     "Error in %s@%d %s: %s required, but got %s!" % (
-                        self.name, lino, line,
+                        self.name, lino, self.line_text(line),
                         rv.TARGET_ALIAS, target_alias))
         else:
             if target_alias:
                 raise LogError(
                     "Error in %s@%d %s: %s not needed, but got %s!" % (
-                        self.name, lino, line,
+                        self.name, lino, self.line_text(line),
                         rv.TARGET_ALIAS, target_alias))
             if not isinstance(target, str):
                 raise LogError(
                     "Error in %s@%d %s: %s required, but got %s!" % (
-                        self.name, lino, line,
+                        self.name, lino, self.line_text(line),
                         rv.TARGET, target))
             target_alias = target
 
@@ -584,12 +995,12 @@ class Source(object):
                 raise LogError(
                         "Error in %s@%d %s: target %s conflict, "
                         "found both in %s and %s" % (
-                            self.name, lino, line,
+                            self.name, lino, self.line_text(line),
                             target, target_alias, target_obj_._target_alias))
 
         #6. create line_obj
         try:
-            line_obj = target_obj._append_line(
+            index = target_obj._append_line(
                     source_obj=self,
                     lino=lino,
                     line=line,
@@ -598,18 +1009,8 @@ class Source(object):
                     target_alias=target_alias,
                     **resv)
         except LogError as e:
-            raise LogError("Error in %s@%d %s!" % (self.name, lino, line), e)
-
-        #7. link line_obj
-        if self.start_lineobj is None:
-            self.start_lineobj = line_obj
-            assert self.last_lineobj is None
-            assert self.len_lineobjs == 0
-        else:
-            assert self.last_lineobj.lino < line_obj.lino
-            self.last_lineobj.nxt_source_line = line_obj
-            line_obj.prv_source_line = self.last_lineobj
-        self.last_lineobj = line_obj
-        self.len_lineobjs += 1
+            raise LogError("Error in %s@%d %s!" % (
+                self.name, lino, self.line_text(line)), e)
 
-        return line_obj
+        #7. lines are linked in source order by the store
+        return Line(self.store, index)
@@ -0,0 +1,150 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+from ast import literal_eval
+import re
+import sys
+
+from .. import reserved_vars as rv
+from ..service_registry import Component
+from .exc import LogError
+from .timestamps import to_seconds
+
+
+# parsed values are reused while the cache is small
+_CACHE_LIMIT = 1 << 16
+
+
+class LineFormat(object):
+    """ The declarative format of log lines, used as f_filter_logline.
+
+    The named groups of pattern are:
+    * time, as "HH:MM:SS.ffffff", parsed into time and seconds;
+    * component, mapped to a Component by components;
+    * other reserved vars, kept as strings;
+    * the groups in payloads, as "k = v" items of python literals;
+    * the others, only used to format target and thread.
+
+    target and thread are %-formats of the parsed vars, thread is formatted
+    after the payloads. Payload keys are renamed by key_alias.
+
+    line_markers are expected in pattern, the datasource only passes the
+    lines with markers, so a line is checked for markers only when it
+    doesn't match, such a line is an error.
+    """
+    def __init__(self, pattern, components,
+                 payloads=(),
+                 payload_sep=",",
+                 payload_eq="=",
+                 key_alias=None,
+                 target=None,
+                 thread=None,
+                 line_markers=None):
+        assert isinstance(pattern, str)
+        assert isinstance(components, dict)
+        assert all(isinstance(c, Component) for c in components.values())
+        assert payload_sep and payload_eq
+
+        self.pattern = pattern
+        self.components = components
+        if isinstance(payloads, str):
+            payloads = [payloads]
+        self.payloads = tuple(payloads)
+        self.payload_sep = payload_sep
+        self.payload_eq = payload_eq
+        self.key_alias = dict(key_alias or {})
+        self.target = target
+        self.thread = thread
+        if isinstance(line_markers, str):
+            line_markers = [line_markers]
+        self.line_markers = tuple(line_markers or ())
+
+        self._re = re.compile(pattern)
+        groups = set(self._re.groupindex)
+        for name in self.payloads:
+            if name not in groups:
+                raise RuntimeError("Payload group %s is not in %s"
+                        % (name, pattern))
+        self._var_groups = [
+                g for g in sorted(groups, key=self._re.groupindex.get)
+                if g in rv.ALL_VARS and g not in self.payloads
+                and g not in {rv.TIME, rv.COMPONENT}]
+        self._has_time = rv.TIME in groups
+        self._has_component = rv.COMPONENT in groups
+
+        self._keys = {}
+        self._values = {}
+
+    def __repr__(self):
+        return "<LineFormat %r payloads=%r sep=%r eq=%r alias=%r target=%r "\
+               "thread=%r markers=%r components=%r>" % (
+                   self.pattern, self.payloads, self.payload_sep,
+                   self.payload_eq, sorted(self.key_alias.items()),
+                   self.target, self.thread, self.line_markers,
+                   sorted((k, c.name) for k, c in self.components.items()))
+
+    def _parse_payload(self, payload, var_dict):
+        payload = payload.strip()
+        if not payload:
+            return
+        keys = self._keys
+        values = self._values
+        try:
+            for item in payload.split(self.payload_sep):
+                k, v = item.split(self.payload_eq, 1)
+                key = keys.get(k)
+                if key is None:
+                    key = k.strip()
+                    key = sys.intern(self.key_alias.get(key, key))
+                    keys[k] = key
+                val = values.get(v, values)
+                if val is values:
+                    val = literal_eval(v.strip())
+                    if len(values) >= _CACHE_LIMIT:
+                        values.clear()
+                    values[v] = val
+                var_dict[key] = val
+        except Exception:
+            raise RuntimeError("Cannot evaluate %s" % payload)
+
+    def __call__(self, line, var_dict):
+        match = self._re.match(line)
+        if match is None:
+            if any(marker in line for marker in self.line_markers):
+                raise LogError("Line doesn't match %s" % self.pattern)
+            return False
+        groups = match.groupdict()
+
+        if self._has_time:
+            time = groups[rv.TIME]
+            var_dict[rv.TIME] = time
+            var_dict[rv.SECONDS] = to_seconds(time)
+        if self._has_component:
+            comp = groups[rv.COMPONENT]
+            c_obj = self.components.get(comp)
+            if c_obj is None:
+                raise RuntimeError("Unknown component: %s" % comp)
+            var_dict[rv.COMPONENT] = c_obj
+        if self.target is not None:
+            var_dict[rv.TARGET] = self.target % groups
+        for name in self._var_groups:
+            var_dict[name] = groups[name]
+        for name in self.payloads:
+            self._parse_payload(groups[name], var_dict)
+        if self.thread is not None:
+            groups.update(var_dict)
+            var_dict[rv.THREAD] = self.thread % groups
+        return True
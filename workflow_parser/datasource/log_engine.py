@@ -17,16 +17,21 @@ from __future__ import print_function
 from abc import ABCMeta
 from abc import abstractmethod
 from collections import defaultdict
+import mmap
+import multiprocessing
 import os
 from os import path
+import re
 import sys
 
 from .. import reserved_vars as rv
 from ..service_registry import Component
 from ..service_registry import ServiceRegistry
+from . import Interner
 from . import Line
 from . import Source
 from .exc import LogError
+from .parse_cache import ParseCache
 
 
 class DriverPlugin(object):
@@ -35,14 +40,33 @@ class DriverPlugin(object):
     def __init__(self,
             f_filter_logfile,
             f_filter_logline,
-            extensions):
+            extensions,
+            line_markers=None):
         self._extensions = extensions
         self.f_filter_logfile = f_filter_logfile
         self.f_filter_logline = f_filter_logline
 
+        # lines without any of the markers are skipped in bulk, before
+        # f_filter_logline is called
+        if line_markers is None:
+            line_markers = getattr(f_filter_logline, "line_markers", None)
+        if isinstance(line_markers, str):
+            line_markers = [line_markers]
+        self.line_markers = tuple(sorted(set(line_markers or ())))
+        if self.line_markers:
+            for marker in self.line_markers:
+                if not isinstance(marker, str) or not marker\
+                        or "\n" in marker:
+                    raise LogError("(LogDriver) invalid line marker %r"
+                            % marker)
+            self.marker_re = re.compile(b"|".join(
+                re.escape(marker.encode()) for marker in self.line_markers))
+        else:
+            self.marker_re = None
+
     def _purge_dict_empty_values(self, var_dict):
-        for k in var_dict.keys():
-            if var_dict[k] in {None, ""}:
+        for k, v in list(var_dict.items()):
+            if v in {None, ""}:
                 var_dict.pop(k)
 
     def do_filter_logfile(self, f_dir, f_name):
@@ -98,7 +122,10 @@ class DriverPlugin(object):
 
 
 class FileDatasource(object):
-    def __init__(self, name, f_dir, vs, sr, plugin):
+    # bytes scanned at a time by the line markers
+    _chunk_size = 1 << 22
+
+    def __init__(self, name, f_dir, vs, sr, plugin, interner=None):
         assert isinstance(sr, ServiceRegistry)
         assert isinstance(plugin, DriverPlugin)
 
@@ -106,9 +133,16 @@ class FileDatasource(object):
         self.plugin = plugin
         self.name = name
         self.f_dir = f_dir
+        self.f_name = path.basename(f_dir)
         self.total_lines = 0
+        # bytes read by tail_records()
+        self.offset = 0
 
-        self.source = Source(name, f_dir, vs)
+        # for the parse cache
+        self.file_vars = None
+        self.cached = None
+
+        self.source = Source(name, f_dir, vs, interner)
 
         self.requests = set()
 
@@ -140,86 +174,301 @@ class FileDatasource(object):
     #     for line in _flush_line():
     #         yield line
 
-    def yield_lineobjs(self, targets_byname):
-        with open(self.f_dir, 'r') as reader:
-            for line in reader:
+    def yield_records(self):
+        """ Yield (lino, (offset, length), vs) of the accepted lines.
+
+        The file is mapped rather than read, lines keep their byte span and
+        the text is read back from the file on demand.
+        """
+        with open(self.f_dir, 'rb') as reader:
+            if not os.fstat(reader.fileno()).st_size:
+                return
+            buf = mmap.mmap(reader.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.plugin.marker_re is None:
+                raws = self._iter_lines(buf)
+            else:
+                raws = self._iter_marked_lines(buf, self.plugin.marker_re)
+            for lino, offset, raw in raws:
+                if_proceed, vs = self.plugin.do_filter_logline(
+                        raw.decode(), lino, self.name)
+                if if_proceed:
+                    yield lino, (offset, len(raw)), vs
+        finally:
+            buf.close()
+
+    def _iter_lines(self, buf):
+        offset = 0
+        for raw in iter(buf.readline, b""):
+            self.total_lines += 1
+            yield self.total_lines, offset, raw
+            offset += len(raw)
+
+    def _iter_marked_lines(self, buf, marker_re):
+        # only the lines with markers, the others are just counted
+        size = len(buf)
+        base = 0
+        while base < size:
+            end = size
+            if base + self._chunk_size < size:
+                end = buf.find(b"\n", base + self._chunk_size)
+                end = size if end < 0 else end + 1
+            chunk = buf[base:end]
+
+            pos = 0
+            match = marker_re.search(chunk)
+            while match is not None:
+                start = chunk.rfind(b"\n", pos, match.start())
+                start = pos if start < 0 else start + 1
+                stop = chunk.find(b"\n", match.end())
+                stop = len(chunk) if stop < 0 else stop + 1
+                self.total_lines += chunk.count(b"\n", pos, start) + 1
+                yield self.total_lines, base + start, chunk[start:stop]
+                pos = stop
+                match = marker_re.search(chunk, pos)
+            self.total_lines += chunk.count(b"\n", pos)
+            if pos < len(chunk) and not chunk.endswith(b"\n"):
+                # the last line without a newline
+                self.total_lines += 1
+            base = end
+
+    def tail_records(self):
+        """ Yield records of the complete lines after the saved offset. """
+        if path.getsize(self.f_dir) < self.offset:
+            raise LogError("%s is truncated, cannot follow it" % self.f_dir)
+
+        with open(self.f_dir, 'rb') as reader:
+            reader.seek(self.offset)
+            for raw in reader:
+                if not raw.endswith(b"\n"):
+                    # partially written, read it again in the next call
+                    break
+                offset = self.offset
+                self.offset += len(raw)
                 self.total_lines += 1
                 lino = self.total_lines
+                marker_re = self.plugin.marker_re
+                if marker_re is not None and marker_re.search(raw) is None:
+                    continue
 
                 if_proceed, vs = self.plugin.do_filter_logline(
-                        line, lino, self.name)
+                        raw.decode(), lino, self.name)
                 if if_proceed:
-                    # convert component
-                    component = vs.get(rv.COMPONENT)
-                    if component is not None:
-                        c_obj = self.sr.f_to_component(component)
-                        if not c_obj:
-                            raise LogError(
-                                    "Error in %s@%d %s: unrecognized component %s"
-                                    % (self.name, lino, line, component))
-                        else:
-                            vs[rv.COMPONENT] = c_obj
-                    # collect requests
-                    request = vs.get(rv.REQUEST)
-                    if request is not None:
-                        self.requests.add(request)
-
-                    lineobj = self.source.append_line(
-                            lino, line, vs, targets_byname)
-                    yield lineobj
+                    yield lino, (offset, len(raw)), vs
+
+    def append_record(self, lino, line, vs, targets_byname):
+        # convert component
+        component = vs.get(rv.COMPONENT)
+        if component is not None:
+            c_obj = self.sr.f_to_component(component)
+            if not c_obj:
+                raise LogError(
+                        "Error in %s@%d %s: unrecognized component %s"
+                        % (self.name, lino, self.source.line_text(line),
+                           component))
+            else:
+                vs[rv.COMPONENT] = c_obj
+        # collect requests
+        request = vs.get(rv.REQUEST)
+        if request is not None:
+            self.requests.add(request)
+
+        return self.source.append_line(lino, line, vs, targets_byname)
+
+    def yield_lineobjs(self, targets_byname):
+        for lino, line, vs in self.yield_records():
+            yield self.append_record(lino, line, vs, targets_byname)
+
+    @classmethod
+    def create_byfile(cls, log_folder, f_name, sr, plugin, cache=None,
+                      interner=None):
+        f_dir = path.join(log_folder, f_name)
+        entry = None
+        if cache is not None and path.isfile(f_dir):
+            entry = cache.load(f_name, f_dir)
+        if entry is not None:
+            if_proceed, vs = True, entry[0]
+        else:
+            if_proceed, vs = plugin.do_filter_logfile(f_dir, f_name)
+        if not if_proceed:
+            return None
+
+        file_vars = _compact_vars(dict(vs))
+        # convert component
+        component = vs.get(rv.COMPONENT)
+        if component is not None:
+            c_obj = sr.f_to_component(component)
+            if not c_obj:
+                raise LogError(
+                        "Error in %s: unrecognized component %s"
+                        % (f_name, component))
+            else:
+                vs[rv.COMPONENT] = c_obj
+        ds = cls(f_name.rsplit(".", 1)[0], f_dir, vs, sr, plugin, interner)
+        ds.file_vars = file_vars
+        if entry is not None:
+            ds.cached = entry[1:]
+        return ds
 
     @classmethod
-    def create_byfolder(cls, log_folder, sr, plugin):
+    def create_byfolder(cls, log_folder, sr, plugin, cache=None):
         assert isinstance(log_folder, str)
         assert isinstance(plugin, DriverPlugin)
 
+        # the interned values of this load
+        interner = Interner()
         datasources = []
         # current_path = path.dirname(os.path.realpath(__file__))
         current_path = os.getcwd()
         log_folder = path.join(current_path, log_folder)
         for f_name in os.listdir(log_folder):
-            f_dir = path.join(log_folder, f_name)
-            if_proceed, vs = plugin.do_filter_logfile(f_dir, f_name)
-            if if_proceed:
-                # convert component
-                component = vs.get(rv.COMPONENT)
-                if component is not None:
-                    c_obj = self.sr.f_to_component(component)
-                    if not c_obj:
-                        raise LogError(
-                                "Error in %s: unrecognized component %s"
-                                % (f_name, component))
-                    else:
-                        vs[rv.COMPONENT] = c_obj
-                ds = cls(f_name.rsplit(".", 1)[0], f_dir, vs, sr, plugin)
+            ds = cls.create_byfile(log_folder, f_name, sr, plugin, cache,
+                                   interner)
+            if ds is not None:
                 datasources.append(ds)
 
+        if cache is not None:
+            cache.evict_missing(ds.f_name for ds in datasources)
+
         return log_folder, datasources
 
+
+class LogTailer(object):
+    """ Follow a live log folder.
+
+    Each poll() reads the complete lines appended since the previous poll,
+    and picks up log files created in the meantime.
+    """
+    def __init__(self, log_folder, sr, plugin):
+        assert isinstance(log_folder, str)
+        assert isinstance(sr, ServiceRegistry)
+        assert isinstance(plugin, DriverPlugin)
+
+        self.log_folder = path.join(os.getcwd(), log_folder)
+        self.sr = sr
+        self.plugin = plugin
+
+        self.datasources = []
+        self.targets_byname = {}
+        self.interner = Interner()
+        self._seen_fnames = set()
+
+    def poll(self):
+        for f_name in sorted(os.listdir(self.log_folder)):
+            if f_name in self._seen_fnames:
+                continue
+            f_dir = path.join(self.log_folder, f_name)
+            if path.isfile(f_dir) and not path.getsize(f_dir):
+                # filter the file after something is written
+                continue
+            self._seen_fnames.add(f_name)
+            ds = FileDatasource.create_byfile(
+                    self.log_folder, f_name, self.sr, self.plugin,
+                    interner=self.interner)
+            if ds is not None:
+                self.datasources.append(ds)
+
+        new_lineobjs = 0
+        for datasource in self.datasources:
+            for lino, line, vs in datasource.tail_records():
+                datasource.append_record(lino, line, vs, self.targets_byname)
+                new_lineobjs += 1
+        return new_lineobjs
+
+
 # step1: load related log files
-def loadsources(log_folder, sr, plugin):
+def loadsources(log_folder, sr, plugin, cache=False):
     print("Load data sources...")
+    parse_cache = None
+    if cache:
+        parse_cache = ParseCache(path.join(os.getcwd(), log_folder), plugin)
     log_folder, datasources = FileDatasource.create_byfolder(
-        log_folder, sr, plugin)
+        log_folder, sr, plugin, parse_cache)
     print("---------------")
 
     #### summary ####
     print("%d datasources from %s" % (len(datasources), log_folder))
     print()
 
-    return datasources
+    return datasources, parse_cache
+
+def _compact_vars(vs):
+    # components are resolved by name when the record is appended
+    component = vs.get(rv.COMPONENT)
+    if isinstance(component, Component):
+        vs[rv.COMPONENT] = component.name
+    return vs
+
+def _parse_records(datasource):
+    records = []
+    for lino, line, vs in datasource.yield_records():
+        records.append((lino, line, _compact_vars(vs)))
+    return datasource.total_lines, records
+
+# parallel read: workers are forked after _pool_datasources is set, so
+# datasources and the driver plugin are inherited rather than pickled.
+_pool_datasources = None
+
+def _parse_records_inpool(index):
+    return _parse_records(_pool_datasources[index])
+
+def _use_pool(processes, datasources):
+    return processes and processes > 1 and len(datasources) > 1 \
+        and "fork" in multiprocessing.get_all_start_methods()
+
+def _parse_records_parallel(datasources, processes):
+    global _pool_datasources
+    ctx = multiprocessing.get_context("fork")
+    _pool_datasources = datasources
+    pool = ctx.Pool(min(processes, len(datasources)))
+    try:
+        for ret in pool.imap(_parse_records_inpool, range(len(datasources))):
+            yield ret
+    finally:
+        pool.terminate()
+        pool.join()
+        _pool_datasources = None
+
+def _yield_records(datasources, processes, cache):
+    to_parse = [ds for ds in datasources if ds.cached is None]
+    if _use_pool(processes, to_parse):
+        print("Read data sources (%d processes)..."
+                % min(processes, len(to_parse)))
+        parsed = _parse_records_parallel(to_parse, processes)
+    else:
+        print("Read data sources...")
+        parsed = (_parse_records(ds) for ds in to_parse)
+
+    # merged in file order, identical to the serial path
+    for datasource in datasources:
+        if datasource.cached is not None:
+            total_lines, records = datasource.cached
+            datasource.cached = None
+        else:
+            total_lines, records = next(parsed)
+            if cache is not None:
+                cache.store(datasource.f_name, datasource.f_dir,
+                            datasource.file_vars, total_lines, records)
+        datasource.total_lines = total_lines
+        yield datasource, records
 
 # step2: read sources
-def readsources(datasources, sr, report):
+def readsources(datasources, sr, report, processes=None, cache=None):
     targets_byname = {}
     targets_byhost = defaultdict(list)
     targets_bycomponent = defaultdict(list)
     threads = set()
 
-    print("Read data sources...")
-    for datasource in datasources:
-        for line_obj in datasource.yield_lineobjs(targets_byname):
-            pass
+    if cache is not None or _use_pool(processes, datasources):
+        for datasource, records in _yield_records(
+                datasources, processes, cache):
+            for lino, line, vs in records:
+                datasource.append_record(lino, line, vs, targets_byname)
+    else:
+        print("Read data sources...")
+        for datasource in datasources:
+            for line_obj in datasource.yield_lineobjs(targets_byname):
+                pass
     for targetobj in targets_byname.values():
         if not isinstance(targetobj.target, str) or not targetobj.target:
             raise LogError("%s has invalid target: %s" % (
@@ -236,6 +485,9 @@ def readsources(datasources, sr, report):
     print("---------------")
 
     #### summary ####
+    if cache is not None:
+        print("parse cache: %d hits, %d stored, %d evicted"
+                % (cache.hits, cache.stored, cache.evicted))
     total_targets = len(targets_byname)
     total_hosts = len(targets_byhost)
     total_components = len(targets_bycomponent)
@@ -298,8 +550,8 @@ def readsources(datasources, sr, report):
                         request=len(requests))
     return targets_byname
 
-def proceed(logfolder, sr, plugin, report):
-    datasources = loadsources(logfolder, sr, plugin)
-    targetobjs = readsources(datasources, sr, report)
+def proceed(logfolder, sr, plugin, report, processes=None, cache=False):
+    datasources, parse_cache = loadsources(logfolder, sr, plugin, cache)
+    targetobjs = readsources(datasources, sr, report, processes, parse_cache)
 
     return targetobjs
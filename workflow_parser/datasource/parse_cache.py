@@ -0,0 +1,177 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+import hashlib
+import marshal
+import os
+from os import path
+import sys
+import types
+import zlib
+
+from .. import reserved_vars as rv
+from .timestamps import is_derivable
+from .timestamps import to_seconds_array
+
+
+CACHE_FOLDER = ".wfcache"
+CACHE_EXT = ".cache"
+CACHE_VERSION = 3
+_MAGIC = b"WFPC"
+
+
+def _module_file(func):
+    module = sys.modules.get(getattr(func, "__module__", None))
+    f_dir = getattr(module, "__file__", None)
+    if f_dir and f_dir.endswith(".pyc"):
+        f_dir = f_dir[:-1]
+    return f_dir
+
+
+def hash_driver(plugin):
+    hasher = hashlib.sha1()
+    hasher.update(("%d:%d" % (CACHE_VERSION, marshal.version)).encode())
+    for func in (plugin.f_filter_logfile, plugin.f_filter_logline):
+        f_dir = _module_file(func)
+        if f_dir and path.isfile(f_dir):
+            with open(f_dir, "rb") as reader:
+                hasher.update(reader.read())
+        if not isinstance(func, types.FunctionType):
+            # e.g. a LineFormat, whose module is not the driver
+            hasher.update(repr(func).encode())
+    hasher.update(repr(sorted(plugin._extensions)).encode())
+    hasher.update(repr(plugin.line_markers).encode())
+    return hasher.hexdigest()
+
+
+def _pack_records(records):
+    # seconds derivable from the time are recomputed in batch on load
+    packed = []
+    for lino, line, vs in records:
+        time = vs.get(rv.TIME)
+        if time is not None and rv.SECONDS in vs\
+                and is_derivable(time, vs[rv.SECONDS]):
+            vs = dict(vs)
+            del vs[rv.SECONDS]
+        packed.append((lino, line, vs))
+    return packed
+
+
+def _unpack_records(records):
+    unpacked = [vs for _, _, vs in records
+                if rv.SECONDS not in vs and rv.TIME in vs]
+    if unpacked:
+        seconds = to_seconds_array([vs[rv.TIME] for vs in unpacked])
+        for vs, sec in zip(unpacked, seconds.tolist()):
+            vs[rv.SECONDS] = sec
+    return records
+
+
+class ParseCache(object):
+    """ Filtered lines of each log file, stored under the log folder.
+
+    Entries are keyed by file path, size, mtime and the driver hash, and
+    are evicted when any of them changes.
+    """
+    def __init__(self, log_folder, plugin):
+        driver_file = _module_file(plugin.f_filter_logfile)
+        if driver_file:
+            driver_name = path.basename(driver_file).rsplit(".", 1)[0]
+        else:
+            driver_name = "driver"
+        self.folder = path.join(log_folder, CACHE_FOLDER, driver_name)
+        self.driver_hash = hash_driver(plugin)
+
+        self.hits = 0
+        self.evicted = 0
+        self.stored = 0
+
+    def __repr__(self):
+        return "<ParseCache %s: %d hits, %d evicted, %d stored>" % (
+                self.folder, self.hits, self.evicted, self.stored)
+
+    def _entry_dir(self, f_name):
+        return path.join(self.folder, f_name + CACHE_EXT)
+
+    def _fingerprint(self, f_dir):
+        stat = os.stat(f_dir)
+        return (f_dir, stat.st_size, stat.st_mtime_ns, self.driver_hash)
+
+    def _evict(self, entry_dir):
+        try:
+            os.remove(entry_dir)
+            self.evicted += 1
+        except OSError:
+            pass
+
+    def load(self, f_name, f_dir):
+        """ Return (file_vars, total_lines, records) or None. """
+        entry_dir = self._entry_dir(f_name)
+        if not path.isfile(entry_dir):
+            return None
+
+        try:
+            with open(entry_dir, "rb") as reader:
+                magic = reader.read(len(_MAGIC))
+                if magic != _MAGIC:
+                    raise ValueError("bad magic")
+                version, fingerprint = marshal.load(reader)
+                if version != CACHE_VERSION\
+                        or tuple(fingerprint) != self._fingerprint(f_dir):
+                    raise ValueError("stale")
+                file_vars, total_lines, records = marshal.loads(
+                        zlib.decompress(reader.read()))
+        except (OSError, EOFError, ValueError, TypeError, zlib.error):
+            self._evict(entry_dir)
+            return None
+
+        self.hits += 1
+        return file_vars, total_lines, _unpack_records(records)
+
+    def store(self, f_name, f_dir, file_vars, total_lines, records):
+        entry_dir = self._entry_dir(f_name)
+        try:
+            payload = zlib.compress(
+                    marshal.dumps((file_vars, total_lines,
+                                   _pack_records(records))), 1)
+        except ValueError as e:
+            # vars of unsupported types are not cached
+            print("! WARN ! cannot cache %s: %s" % (f_name, e))
+            return
+
+        tmp_dir = entry_dir + ".tmp"
+        try:
+            if not path.exists(self.folder):
+                os.makedirs(self.folder)
+            with open(tmp_dir, "wb") as writer:
+                writer.write(_MAGIC)
+                marshal.dump(
+                        (CACHE_VERSION, self._fingerprint(f_dir)), writer)
+                writer.write(payload)
+            os.replace(tmp_dir, entry_dir)
+            self.stored += 1
+        except OSError as e:
+            print("! WARN ! cannot write cache %s: %s" % (entry_dir, e))
+
+    def evict_missing(self, f_names):
+        """ Drop entries of log files no longer in the folder. """
+        if not path.isdir(self.folder):
+            return
+        f_names = set(f_names)
+        for entry_name in os.listdir(self.folder):
+            if not entry_name.endswith(CACHE_EXT)\
+                    or entry_name[:-len(CACHE_EXT)] not in f_names:
+                self._evict(path.join(self.folder, entry_name))
@@ -0,0 +1,89 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import re
+
+import numpy as np
+
+
+# times as "HH:MM:SS.ffffff", that format_time() gives back from seconds
+_CANONICAL_RE = re.compile(r"\d\d:[0-5]\d:[0-5]\d\.\d{6}\Z")
+
+# consecutive lines share the "HH:MM" prefix
+_seconds_byprefix = {}
+
+
+def _prefix_seconds(prefix):
+    base = _seconds_byprefix.get(prefix)
+    if base is None:
+        h, m = prefix.split(":")
+        base = int(h) * 3600 + int(m) * 60
+        _seconds_byprefix[prefix] = base
+    return base
+
+
+def to_seconds(time):
+    prefix, _, sec = time.rpartition(":")
+    return _prefix_seconds(prefix) + float(sec)
+
+
+def _canonical_seconds(times):
+    # digits of fixed-width times, the fractions are divided as integers so
+    # that they round the same as float()
+    codes = np.ascontiguousarray(times).view(np.uint32)
+    codes = codes.reshape(times.shape + (15,))
+    if not ((codes[..., 2] == ord(":")) & (codes[..., 5] == ord(":"))
+            & (codes[..., 8] == ord("."))).all():
+        return None
+    digits = codes.astype(np.int64) - ord("0")
+    if ((digits < 0) | (digits > 9))[..., [0, 1, 3, 4, 6, 7, 9, 10, 11,
+                                           12, 13, 14]].any():
+        return None
+    micros = digits[..., 6] * 10 + digits[..., 7]
+    for i in range(9, 15):
+        micros = micros * 10 + digits[..., i]
+    return (digits[..., 0] * 36000 + digits[..., 1] * 3600
+            + digits[..., 3] * 600 + digits[..., 4] * 60)\
+        + micros / 1e6
+
+
+def to_seconds_array(times):
+    """ Convert a sequence of times to a float64 array of seconds. """
+    times = np.asarray(times, dtype=np.str_)
+    if not times.size:
+        return np.empty(times.shape, dtype=np.float64)
+    if times.dtype == np.dtype("U15"):
+        seconds = _canonical_seconds(times)
+        if seconds is not None:
+            return seconds
+
+    parts = np.char.rpartition(times, ":")
+    prefixes, inverse = np.unique(parts[..., 0], return_inverse=True)
+    bases = np.array([_prefix_seconds(str(p)) for p in prefixes],
+                     dtype=np.int64)
+    return bases[inverse.reshape(times.shape)]\
+        + parts[..., 2].astype(np.float64)
+
+
+def format_time(seconds):
+    hours = int(seconds // 3600)
+    minutes = int((seconds - hours * 3600) // 60)
+    return "%02d:%02d:%09.6f" % (hours, minutes,
+                                 seconds - hours * 3600 - minutes * 60)
+
+
+def is_derivable(time, seconds):
+    """ If time is exactly format_time(seconds), so it needn't be kept. """
+    return _CANONICAL_RE.match(time) is not None\
+        and to_seconds(time) == seconds
@@ -15,6 +15,7 @@
 import sys
 
 from . import reserved_vars as rv
+from .datasource.line_format import LineFormat
 from .datasource.log_engine import DriverPlugin
 from .graph import Master
 from .service_registry import ServiceRegistry
@@ -30,8 +31,9 @@ class Driver(DriverPlugin):
         self.graph = graph
 
         # f_filter_logfile(self, f_dir, f_name):
-        # f_filter_logline(self, line):
+        # f_filter_logline(self, line): or a LineFormat
         # extentions = ["log"]
+        # line_markers = None, or strings one of which is in valid lines
         super(Driver, self).__init__(**kwgs)
 
 
@@ -43,7 +45,8 @@ def register_driver(module_name,
         services, graph,
         f_filter_logfile,
         f_filter_logline,
-        extensions=None):
+        extensions=None,
+        line_markers=None):
 
     if not extensions:
         extensions = ["log"]
@@ -53,7 +56,8 @@ def register_driver(module_name,
             graph=graph,
             f_filter_logfile=f_filter_logfile,
             f_filter_logline=f_filter_logline,
-            extensions=extensions)
+            extensions=extensions,
+            line_markers=line_markers)
 
     if module_name == "__main__":
         from .loader import execute
@@ -64,4 +68,4 @@ def register_driver(module_name,
         module.__all__ = [graph.name]
 
 
-__all__ = ["init", "register_driver"]
+__all__ = ["init", "register_driver", "LineFormat"]
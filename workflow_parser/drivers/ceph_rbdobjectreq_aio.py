@@ -13,6 +13,7 @@
 # under the License.
 
 from workflow_parser.driver import init
+from workflow_parser.driver import LineFormat
 from workflow_parser.driver import register_driver
 
 
@@ -151,69 +152,24 @@ def filter_logfile(f_dir, f_name, var_dict):
         return True
 
 
-def filter_logline(line, var_dict):
-    if " rbdobjectreq:" not in line:
-        return False
-
-    # time, seconds
-    lines = line.split(" ", 1)
-    line = lines[1]
-    time = lines[0][1:-1]
-    var_dict[rv.TIME] = time
-    _time_s = time.split(":")
-    seconds = int(_time_s[0]) * 3600 + int(_time_s[1]) * 60 + float(_time_s[2])
-    var_dict[rv.SECONDS] = seconds
-
-    # component, target
-    lines = line.split(" ", 2)
-    line = lines[2]
-    _comp = lines[1].split(":")
-    comp = _comp[1]
-    if comp == "python":
-        comp = client
-    elif comp == "fio":
-        comp = client
-    elif comp == "qemu-system-x86":
-        comp = client
-    else:
-        raise RuntimeError("Unknown component: %s" % comp)
-    var_dict[rv.COMPONENT] = comp
-    target_alias = _comp[1] + ":" + _comp[2]
-    var_dict[rv.TARGET] = target_alias
-
-    # keyword
-    lines = line.split(" ", 1)
-    line = lines[1]
-    var_dict[rv.KEYWORD] = lines[0].split(":", 1)[1][:-1]
-
-    def _convert(dict_str):
-        try:
-            ret = {}
-            dict_str = dict_str.strip()
-            if dict_str:
-                items = dict_str.split(", ")
-                for item in items:
-                    k, v = item.strip().split(" = ", 1)
-                    k = k.strip()
-                    ret[k] = eval(v.strip())
-        except Exception:
-            raise RuntimeError("Cannot evaluate %s" % dict_str)
-        return ret
-
-    # thread
-    lines = line.split(" }, { ")
-    # dict_ = _convert(lines[0].strip()[1:])
-    # var_dict[rv.THREAD] = str(dict_["cpu_id"])
-    dict1_ = _convert(lines[1])
-    var_dict.update(dict1_)
-    dict2_ = _convert(lines[2].strip()[:-1])
-    var_dict.update(dict2_)
-    var_dict[rv.THREAD] = str(var_dict["pthread_id"])
-
-    return True
+# [time] host ust:component:pid rbdobjectreq:keyword: { cpu_id = n },
+# { pthread_id = n }, { k = v, ... }
+line_format = LineFormat(
+        r"\[(?P<time>[^\]]*)\] \S+ ust:(?P<component>[^:]*):(?P<pid>\S*)"
+        r" rbdobjectreq:(?P<keyword>\S*): \{ [^}]*\}, \{ ?(?P<context>.*?) ?\},"
+        r" \{ ?(?P<payload>.*?) ?\}\s*$",
+        components={"python": client,
+                    "fio": client,
+                    "qemu-system-x86": client},
+        payloads=["context", "payload"],
+        payload_sep=", ",
+        payload_eq=" = ",
+        target="%(component)s:%(pid)s",
+        thread="%(pthread_id)s",
+        line_markers=" rbdobjectreq:")
 
 
 register_driver(
         __name__, sr, graph,
-        filter_logfile, filter_logline,
+        filter_logfile, line_format,
         ["ctraces"])
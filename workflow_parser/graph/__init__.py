@@ -17,6 +17,7 @@ from abc import abstractmethod
 from abc import abstractproperty
 from collections import defaultdict
 from collections import OrderedDict
+from contextlib import contextmanager
 from orderedset import OrderedSet
 
 from ..service_registry import Component
@@ -117,6 +118,10 @@ class NodeBase(object):
         self.vis_weight = 0
         self.request_state = None
 
+        # keyword dispatch, see decide_edge()
+        self._edge_bykeyword = {}
+        self._edge_memo = {}
+
     @property
     def is_start(self):
         return self in self.graph.start_nodes
@@ -192,17 +197,33 @@ class NodeBase(object):
                         conflict.name, conflict.keyword,
                         edge.name, edge.keyword))
         self.edges.add(edge)
+        self._edge_bykeyword.setdefault(edge.keyword, edge)
+        self._edge_memo.clear()
+        self.graph.master._invalidate_dispatch()
         self.graph.register_edge(self, edge)
         return ret_edge, ret_tonode
 
-    def decide_edge(self, keyword):
-        assert isinstance(keyword, str)
-
+    def _match_edge(self, keyword):
+        # NOTE: an exact match is also the first substring match, because
+        # build() rejects an edge whose keyword contains an earlier one.
+        edge = self._edge_bykeyword.get(keyword)
+        if edge is not None:
+            return edge
         for edge in self.edges:
             if edge.keyword in keyword:
                 return edge
         return None
 
+    def decide_edge(self, keyword):
+        assert isinstance(keyword, str)
+
+        try:
+            return self._edge_memo[keyword]
+        except KeyError:
+            edge = self._match_edge(keyword)
+            self._edge_memo[keyword] = edge
+            return edge
+
 
 class EdgeBase(object):
     __metaclass__ = ABCMeta
@@ -655,6 +676,7 @@ class ThreadGraph(GraphBase):
         for node in graph.end_nodes:
             self.end_nodes.add(node)
         self.master._remove_thread(graph)
+        self.master._invalidate_dispatch()
 
 
 class MasterBase(object):
@@ -688,6 +710,11 @@ class Master(JoinMasterMixin, GraphNamespaceMixin, MasterBase):
         self.marks = OrderedSet()
         self.seen_edges = OrderedSet()
 
+        # (component, keyword) -> (start node, edge)
+        self._startedge_memo = {}
+        # thread graphs allowed to start thread instances, None is all
+        self._selected_threadgraphs = None
+
     @property
     def request_types(self):
         return list(self.req_startnode_bytype.keys())
@@ -775,12 +802,135 @@ class Master(JoinMasterMixin, GraphNamespaceMixin, MasterBase):
         assert graph.master is self
 
         self.thread_graphs.remove(graph)
-        self.threadgraphs_bycomponent(graph.component).discard(graph)
+        self.threadgraphs_bycomponent[graph.component].discard(graph)
         self._threadgraph_index = 0
         for thread_graph in self.thread_graphs:
             self._threadgraph_index += 1
             thread_graph.name = "gt%d" % self._threadgraph_index
 
+    def _invalidate_dispatch(self):
+        self._startedge_memo.clear()
+
+    def decide_startedge(self, keyword, component):
+        """ Find the first start node of the component's thread graphs
+        that accepts the keyword, return (start node, edge) or None. """
+        key = (component, keyword)
+        try:
+            return self._startedge_memo[key]
+        except KeyError:
+            ret = None
+            selected = self._selected_threadgraphs
+            for t_g in self.threadgraphs_bycomponent.get(component, ()):
+                if selected is not None and t_g not in selected:
+                    continue
+                for s_node in t_g.start_nodes:
+                    edge = s_node.decide_edge(keyword)
+                    if edge:
+                        ret = (s_node, edge)
+                        break
+                if ret:
+                    break
+            self._startedge_memo[key] = ret
+            return ret
+
+    def _link_threadgraphs(self):
+        # thread graphs calling each function graph, directly or not
+        callers_byfunc = defaultdict(set)
+        for t_g in self.thread_graphs:
+            funcs = set()
+            graphs = [t_g]
+            while graphs:
+                for edge in graphs.pop().edges:
+                    if isinstance(edge, ClEdge)\
+                            and edge.func_graph not in funcs:
+                        funcs.add(edge.func_graph)
+                        graphs.append(edge.func_graph)
+            for f_g in funcs:
+                callers_byfunc[f_g].add(t_g)
+
+        def owners(edge):
+            if isinstance(edge.graph, ThreadGraph):
+                return {edge.graph}
+            return callers_byfunc[edge.graph]
+
+        linked = defaultdict(set)
+        def link(from_edge, to_edge):
+            for from_g in owners(from_edge):
+                for to_g in owners(to_edge):
+                    linked[from_g].add(to_g)
+                    linked[to_g].add(from_g)
+        for jo in self.inner_joinobjs:
+            link(jo.from_item, jo.to_item)
+        for jo in self.cross_joinobjs:
+            link(jo.caller_real, jo.callee)
+        return linked
+
+    def select_threadgraphs(self, request_types=None, components=None):
+        """ Return the thread graphs that requests of request_types go
+        through, and that join with the thread graphs of components. None
+        is not to filter.
+
+        Thread graphs are linked by joins, a thread graph is not reached if
+        it can only start requests of the other types. The peers that the
+        graphs of components join to are kept, so that requests complete.
+        """
+        linked = self._link_threadgraphs()
+        def _reach(graphs, allowed):
+            reached = set(graphs)
+            graphs = list(reached)
+            while graphs:
+                for t_g in linked[graphs.pop()]:
+                    if t_g not in reached and t_g in allowed:
+                        reached.add(t_g)
+                        graphs.append(t_g)
+            return reached
+
+        reached = set(self.thread_graphs)
+        if request_types is not None:
+            request_types = set(request_types)
+            unknown = request_types - self.req_startnode_bytype.keys()
+            if unknown:
+                raise RuntimeError("Unknown request types: %s"
+                        % ",".join(sorted(unknown)))
+
+            allowed = set()
+            for t_g in self.thread_graphs:
+                if not all(isinstance(node, ReqNode)
+                           and node.request_type not in request_types
+                           for node in t_g.start_nodes):
+                    allowed.add(t_g)
+            reached = _reach([self.req_startnode_bytype[rtype].graph
+                              for rtype in request_types], allowed)
+
+        if components is not None:
+            names = set(str(c) for c in components)
+            unknown = names - set(c.name for c in self.components)
+            if unknown:
+                raise RuntimeError("Unknown components: %s"
+                        % ",".join(sorted(unknown)))
+            reached = _reach([t_g for t_g in reached
+                              if t_g.component.name in names], reached)
+
+        if not any(isinstance(node, ReqNode) and node.is_start
+                   for t_g in reached for node in t_g.start_nodes):
+            raise RuntimeError("No request can start from thread graphs "
+                    "of request types %s, components %s"
+                    % (request_types, components))
+        return OrderedSet(t_g for t_g in self.thread_graphs
+                          if t_g in reached)
+
+    @contextmanager
+    def select(self, threadgraphs):
+        """ Only the threadgraphs can start thread instances inside. """
+        assert self._selected_threadgraphs is None
+        self._selected_threadgraphs = set(threadgraphs)
+        self._invalidate_dispatch()
+        try:
+            yield
+        finally:
+            self._selected_threadgraphs = None
+            self._invalidate_dispatch()
+
     def _register_requeststart(self, rnode):
         assert isinstance(rnode, ReqNode)
         assert rnode.is_start
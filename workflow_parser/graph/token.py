@@ -12,8 +12,6 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-from orderedset import OrderedSet
-
 from ..service_registry import Component
 from . import (ClEdge,
                FnNode,
@@ -257,14 +255,12 @@ class Token(object):
         assert isinstance(keyword, str)
         assert isinstance(component, Component)
 
-        threadgraphs = master.threadgraphs_bycomponent.get(component, OrderedSet())
-        for t_g in threadgraphs:
-            for s_node in t_g.start_nodes:
-                edge = s_node.decide_edge(keyword)
-                if edge:
-                    token = cls(s_node, master)
-                    token._step_edge(edge)
-                    return token
+        start = master.decide_startedge(keyword, component)
+        if start:
+            s_node, edge = start
+            token = cls(s_node, master)
+            token._step_edge(edge)
+            return token
         return None
 
     def do_step(self, keyword):
@@ -1,14 +1,23 @@
+import os
+
 from .analyst.report import Report
 from .analyst.draw_engine import DrawEngine
 from .analyst.automated_suite import do_statistics
 from .clockmaster import adjust_clock
+from .datasource.log_engine import LogTailer
 from .datasource.log_engine import proceed as l_proceed
+from .datasource.parse_cache import hash_driver
 from .driver import Driver
 from .utils import Report as ParserReport
+from .workflow.engine import StreamEngine
 from .workflow.engine import proceed
+from .workflow.engine.serialize import dump_requests
+from .workflow.engine.serialize import load_requests
 
 
-def _load_data(data_path, driver):
+def _load_data(data_path, driver, processes=None, cache=False,
+               indexer="hash", report_json=None, clock_solver="relax",
+               request_types=None, components=None):
     print("Load result from %s" % data_path)
     assert isinstance(driver, Driver)
     print("Load driver %s" % driver.name)
@@ -18,29 +27,38 @@ def _load_data(data_path, driver):
     print("graph:")
     print(str(master))
 
+    threadgraphs = None
+    if request_types is not None or components is not None:
+        threadgraphs = master.select_threadgraphs(request_types, components)
+        print("Select thread graphs: %s" % ",".join(
+            t_g.name for t_g in threadgraphs))
+
     report_i = ParserReport()
     requestinss = None
     try:
         # build logs
-        targets_byname = l_proceed(data_path, driver.services, driver, report_i)
+        targets_byname = l_proceed(data_path, driver.services, driver, report_i,
+                                   processes, cache)
 
         # build states
-        requestinss = proceed(targets_byname, master, report_i)
+        requestinss = proceed(targets_byname, master, report_i, indexer,
+                              processes, threadgraphs)
     except Exception:
         print("\n%r\n" % report_i)
         raise
     print("%r" % report_i)
     print()
+    if report_json:
+        report_i.dump_json(report_json)
 
     # correct clocks
-    adjust_clock(requestinss)
+    adjust_clock(requestinss, clock_solver)
 
     return requestinss
 
 
 def execute(driver):
     import argparse
-    import os
 
     parser = argparse.ArgumentParser()
     parser.add_argument('folder',
@@ -49,6 +67,35 @@ def execute(driver):
     parser.add_argument('--brief',
                         action="store_true",
                         help="Don't export report and draw figures.")
+    parser.add_argument('--processes',
+                        type=int,
+                        default=None,
+                        help="Read logs and build requests with a pool "
+                             "of processes.")
+    parser.add_argument('--cache',
+                        action="store_true",
+                        help="Cache parsed log files under the log folder.")
+    parser.add_argument('--indexer',
+                        choices=["hash", "pandas"],
+                        default="hash",
+                        help="The engine to join paces.")
+    parser.add_argument('--report-json',
+                        default=None,
+                        help="Export the per-stage report to a JSON file.")
+    parser.add_argument('--clock-solver',
+                        choices=["relax", "matrix"],
+                        default="relax",
+                        help="The engine to solve host clock offsets.")
+    parser.add_argument('--request-types',
+                        nargs="+",
+                        default=None,
+                        help="Only build the thread graphs that "
+                             "requests of these types go through.")
+    parser.add_argument('--components',
+                        nargs="+",
+                        default=None,
+                        help="Only build the thread graphs of these "
+                             "components and the peers they join to.")
     # parser.add_argument('--outfolder',
     #                     help="Folder to put figures.",
     #                     default="/root/container/out/")
@@ -59,7 +106,10 @@ def execute(driver):
     #                     "valid only when --draw is set.")
     args = parser.parse_args()
 
-    requestinss = _load_data(args.folder, driver)
+    requestinss = _load_data(args.folder, driver, args.processes,
+                             args.cache, args.indexer, args.report_json,
+                             args.clock_solver, args.request_types,
+                             args.components)
     if requestinss:
         folders = args.folder.split("/")
         name = folders[-1] or folders[-2]
@@ -69,13 +119,22 @@ def execute(driver):
             outfolder = args.folder + ("/out-%s/" % driver.name)
             if not os.path.exists(outfolder):
                 os.makedirs(outfolder)
-            draw_engine = DrawEngine(outfolder)
+            draw_engine = DrawEngine(outfolder, args.processes)
             out_file = outfolder+"/report.csv"
         do_statistics(name, driver.graph, requestinss, draw_engine, out_file)
 
 
-def load(data_path, driver):
-    requestinss = _load_data(data_path, driver)
+def load(data_path, driver, processes=None, cache=False, indexer="hash",
+         report_json=None, clock_solver="relax", request_types=None,
+         components=None):
+    requestinss = _load_data(data_path, driver, processes, cache, indexer,
+                             report_json, clock_solver, request_types,
+                             components)
+    if not requestinss:
+        print("! WARN !")
+        print("No requests are built from %s" % data_path)
+        print()
+        return None
 
     folders = data_path.split("/")
     name = folders[-1] or folders[-2]
@@ -84,4 +143,63 @@ def load(data_path, driver):
     return Requests_D(name, requestinss, driver.graph)
 
 
-__all__ = ["load"]
+def save(requestinss, f_dir, driver):
+    """ Save built requests, reload them with load_built(). """
+    assert isinstance(driver, Driver)
+    dump_requests(requestinss, f_dir, driver.graph, hash_driver(driver))
+
+
+def load_built(f_dir, driver):
+    print("Load built requests from %s" % f_dir)
+    assert isinstance(driver, Driver)
+    print("Load driver %s" % driver.name)
+
+    report_i = ParserReport()
+    try:
+        requestinss = load_requests(f_dir, driver.graph, driver.services,
+                                    hash_driver(driver), report_i)
+    except Exception:
+        print("\n%r\n" % report_i)
+        raise
+    print("%r" % report_i)
+    print()
+
+    name = os.path.basename(f_dir.rstrip("/")).rsplit(".", 1)[0]
+
+    from .analyst.notebook_display import Requests_D
+    return Requests_D(name, requestinss, driver.graph)
+
+
+class StreamSession(object):
+    """ Follow a log folder that is still being written.
+
+    Each poll() returns the requests completed since the previous poll.
+    Clocks are not adjusted, call adjust_clock() on the collected requests.
+    """
+    def __init__(self, data_path, driver, window=1.0, indexer="hash"):
+        assert isinstance(driver, Driver)
+        print("Follow %s" % data_path)
+        print("Load driver %s" % driver.name)
+        self.tailer = LogTailer(data_path, driver.services, driver)
+        self.engine = StreamEngine(driver.graph, window, indexer)
+        self.report = None
+
+    def _proceed(self, flush):
+        self.report = ParserReport()
+        self.tailer.poll()
+        return self.engine.proceed(
+                self.tailer.targets_byname, self.report, flush)
+
+    def poll(self):
+        return self._proceed(False)
+
+    def close(self):
+        # build all the remaining requests
+        return self._proceed(True)
+
+
+def stream(data_path, driver, window=1.0, indexer="hash"):
+    return StreamSession(data_path, driver, window, indexer)
+
+
+__all__ = ["load", "load_built", "save", "stream"]
@@ -0,0 +1,432 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+from collections import defaultdict
+import heapq
+import os
+import random
+
+from . import reserved_vars as rv
+from .datasource.timestamps import format_time
+from .driver import Driver
+from .graph import ClEdge
+from .graph import FnNode
+from .graph import KwEdge
+from .graph import Master
+from .graph.joinables import ALL
+from .graph.joinables import ANY
+
+
+# babeltrace formats of the bundled drivers: provider, program by component
+DRIVER_FORMATS = {
+    "CephRadosWriteoperation": ("radoswrite", {"osd": "ceph-osd",
+                                               "client": "fio"}),
+    "CephRbdimagereq": ("rbdimagereq", {"client": "fio"}),
+    "CephRbdobjectreq": ("rbdobjectreq", {"client": "fio"}),
+}
+
+_INF = float("inf")
+_ISSUE = 0
+_SPAWN = 1
+# a thread instance longer than this is cut
+_MAX_STEPS = 1000
+
+
+def _format_vars(vars_):
+    return ", ".join("%s = %r" % (k, v) for k, v in sorted(vars_.items()))
+
+
+class _Target(object):
+    def __init__(self, host, component, program, pid):
+        self.host = host
+        self.component = component
+        self.program = program
+        self.pid = pid
+        self._idle_threads = []
+        self._len_threads = 0
+
+    def acquire_thread(self, seconds):
+        if self._idle_threads and self._idle_threads[0][0] <= seconds:
+            return heapq.heappop(self._idle_threads)[1]
+        self._len_threads += 1
+        return self.pid * 100 + self._len_threads
+
+    def release_thread(self, thread, seconds):
+        heapq.heappush(self._idle_threads, (seconds, thread))
+
+
+class _RequestContext(object):
+    def __init__(self, origin):
+        self.origin = origin
+        self.len_threads = 1
+
+
+class TraceGenerator(object):
+    """ Generate babeltrace log folders from the graph of a driver.
+
+    Requests start from the request start nodes and their thread instances
+    walk the thread graphs, preferring the edges closest to a request end.
+    A join from a line spawns the joined thread instance with the schema
+    values shared, locally in the same target or remotely in another host.
+    Request calls (cross joins) are not generated.
+    """
+    def __init__(self, master, provider, programs=None, hosts=2,
+                 concurrency=8, skew=0.0005, noise=0.0, drop=0.0,
+                 branch=0.0, step_time=0.00002, local_latency=0.00005,
+                 remote_latency=0.0002, think_time=0.0005, max_threads=32,
+                 seed=None):
+        assert isinstance(master, Master)
+        assert isinstance(provider, str)
+        assert concurrency > 0
+
+        self.master = master
+        self.provider = provider
+        self.programs = programs or {}
+        self.concurrency = concurrency
+        self.skew = skew
+        self.noise = noise
+        self.drop = drop
+        self.branch = branch
+        self.step_time = step_time
+        self.local_latency = local_latency
+        self.remote_latency = remote_latency
+        self.think_time = think_time
+        self.max_threads = max_threads
+        self.random = random.Random(seed)
+
+        self.targets_bycomponent = defaultdict(list)
+        self.skew_byhost = {}
+        components = set(t_g.component for t_g in master.thread_graphs)
+        for component in sorted(components, key=lambda c: c.name):
+            if isinstance(hosts, dict):
+                len_hosts = hosts.get(component.name, 1)
+            else:
+                len_hosts = hosts
+            program = self.programs.get(component.name, component.name)
+            for i in range(len_hosts):
+                host = "%s%d" % (component.name, i + 1)
+                pid = 1000 + len(self.skew_byhost)
+                self.skew_byhost[host] = self.random.uniform(-skew, skew)
+                self.targets_bycomponent[component].append(
+                        _Target(host, component, program, pid))
+
+        self.request_starts = list(master.req_startnode_bytype.values())
+        if not self.request_starts:
+            raise RuntimeError("Graph %s has no request start!" % master.name)
+
+        # the thread start node and function calls to reach a start edge
+        self._start_bykwedge = {}
+        for t_g in master.thread_graphs:
+            for s_node in t_g.start_nodes:
+                for edge in s_node.edges:
+                    callstack = []
+                    while isinstance(edge, ClEdge):
+                        callstack.append(edge)
+                        edge = edge.func_startedge
+                    self._start_bykwedge.setdefault(
+                            edge, (s_node, callstack))
+
+        self._cost_bykwedge = {}
+        self._distance_bynode = {}
+        self._build_distances()
+        self._required_bykwedge = {}
+        self._build_required()
+
+        self._value_index = 0
+        self._event_index = 0
+        self._lines_byhost = defaultdict(list)
+        self._line_index = 0
+        self._files = {}
+        self.len_lines = 0
+        self.len_threadinss = 0
+        self.len_unjoined = 0
+
+    def _build_distances(self):
+        # steps to a request end, following joins to the spawned threads
+        graphs = list(self.master.thread_graphs)
+        graphs.extend(self.master.funcgraph_byname.values())
+        nodes = [node for graph in graphs for node in graph.nodes]
+        kwedges = [edge for graph in graphs for edge in graph.edges
+                   if isinstance(edge, KwEdge)]
+        distances = self._distance_bynode
+        costs = self._cost_bykwedge
+        for node in nodes:
+            distances[node] = 0 if node.is_request_end else _INF
+        for edge in kwedges:
+            costs[edge] = _INF
+
+        changed = True
+        while changed:
+            changed = False
+            for edge in kwedges:
+                cost = distances[edge.node]
+                for jo in edge._jm_inner_jsobjs:
+                    if jo.to_item in self._start_bykwedge:
+                        cost = min(cost, costs[jo.to_item])
+                cost += 1
+                if cost < costs[edge]:
+                    costs[edge] = cost
+                    changed = True
+            for node in nodes:
+                for edge in node.edges:
+                    cost = self._edge_cost(edge)
+                    if cost < distances[node]:
+                        distances[node] = cost
+                        changed = True
+
+    def _build_required(self):
+        # the schema vars of all the joins of an edge, whether followed or
+        # not, and the refreshed vars, are expected in its lines
+        graphs = list(self.master.thread_graphs)
+        graphs.extend(self.master.funcgraph_byname.values())
+        for graph in graphs:
+            for edge in graph.edges:
+                if not isinstance(edge, KwEdge):
+                    continue
+                keys = set(edge.refresh_vars)
+                for jo in edge._jm_inner_jsobjs:
+                    keys.update(from_key for from_key, _ in jo.schemas)
+                for jo in edge._jm_inner_jedobjs:
+                    keys.update(to_key for _, to_key in jo.schemas)
+                for jo in edge._jm_callee_jsobjs:
+                    keys.update(from_key for from_key, _ in jo.schemas)
+                for jo in edge._jm_callee_jedobjs:
+                    keys.update(to_key for _, to_key in jo.schemas)
+                self._required_bykwedge[edge] = sorted(
+                        k for k in keys if k not in rv.ALL_VARS)
+
+    def _edge_cost(self, edge):
+        cost = _INF
+        while isinstance(edge, ClEdge):
+            # the called function counts as one step
+            cost = min(cost, self._distance_bynode[edge.node] + 1)
+            edge = edge.func_startedge
+        return min(cost, self._cost_bykwedge[edge])
+
+    def _choose(self, options, f_cost):
+        if len(options) == 1:
+            return options[0]
+        if self.branch and self.random.random() < self.branch:
+            return self.random.choice(options)
+        costs = [f_cost(option) for option in options]
+        best = min(costs)
+        return self.random.choice(
+                [o for o, c in zip(options, costs) if c == best])
+
+    def _iter_steps(self, s_node, edge, callstack):
+        node = s_node
+        callstack = list(callstack)
+        for _ in range(_MAX_STEPS):
+            if edge is None:
+                options = list(node.edges)
+                if not options:
+                    return
+                if not callstack and node.is_end:
+                    options.append(None)
+                edge = self._choose(options, lambda e:
+                        _INF if e is None else self._edge_cost(e))
+                if edge is None:
+                    return
+            while isinstance(edge, ClEdge):
+                callstack.append(edge)
+                edge = edge.func_startedge
+            yield edge
+            node = edge.node
+            edge = None
+            while isinstance(node, FnNode) and node.is_end:
+                node = callstack.pop().node
+        print("! WARN ! Cut thread instance at %s after %d steps"
+                % (node.name, _MAX_STEPS))
+
+    def _delay(self, mean):
+        # at least half of the mean, so that causality survives the
+        # microsecond timestamps
+        return mean / 2 + self.random.expovariate(2. / mean)
+
+    def _new_value(self):
+        self._value_index += 1
+        return self._value_index
+
+    def _choose_joins(self, edge):
+        jos = [jo for jo in edge._jm_inner_jsobjs
+               if jo.to_item in self._start_bykwedge]
+        if len(jos) != len(edge._jm_inner_jsobjs):
+            self.len_unjoined += len(edge._jm_inner_jsobjs) - len(jos)
+        if len(jos) <= 1 or edge._jm_inner_jstype == ALL:
+            return jos
+        if edge._jm_inner_jstype == ANY:
+            return self.random.sample(
+                    jos, self.random.randint(1, len(jos)))
+        return [self._choose(jos, lambda jo: self._cost_bykwedge[jo.to_item])]
+
+    def _choose_target(self, target, component, is_remote, ctx):
+        if not is_remote:
+            assert target.component is component
+            return target
+        targets = [t for t in self.targets_bycomponent[component]
+                   if t.host != target.host]
+        if not targets:
+            targets = self.targets_bycomponent[component]
+        # replies go back to where the request is issued
+        if ctx.origin in targets:
+            return ctx.origin
+        return self.random.choice(targets)
+
+    def _push_event(self, events, seconds, kind, args):
+        self._event_index += 1
+        heapq.heappush(events, (seconds, self._event_index, kind, args))
+
+    def _emit(self, seconds, target, thread, keyword, vars_):
+        if self.drop and self.random.random() < self.drop:
+            return
+        self._push_line(seconds, target, thread, self.provider, keyword, vars_)
+        if self.noise and self.random.random() < self.noise:
+            self._push_line(seconds, target, thread, "noise", "sched_switch", {})
+
+    def _push_line(self, seconds, target, thread, provider, keyword, vars_):
+        self._line_index += 1
+        heapq.heappush(self._lines_byhost[target.host],
+                       (seconds, self._line_index,
+                        target, thread, provider, keyword, vars_))
+
+    def _flush(self, log_folder, until, extension):
+        for host, lines in self._lines_byhost.items():
+            writer = self._files.get(host)
+            if writer is None:
+                writer = open(os.path.join(
+                    log_folder, "%s.%s" % (host, extension)), "w")
+                self._files[host] = writer
+            skew = self.skew_byhost[host]
+            while lines and lines[0][0] < until:
+                seconds, _, target, thread, provider, keyword, vars_ =\
+                        heapq.heappop(lines)
+                writer.write(
+                        "[%s] %s ust:%s:%d %s:%s: { cpu_id = %d },"
+                        " { pthread_id = %d }, { %s }\n" % (
+                            format_time(seconds + skew), host,
+                            target.program, target.pid, provider, keyword,
+                            thread % 8, thread, _format_vars(vars_)))
+                self.len_lines += 1
+
+    def _run_thread(self, seconds, events, ctx, target, s_node, edge,
+                    callstack, first_vars):
+        thread = target.acquire_thread(seconds)
+        self.len_threadinss += 1
+        # refreshed vars are kept by the later lines of the thread
+        refreshed = {}
+        vars_ = first_vars
+        for kwedge in self._iter_steps(s_node, edge, callstack):
+            if vars_ is None:
+                vars_ = {}
+                seconds += self._delay(self.step_time)
+            for key in kwedge.refresh_vars:
+                if key not in vars_:
+                    vars_[key] = self._new_value()
+                refreshed[key] = vars_[key]
+            for key in self._required_bykwedge[kwedge]:
+                if key not in vars_:
+                    value = refreshed.get(key)
+                    if value is None:
+                        value = self._new_value()
+                    vars_[key] = value
+            for jo in self._choose_joins(kwedge):
+                to_vars = {}
+                for from_key, to_key in jo.schemas:
+                    if from_key in rv.ALL_VARS:
+                        continue
+                    value = vars_.get(from_key)
+                    if value is None:
+                        value = self._new_value()
+                        vars_[from_key] = value
+                    to_vars[to_key] = value
+                if ctx.len_threads >= self.max_threads:
+                    self.len_unjoined += 1
+                    continue
+                ctx.len_threads += 1
+                t_s_node, t_callstack = self._start_bykwedge[jo.to_item]
+                to_target = self._choose_target(
+                        target, t_s_node.graph.component, jo.is_remote, ctx)
+                if jo.is_remote:
+                    latency = self.remote_latency
+                else:
+                    latency = self.local_latency
+                to_seconds = seconds + self._delay(latency)
+                self._push_event(events, to_seconds, _SPAWN,
+                        (ctx, to_target, t_s_node, jo.to_item, t_callstack,
+                         to_vars))
+            self._emit(seconds, target, thread, kwedge.keyword, vars_)
+            vars_ = None
+        target.release_thread(thread, seconds)
+        return seconds
+
+    def generate(self, log_folder, requests, extension="ctraces",
+                 start_seconds=43200.0):
+        """ Write the logs of `requests` requests into log_folder, a file
+        for each host. """
+        if not os.path.isdir(log_folder):
+            os.makedirs(log_folder)
+
+        events = []
+        for slot in range(self.concurrency):
+            self._push_event(events,
+                    start_seconds + self.random.uniform(0, self.think_time),
+                    _ISSUE, slot)
+        issued = 0
+        try:
+            while events:
+                seconds, _, kind, args = heapq.heappop(events)
+                # lines before any new thread instance can be written
+                self._flush(log_folder, seconds, extension)
+                if kind == _ISSUE:
+                    if issued == requests:
+                        continue
+                    issued += 1
+                    s_node = self.random.choice(self.request_starts)
+                    target = self.random.choice(
+                            self.targets_bycomponent[s_node.graph.component])
+                    ctx = _RequestContext(target)
+                    end = self._run_thread(seconds, events, ctx, target,
+                                           s_node, None, [], {})
+                    self._push_event(events,
+                            end + self._delay(self.think_time),
+                            _ISSUE, args)
+                else:
+                    ctx, target, s_node, edge, callstack, vars_ = args
+                    self._run_thread(seconds, events, ctx, target,
+                                     s_node, edge, callstack, vars_)
+            self._flush(log_folder, _INF, extension)
+        finally:
+            for writer in self._files.values():
+                writer.close()
+            self._files.clear()
+
+        print("Generated %d requests, %d thread instances, %d lines in %s"
+                % (issued, self.len_threadinss, self.len_lines, log_folder))
+        if self.len_unjoined:
+            print("! WARN ! %d joins are not followed" % self.len_unjoined)
+
+
+def generate(driver, log_folder, requests, **kwds):
+    """ Generate logs of the driver, see TraceGenerator for the options. """
+    assert isinstance(driver, Driver)
+    if "provider" not in kwds:
+        if driver.name not in DRIVER_FORMATS:
+            raise RuntimeError("Unknown log format of driver %s!"
+                    % driver.name)
+        kwds["provider"], kwds["programs"] = DRIVER_FORMATS[driver.name]
+    generator = TraceGenerator(driver.graph, **kwds)
+    generator.generate(log_folder, requests, driver._extensions[0])
+    return generator
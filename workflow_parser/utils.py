@@ -14,7 +14,14 @@
 
 import heapq
 import inspect
+import json
 import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 def module_expose_api(module_name, m_locals):
@@ -110,7 +117,39 @@ class Heap(object):
                    largest_str)
 
 
+def peak_rss(children=False):
+    # in KB, 0 if unknown
+    # children: the largest of the terminated and waited child processes
+    if resource is None:
+        return 0
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    maxrss = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes in macOS
+        maxrss //= 1024
+    return maxrss
+
+
+def _children_cpu():
+    # cpu seconds of the terminated and waited child processes, e.g. pools
+    if resource is None:
+        return 0.
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rate(cnt, seconds):
+    if not isinstance(cnt, int) or seconds <= 0:
+        return "x"
+    return int(cnt / seconds)
+
+
 class Report(object):
+    _fields = ("line", "component", "host", "target", "thread", "request",
+               "threadins", "pace", "innerjoin", "innerjoined",
+               "interfacejoin", "interfacejoined", "leftinterface",
+               "rightinterface")
+
     def __init__(self):
         self._steps = []
         self.lines = []
@@ -120,6 +159,7 @@ class Report(object):
         self.threads = []
         self.requests = []
         self.threadinss = []
+        self.paces = []
         self.innerjoins = []
         self.innerjoineds = []
         self.interfacejoins = []
@@ -127,11 +167,38 @@ class Report(object):
         self.leftinterfaces = []
         self.rightinterfaces = []
 
+        # cost of each step since the previous one, cpu includes the
+        # pool workers, child_rss_deltas are of the largest worker
+        self.walls = []
+        self.cpus = []
+        self.rss_deltas = []
+        self.child_rss_deltas = []
+        self.start()
+
+    def start(self):
+        self._last_wall = time.time()
+        self._last_cpu = time.process_time() + _children_cpu()
+        self._last_rss = peak_rss()
+        self._last_child_rss = peak_rss(children=True)
+
     def step(self, name, line="x", component="x", host="x", target="x",
-             thread="x", request="x", threadins="x",
+             thread="x", request="x", threadins="x", pace="x",
              innerjoin="x", innerjoined="x",
              interfacejoin="x", interfacejoined="x",
              leftinterface="x", rightinterface="x"):
+        wall = time.time()
+        cpu = time.process_time() + _children_cpu()
+        rss = peak_rss()
+        child_rss = peak_rss(children=True)
+        self.walls.append(wall - self._last_wall)
+        self.cpus.append(cpu - self._last_cpu)
+        self.rss_deltas.append(rss - self._last_rss)
+        self.child_rss_deltas.append(child_rss - self._last_child_rss)
+        self._last_wall = wall
+        self._last_cpu = cpu
+        self._last_rss = rss
+        self._last_child_rss = child_rss
+
         self._steps.append(name)
         self.lines.append(line)
         self.components.append(component)
@@ -140,6 +207,7 @@ class Report(object):
         self.threads.append(thread)
         self.requests.append(request)
         self.threadinss.append(threadins)
+        self.paces.append(pace)
         self.innerjoins.append(innerjoin)
         self.innerjoineds.append(innerjoined)
         self.interfacejoins.append(interfacejoin)
@@ -147,19 +215,67 @@ class Report(object):
         self.leftinterfaces.append(leftinterface)
         self.rightinterfaces.append(rightinterface)
 
+    def _joins(self, i):
+        joins = [self.innerjoins[i], self.interfacejoins[i]]
+        if all(isinstance(j, int) for j in joins):
+            return sum(joins)
+        else:
+            return "x"
+
+    def to_dict(self):
+        ret = []
+        for i, name in enumerate(self._steps):
+            step = {"name": name}
+            for field, values in zip(self._fields, (
+                    self.lines, self.components, self.hosts, self.targets,
+                    self.threads, self.requests, self.threadinss,
+                    self.paces, self.innerjoins, self.innerjoineds,
+                    self.interfacejoins, self.interfacejoineds,
+                    self.leftinterfaces, self.rightinterfaces)):
+                if values[i] != "x":
+                    step[field] = values[i]
+            step["wall"] = self.walls[i]
+            step["cpu"] = self.cpus[i]
+            step["rss_kb"] = self.rss_deltas[i]
+            step["child_rss_kb"] = self.child_rss_deltas[i]
+            line_rate = _rate(self.lines[i], self.walls[i])
+            if line_rate != "x":
+                step["lines_per_s"] = line_rate
+            pace_rate = _rate(self.paces[i], self.walls[i])
+            if pace_rate != "x":
+                step["paces_per_s"] = pace_rate
+            join_rate = _rate(self._joins(i), self.walls[i])
+            if join_rate != "x":
+                step["joins_per_s"] = join_rate
+            ret.append(step)
+        return ret
+
+    def dump_json(self, f_dir):
+        with open(f_dir, "w") as writer:
+            json.dump(self.to_dict(), writer, indent=2)
+
     def __repr__(self):
         head = " "*7 +"      line,component,     host,   target,"\
-               "   thread,  request,  thd_ins,"\
+               "   thread,  request,  thd_ins,    paces,"\
                " innjoins,innjoined,"\
                " infjoins,infjoined,"\
-               " l_interf, r_interf"
-        fmt = "\n%7s" + ",%9s"*13
+               " l_interf, r_interf,"\
+               "  wall(s),   cpu(s),  rss(MB),c_rss(MB),"\
+               "   line/s,   pace/s,   join/s"
+        fmt = "\n%7s" + ",%9s"*21
         ret = head
         for i, name in enumerate(self._steps):
             ret += fmt % (name, self.lines[i], self.components[i],
                           self.hosts[i], self.targets[i], self.threads[i],
                           self.requests[i], self.threadinss[i],
+                          self.paces[i],
                           self.innerjoins[i], self.innerjoineds[i],
                           self.interfacejoins[i], self.interfacejoineds[i],
-                          self.leftinterfaces[i], self.rightinterfaces[i])
+                          self.leftinterfaces[i], self.rightinterfaces[i],
+                          "%.3f" % self.walls[i], "%.3f" % self.cpus[i],
+                          "%.1f" % (self.rss_deltas[i] / 1024.),
+                          "%.1f" % (self.child_rss_deltas[i] / 1024.),
+                          _rate(self.lines[i], self.walls[i]),
+                          _rate(self.paces[i], self.walls[i]),
+                          _rate(self._joins(i), self.walls[i]))
         return ret
@@ -16,19 +16,37 @@ from .schema import SchemaEngine
 from .threadins import build_thread_instances
 from .request import build_requests
 from .request import group_threads
+from .stream import StreamEngine
 
 
-__all__ = ["proceed"]
+__all__ = ["proceed", "StreamEngine"]
 
 
-def proceed(target_byname, mastergraph, report):
+def proceed(target_byname, mastergraph, report, indexer="hash",
+            processes=None, threadgraphs=None):
     target_objs = set(t for t in target_byname.values())
-    schema_engine = SchemaEngine(mastergraph)
-    threadinss = build_thread_instances(target_objs,
-                                        mastergraph,
-                                        schema_engine,
-                                        report)
+    schema_engine = SchemaEngine(mastergraph, indexer)
+    if threadgraphs is None:
+        threadinss = build_thread_instances(target_objs,
+                                            mastergraph,
+                                            schema_engine,
+                                            report)
+    else:
+        # only the targets that can start the selected thread graphs
+        components = set(t_g.component for t_g in threadgraphs)
+        len_targets = len(target_objs)
+        target_objs = set(t for t in target_objs
+                          if t.component in components)
+        print("Select %d/%d targets of components %s" % (
+            len(target_objs), len_targets,
+            ",".join(sorted(c.name for c in components))))
+        with mastergraph.select(threadgraphs):
+            threadinss = build_thread_instances(target_objs,
+                                                mastergraph,
+                                                schema_engine,
+                                                report)
     joininfo = schema_engine.proceed(report, target_byname)
     threadgroup_by_request = group_threads(threadinss, joininfo, report)
-    requestinss = build_requests(threadgroup_by_request, joininfo, report)
+    requestinss = build_requests(threadgroup_by_request, joininfo, report,
+                                 processes)
     return requestinss
@@ -16,6 +16,7 @@ from __future__ import print_function
 
 from collections import defaultdict
 from itertools import chain
+import multiprocessing
 
 from ...utils import Report
 from ..entities.join import InnerjoinActivity
@@ -37,48 +38,83 @@ def group_threads(threadinss, joininfo, report):
     assert isinstance(report, Report)
 
     print("Group threads...")
-    seen_threadinss = set()
-    def group(threadins, threadins_group, requests):
-        assert isinstance(threadins, ThreadInstance)
-
-        if threadins in seen_threadinss:
-            return
-        seen_threadinss.add(threadins)
-        threadins_group.add(threadins)
-        if threadins.request:
-            requests.add(threadins.request)
+    # union-find over the thread instances connected by inner joins,
+    # thread instances only reachable by joins are appended
+    threadins_list = []
+    index_bythreadins = {}
+    parents = []
+    sizes = []
+    def index(threadins):
+        i = index_bythreadins.get(threadins)
+        if i is None:
+            assert isinstance(threadins, ThreadInstance)
+            i = len(threadins_list)
+            index_bythreadins[threadins] = i
+            threadins_list.append(threadins)
+            parents.append(i)
+            sizes.append(1)
+        return i
+
+    def find(i):
+        while parents[i] != i:
+            # path halving
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(i, j):
+        i = find(i)
+        j = find(j)
+        if i != j:
+            if sizes[i] < sizes[j]:
+                i, j = j, i
+            parents[j] = i
+            sizes[i] += sizes[j]
 
+    for threadins in threadinss:
+        index(threadins)
+    i = 0
+    while i < len(threadins_list):
+        threadins = threadins_list[i]
         for joins in joininfo.iter_innerjoins(threadins):
             if isinstance(joins, RequestjoinActivity):
                 to_threadins = joins.to_pace_unnested.threadins
             else:
                 to_threadins = joins.to_threadins
             assert to_threadins is not threadins
-            group(to_threadins, threadins_group, requests)
+            union(i, index(to_threadins))
         for joined in joininfo.iter_innerjoined(threadins):
             if isinstance(joined, RequestjoinActivity):
                 from_threadins = joined.from_pace_unnested.threadins
             else:
                 from_threadins = joined.from_threadins
             assert from_threadins is not threadins
-            group(from_threadins, threadins_group, requests)
+            union(i, index(from_threadins))
+        i += 1
+
+    # groups are ordered by their first thread instance
+    groups_byroot = {}
+    for i, threadins in enumerate(threadins_list):
+        root = find(i)
+        group = groups_byroot.get(root)
+        if group is None:
+            group = (set(), set())
+            groups_byroot[root] = group
+        group[0].add(threadins)
+        if threadins.request:
+            group[1].add(threadins.request)
 
     threadgroup_by_request = defaultdict(set)
     threadgroups_with_multiple_requests = []
     threadgroups_without_request = []
-    for threadins in threadinss:
-        assert isinstance(threadins, ThreadInstance)
-        if threadins not in seen_threadinss:
-            threadins_group = set()
-            requests = set()
-            group(threadins, threadins_group, requests)
-            len_req = len(requests)
-            if len_req > 1:
-                threadgroups_with_multiple_requests.append((threadins_group, requests))
-            elif len_req == 1:
-                threadgroup_by_request[requests.pop()].update(threadins_group)
-            else:
-                threadgroups_without_request.append(threadins_group)
+    for threadins_group, requests in groups_byroot.values():
+        len_req = len(requests)
+        if len_req > 1:
+            threadgroups_with_multiple_requests.append((threadins_group, requests))
+        elif len_req == 1:
+            threadgroup_by_request[requests.pop()].update(threadins_group)
+        else:
+            threadgroups_without_request.append(threadins_group)
     print("----------------")
 
     components = set()
@@ -130,6 +166,7 @@ def group_threads(threadinss, joininfo, report):
                 thread=len(threads),
                 request=len(threadgroup_by_request)+len(threadgroups_without_request),
                 threadins=len(collected_threadinss),
+                pace=sum_['lines'],
                 innerjoin=sum_['joins'],
                 innerjoined=sum_['joined'],
                 interfacejoin=sum_['rjoins'],
@@ -198,7 +235,8 @@ def group_threads(threadinss, joininfo, report):
     return ret
 
 
-def _build_mainpath(reqins):
+def _build_mainpath(reqins, main_activities=None):
+    # main_activities: collects the activities marked as main
     assert isinstance(reqins, RequestInstance)
     activity = reqins.end_activity
     assert activity
@@ -212,6 +250,8 @@ def _build_mainpath(reqins):
         if activity.is_main:
             return ("Revisited", activity.activity_name)
         activity.is_main = True
+        if main_activities is not None:
+            main_activities.append(activity)
         if pace:
             pace.prv_main_activity = activity
 
@@ -244,10 +284,27 @@ def _build_mainpath(reqins):
     return None
 
 
+def _replay_mainpath(reqins, main_activities):
+    # apply the main path found by _build_mainpath() in a forked builder
+    pace = None
+    for activity in main_activities:
+        activity.is_main = True
+        if pace:
+            pace.prv_main_activity = activity
+        pace = activity.from_pace
+        reqins.len_main_paces += 1
+        if pace is None or pace.is_main:
+            break
+        pace.is_main = True
+        pace.nxt_main_activity = activity
+
+
 def _set_orders(reqins):
+    # return the ordered activities, an activity can be ordered again
     assert isinstance(reqins, RequestInstance)
     activity = reqins.start_activity
     assert activity
+    ordered = []
     # store path -> order
     path_dict = defaultdict(lambda: 0)
     # store act -> path_dict
@@ -261,6 +318,7 @@ def _set_orders(reqins):
             path = act.path
             order = path_dict[path]+1
             act.order = order
+            ordered.append(act)
             npath_dict[path] = order
             path_dict = path_dict.copy()
             path_dict.update(npath_dict)
@@ -271,6 +329,41 @@ def _set_orders(reqins):
                 for acts in pace.nxt_activity_bytype.values():
                     for act in acts:
                         bfdict[act] = path_dict
+    return ordered
+
+
+def _iter_thread_activities(threadins):
+    act_type = ThreadActivity._act_type
+    activity = threadins.start_activity
+    while activity is not None:
+        yield activity
+        pace = activity.to_pace
+        if pace is None:
+            break
+        activity = pace.get_nxt(act_type)[0]
+
+
+def _collect_threadins(requestins, threadins):
+    # activities_bymark
+    for mark, acts in threadins.activities_bymark.items():
+        requestins.activities_bymark[mark].extend(acts)
+
+    # request vars
+    requestins.request_vars["thread"].add(threadins.target+":"+threadins.thread)
+    requestins.request_vars["host"].add(threadins.host)
+    requestins.request_vars["component"].add(threadins.component)
+    requestins.request_vars["target"].add(threadins.target)
+    for key, val in threadins.thread_vars.items():
+        requestins.request_vars[key].add(val)
+    for key, vals in threadins.thread_vars_dup.items():
+        requestins.request_vars[key].update(vals)
+
+    # len_paces
+    requestins.len_paces += threadins.len_activities-1
+
+    # thread/target
+    requestins.thread_objs.add(threadins.thread_obj)
+    requestins.target_objs.add(threadins.target_obj)
 
 
 class RequestBuilder(object):
@@ -289,6 +382,10 @@ class RequestBuilder(object):
         self.e_extra_s_threadinss = set()
         self.e_extra_e_threadinss = set()
         self.e_stray_threadinss = set()
+        # recorded by a forked builder
+        self.main_activities = None
+        self.ordered_activities = ()
+        self.seen_threadinss = ()
 
     def __nonzero__(self):
         if self.errors or not self.is_built:
@@ -296,7 +393,7 @@ class RequestBuilder(object):
         else:
             return True
 
-    def build(self):
+    def build(self, set_orders=True):
         assert not self.is_built
         requestins = self.requestins
         joininfo = self.joininfo
@@ -358,26 +455,7 @@ class RequestBuilder(object):
                         threadins.end_activity.from_seconds:
                     requestins.last_activity = threadins.end_activity
 
-            # activities_bymark
-            for mark, acts in threadins.activities_bymark.items():
-                requestins.activities_bymark[mark].extend(acts)
-
-            # request vars
-            requestins.request_vars["thread"].add(threadins.target+":"+threadins.thread)
-            requestins.request_vars["host"].add(threadins.host)
-            requestins.request_vars["component"].add(threadins.component)
-            requestins.request_vars["target"].add(threadins.target)
-            for key, val in threadins.thread_vars.items():
-                requestins.request_vars[key].add(val)
-            for key, vals in threadins.thread_vars_dup.items():
-                requestins.request_vars[key].update(vals)
-
-            # len_paces
-            requestins.len_paces += threadins.len_activities-1
-
-            # thread/target
-            requestins.thread_objs.add(threadins.thread_obj)
-            requestins.target_objs.add(threadins.target_obj)
+            _collect_threadins(requestins, threadins)
 
             # join_activities
             for join in joininfo.iter_emptyjoin(threadins, is_joins=True):
@@ -400,6 +478,8 @@ class RequestBuilder(object):
 
         _process(requestins.start_activity.threadins)
 
+        if self.main_activities is not None:
+            self.seen_threadinss = list(requestins.threadinss)
         requestins.threadinss.sort(key=lambda ti: ti.start_activity.to_seconds)
 
         # error: incomplete threadinss
@@ -424,20 +504,216 @@ class RequestBuilder(object):
             self.errors["Contains no end activity"] = ""
         else:
             # parse main path!
-            err = _build_mainpath(requestins)
+            err = _build_mainpath(requestins, self.main_activities)
             if err:
                 self.errors["Main route parse error"] = err
 
-        if not self.errors:
-            _set_orders(requestins)
+        if not self.errors and set_orders:
+            self.ordered_activities = _set_orders(requestins)
 
         self.is_built = True
         if not self.errors:
             requestins.automate_name()
             return requestins
 
+    def export(self, tis_index, joins_index):
+        # compact the build result by indexes, None if not indexable
+        requestins = self.requestins
+        def _ti(activity):
+            if activity is None:
+                return None
+            return tis_index[activity.threadins]
+
+        try:
+            positions = {}
+            def _position(activity):
+                threadins = activity.threadins
+                if threadins not in positions:
+                    positions[threadins] = {act: k for k, act in
+                            enumerate(_iter_thread_activities(threadins))}
+                return tis_index[threadins], positions[threadins][activity]
+
+            main = []
+            for activity in self.main_activities or ():
+                if isinstance(activity, ThreadActivity):
+                    main.append(_position(activity))
+                else:
+                    main.append((-1, joins_index[activity]))
+
+            ordered = set()
+            join_orders = {}
+            for activity in self.ordered_activities:
+                if isinstance(activity, ThreadActivity):
+                    ordered.add(activity)
+                else:
+                    join_orders[joins_index[activity]] = activity.order
+            thread_orders = []
+            for threadins in set(act.threadins for act in ordered):
+                thread_orders.append(
+                        (tis_index[threadins],
+                         [act.order if act in ordered else None
+                          for act in _iter_thread_activities(threadins)]))
+
+            return (self.is_built, self.errors, self.warns,
+                    [[tis_index[ti] for ti in tis] for tis in
+                        (self.e_incomplete_threadinss,
+                         self.e_extra_s_threadinss,
+                         self.e_extra_e_threadinss,
+                         self.e_stray_threadinss)],
+                    (_ti(requestins.start_activity),
+                     _ti(requestins.end_activity),
+                     _ti(requestins.last_activity)),
+                    [tis_index[ti] for ti in self.seen_threadinss],
+                    [[joins_index[join] for join in joins] for joins in
+                        (requestins.emptyjoins_activities,
+                         requestins.emptyjoined_activities,
+                         requestins.innerjoin_activities,
+                         requestins.requestjoin_activities,
+                         requestins.crossjoinl_activities,
+                         requestins.crossjoinr_activities)],
+                    main, thread_orders, list(join_orders.items()))
+        except KeyError:
+            return None
+
+    def apply(self, result, threadinss, joins, chains):
+        # apply an exported build result without walking the request again
+        assert not self.is_built
+        requestins = self.requestins
+        is_built, self.errors, self.warns, e_tis, ends, seen,\
+                join_sets, main, thread_orders, join_orders = result
 
-def build_requests(threadgroup_by_request, joininfo, report):
+        def _chain(index):
+            if index not in chains:
+                chains[index] = list(
+                        _iter_thread_activities(threadinss[index]))
+            return chains[index]
+
+        for threadins in self.threadinss:
+            threadins.requestins = requestins
+        self.e_incomplete_threadinss, self.e_extra_s_threadinss,\
+                self.e_extra_e_threadinss, self.e_stray_threadinss =\
+                [set(threadinss[i] for i in tis) for tis in e_tis]
+
+        start, end, last = ends
+        if start is not None:
+            requestins.start_activity = threadinss[start].start_activity
+        if end is not None:
+            requestins.end_activity = threadinss[end].rend_activity
+        if last is not None:
+            requestins.last_activity = threadinss[last].end_activity
+
+        for index in seen:
+            threadins = threadinss[index]
+            requestins.threadinss.append(threadins)
+            _collect_threadins(requestins, threadins)
+        requestins.threadinss.sort(key=lambda ti: ti.start_activity.to_seconds)
+
+        for activities, indexes in zip(
+                (requestins.emptyjoins_activities,
+                 requestins.emptyjoined_activities,
+                 requestins.innerjoin_activities,
+                 requestins.requestjoin_activities,
+                 requestins.crossjoinl_activities,
+                 requestins.crossjoinr_activities), join_sets):
+            activities.update(joins[i] for i in indexes)
+
+        if main:
+            _replay_mainpath(requestins,
+                    [_chain(i)[k] if i >= 0 else joins[k] for i, k in main])
+
+        for index, orders in thread_orders:
+            for activity, order in zip(_chain(index), orders):
+                if order is not None:
+                    activity.order = order
+        for index, order in join_orders:
+            joins[index].order = order
+
+        self.is_built = is_built
+        if is_built and not self.errors:
+            requestins.automate_name()
+            return requestins
+
+
+def _index_groups(threadgroup_by_request, joininfo):
+    threadinss = []
+    for _, threads in threadgroup_by_request:
+        threadinss.extend(threads)
+    joins = {}
+    for joins_bytis in (joininfo.innerjoins_bytis,
+                        joininfo.innerjoined_bytis,
+                        joininfo.requestjoins_bytis,
+                        joininfo.requestjoined_bytis,
+                        joininfo.crossjoinleft_bytis,
+                        joininfo.crossjoinright_bytis,
+                        joininfo.emptyjoins_bytis,
+                        joininfo.emptyjoined_bytis):
+        for join in chain.from_iterable(joins_bytis.values()):
+            joins.setdefault(join, len(joins))
+            if isinstance(join, RequestjoinActivity) and join.is_nest:
+                joins.setdefault(join.left_crossjoin, len(joins))
+                joins.setdefault(join.right_crossjoin, len(joins))
+    return threadinss, sorted(joins, key=joins.get)
+
+# parallel build: workers are forked after the _pool_* globals are set, so
+# the thread instances and joins are inherited rather than pickled. Each
+# worker returns compact results by index, applied in group order by the
+# parent.
+_pool_groups = None
+_pool_joininfo = None
+_pool_set_orders = True
+_pool_threadinss = None
+_pool_joins = None
+_pool_tis_index = None
+_pool_joins_index = None
+
+def _build_inpool(bounds):
+    global _pool_tis_index, _pool_joins_index
+    if _pool_tis_index is None:
+        _pool_tis_index = {ti: i for i, ti in enumerate(_pool_threadinss)}
+        _pool_joins_index = {join: i for i, join in enumerate(_pool_joins)}
+    results = []
+    for request, threads in _pool_groups[bounds[0]:bounds[1]]:
+        r_builder = RequestBuilder(request, _pool_joininfo, threads)
+        r_builder.main_activities = []
+        r_builder.build(_pool_set_orders)
+        results.append(r_builder.export(_pool_tis_index, _pool_joins_index))
+    return results
+
+def _use_pool(processes, threadgroup_by_request):
+    return processes and processes > 1 and len(threadgroup_by_request) > 1 \
+        and "fork" in multiprocessing.get_all_start_methods()
+
+def _build_parallel(threadgroup_by_request, joininfo, threadinss, joins,
+                    processes, set_orders):
+    global _pool_groups, _pool_joininfo, _pool_set_orders
+    global _pool_threadinss, _pool_joins
+    ctx = multiprocessing.get_context("fork")
+    _pool_groups = threadgroup_by_request
+    _pool_joininfo = joininfo
+    _pool_set_orders = set_orders
+    _pool_threadinss = threadinss
+    _pool_joins = joins
+    len_groups = len(threadgroup_by_request)
+    step = max(1, len_groups // (processes * 8))
+    bounds = [(i, min(i + step, len_groups))
+              for i in range(0, len_groups, step)]
+    pool = ctx.Pool(min(processes, len(bounds)))
+    try:
+        for results in pool.imap(_build_inpool, bounds):
+            for result in results:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+        _pool_groups = None
+        _pool_joininfo = None
+        _pool_set_orders = True
+        _pool_threadinss = None
+        _pool_joins = None
+
+
+def build_requests(threadgroup_by_request, joininfo, report,
+                   processes=None, set_orders=True):
     requestinss = {}
     # error report
     error_builders = []
@@ -452,10 +728,25 @@ def build_requests(threadgroup_by_request, joininfo, report):
     extra_end_threadinss = set()
     stray_threadinss = set()
 
-    print("Build requests...")
+    if _use_pool(processes, threadgroup_by_request):
+        print("Build requests (%d processes)..." % processes)
+        group_tis, group_joins = _index_groups(
+                threadgroup_by_request, joininfo)
+        chains = {}
+        results = _build_parallel(threadgroup_by_request, joininfo,
+                                  group_tis, group_joins, processes,
+                                  set_orders)
+    else:
+        print("Build requests...")
+        results = None
     for request, threads in threadgroup_by_request:
         r_builder = RequestBuilder(request, joininfo, threads)
-        requestins = r_builder.build()
+        result = next(results) if results is not None else None
+        if result is not None:
+            requestins = r_builder.apply(
+                    result, group_tis, group_joins, chains)
+        else:
+            requestins = r_builder.build(set_orders)
 
         if requestins:
             if r_builder.warns:
@@ -540,6 +831,7 @@ def build_requests(threadgroup_by_request, joininfo, report):
                 thread=len(thread_objs),
                 request=len(requestinss),
                 threadins=len(threadinss),
+                pace=cnt_lines,
                 innerjoin=len(innerjoins),
                 innerjoined=len(innerjoins),
                 interfacejoin=len(requestjoins),
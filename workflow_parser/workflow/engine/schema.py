@@ -76,6 +76,18 @@ class JoinInfo(object):
             else:
                 self.emptyjoined_bytis[join.threadins].append(join)
 
+    def discard(self, tis):
+        # forget the joins of a thread instance that is already built
+        for joins_bytis in (self.innerjoins_bytis,
+                            self.innerjoined_bytis,
+                            self.requestjoins_bytis,
+                            self.requestjoined_bytis,
+                            self.crossjoinleft_bytis,
+                            self.crossjoinright_bytis,
+                            self.emptyjoins_bytis,
+                            self.emptyjoined_bytis):
+            joins_bytis.pop(tis, None)
+
     def iter_innerjoins(self, tis, is_request=None):
         assert isinstance(tis, ThreadinsBase)
         if is_request is None:
@@ -129,13 +141,13 @@ class JoinInfo(object):
 
 
 class SchemaEngine(object):
-    def __init__(self, join_master):
+    def __init__(self, join_master, indexer="hash"):
         assert isinstance(join_master, JoinMasterMixin)
 
         self.innerj_proj = JoiningProject(
-                "inner_joins", join_master.inner_joinobjs)
+                "inner_joins", join_master.inner_joinobjs, indexer)
         self.crossj_proj = JoiningProject(
-                "cross_joins", join_master.cross_joinobjs)
+                "cross_joins", join_master.cross_joinobjs, indexer)
 
     def load_pace(self, pace):
         assert isinstance(pace, Pace)
@@ -171,26 +183,17 @@ class SchemaEngine(object):
                     item=pace,
                     join_objs=joinable._jm_callee_jedobjs)
 
-    def proceed(self, report, target_byname):
-        assert isinstance(report, Report)
-        print("Join paces...")
-        print("-------------")
-
-        inner_from = 0
-        inner_to = 0
-        cross_from = 0
-        cross_to = 0
-
-        joininfo = JoinInfo()
-
-        for jo, from_, to_ in self.innerj_proj.yield_results(target_byname):
+    def _join_inner(self, joininfo, results):
+        cnt_from = 0
+        cnt_to = 0
+        for jo, from_, to_ in results:
             if from_ is None:
                 assert to_ is not None
                 join = EmptyjoinActivity(to_, False, jo, InnerjoinActivity)
-                inner_to += 1
+                cnt_to += 1
             elif to_ is None:
                 join = EmptyjoinActivity(from_, True, jo, InnerjoinActivity)
-                inner_from += 1
+                cnt_from += 1
             elif isinstance(jo, RequestJoin):
                 join = RequestjoinActivity(jo, from_, to_)
                 self.crossj_proj.load_fromitem(
@@ -213,8 +216,10 @@ class SchemaEngine(object):
                 raise StateError("SchemaEngine, invalid jo type: %s" %
                         jo.__class__)
             joininfo.add_join(join)
+        return cnt_from, cnt_to
 
-        for jo, from_, to_ in self.crossj_proj.yield_results(target_byname):
+    def _join_cross(self, joininfo, results):
+        for jo, from_, to_ in results:
             if from_ is None:
                 assert to_ is not None
                 join = EmptyjoinActivity(to_, False, jo, CrossjoinActivity)
@@ -224,6 +229,20 @@ class SchemaEngine(object):
                 join = CrossjoinActivity(jo, from_, to_)
             joininfo.add_join(join)
 
+    def proceed(self, report, target_byname):
+        assert isinstance(report, Report)
+        print("Join paces...")
+        print("-------------")
+
+        cross_from = 0
+        cross_to = 0
+
+        joininfo = JoinInfo()
+        inner_from, inner_to = self._join_inner(
+                joininfo, self.innerj_proj.yield_results(target_byname))
+        self._join_cross(
+                joininfo, self.crossj_proj.yield_results(target_byname))
+
         #### report #####
         report.step("join_ps",
                     innerjoin=joininfo.len_inners,
@@ -242,3 +261,25 @@ class SchemaEngine(object):
             print()
 
         return joininfo
+
+    def proceed_window(self, joininfo, target_byname, horizon):
+        """ Join the paces loaded so far into joininfo.
+
+        Paces before horizon that are still unjoined become empty joins, see
+        JoiningProject.yield_window().
+        """
+        assert isinstance(joininfo, JoinInfo)
+        print("Join paces...")
+        print("-------------")
+
+        self._join_inner(joininfo,
+                self.innerj_proj.yield_window(target_byname, horizon))
+        self._join_cross(joininfo,
+                self.crossj_proj.yield_window(target_byname, horizon))
+        print()
+
+    def iter_pending_threadinss(self):
+        # thread instances that can still be joined
+        for item in chain(self.innerj_proj.iter_pending(),
+                          self.crossj_proj.iter_pending()):
+            yield item.env.threadins
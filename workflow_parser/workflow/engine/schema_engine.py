@@ -16,11 +16,13 @@ from __future__ import print_function
 
 from abc import ABCMeta
 from abc import abstractmethod
+from collections import defaultdict
 from functools import total_ordering
 from itertools import chain
 import pandas as pd
 import numpy as np
 
+from ...datasource import Interner
 from ...graph.joinables import JoinBase
 from ..exc import StateError
 
@@ -39,8 +41,12 @@ JoinTypes = {ONE, ALL, ANY}
 
 
 class JoiningProject(object):
-    def __init__(self, name, join_objs):
+    def __init__(self, name, join_objs, indexer="hash"):
         assert isinstance(name, str)
+        if indexer not in Indexers:
+            raise RuntimeError("Invalid indexer %s, choose from %s" % (
+                indexer, ",".join(Indexers.keys())))
+        indexer_cls = Indexers[indexer]
 
         self.name = name
         self.works_byjo = {}
@@ -53,7 +59,7 @@ class JoiningProject(object):
 
         for jo in join_objs:
             assert jo not in self.works_byjo
-            self.works_byjo[jo] = PandasIndexer(join_obj=jo)
+            self.works_byjo[jo] = indexer_cls(join_obj=jo)
 
     def load_fromitem(self, join_objs, **kwds):
         assert join_objs
@@ -86,6 +92,48 @@ class JoiningProject(object):
         for jo, from_, to_ in self.yield_empty():
             yield jo, from_, to_
 
+    def yield_window(self, target_byname, horizon):
+        """ Join the loaded items, and finalize the ones before horizon.
+
+        Unjoined items older than horizon are yielded as empty, the others
+        are kept for the next call.
+        """
+        for jo_work in self.works_byjo.values():
+            for jo, from_, to_ in jo_work.yield_results(target_byname):
+                yield jo, from_, to_
+            jo_work.expire(horizon)
+
+        print(self.name+":")
+        def _yield_expired(items, is_from):
+            pending = []
+            cnt_success = 0
+            cnt_fail = 0
+            for item in items:
+                if item.is_success:
+                    cnt_success += 1
+                elif item.seconds < horizon:
+                    cnt_fail += 1
+                    for jos in item.yield_empty():
+                        if is_from:
+                            yield jos, item.item, None
+                        else:
+                            yield jos, None, item.item
+                else:
+                    pending.append(item)
+            items[:] = pending
+            print("  %s: %d success, %d failed, %d pending" % (
+                "from" if is_from else "to",
+                cnt_success, cnt_fail, len(pending)))
+        for ret in _yield_expired(self.from_items, True):
+            yield ret
+        for ret in _yield_expired(self.to_items, False):
+            yield ret
+
+    def iter_pending(self):
+        for jo_work in self.works_byjo.values():
+            for item in chain(jo_work.from_items, jo_work.to_items):
+                yield item
+
     def yield_empty(self):
         print(self.name+":")
         cnt_success = 0
@@ -244,9 +292,19 @@ class IndexerBase(object):
         pass
 
 
-class PandasIndexer(IndexerBase):
+# target alias translation: A(target_t) -> B(target), target_t needs translation
+def _get_value(target_byname, item, schema, other):
+    ret = str(item.env[schema])
+    if "target" != schema and "target" == other:
+        if ret not in target_byname:
+            raise StateError("Cannot translate target %s" % ret)
+        ret = target_byname[ret].target
+    return ret
+
+
+class ItemIndexerBase(IndexerBase):
     def __init__(self, **kwds):
-        super(PandasIndexer, self).__init__(**kwds)
+        super(ItemIndexerBase, self).__init__(**kwds)
 
         self.from_items = []
         self.to_items = []
@@ -272,15 +330,71 @@ class PandasIndexer(IndexerBase):
         self.occur_negateve_offset = 0
 
     def load_fromitem(self, from_item):
-        super(PandasIndexer, self).load_fromitem(from_item)
+        super(ItemIndexerBase, self).load_fromitem(from_item)
 
         self.from_items.append(from_item)
 
     def load_toitem(self, to_item):
-        super(PandasIndexer, self).load_toitem(to_item)
+        super(ItemIndexerBase, self).load_toitem(to_item)
 
         self.to_items.append(to_item)
 
+    def expire(self, horizon):
+        # drop the items that cannot be joined any more
+        join_obj = self.join_obj
+        self.from_items = [item for item in self.from_items
+                           if item.seconds >= horizon
+                           and item.is_joinable(join_obj)]
+        self.to_items = [item for item in self.to_items
+                         if item.seconds >= horizon
+                         and item.is_joinable(join_obj)]
+
+    def _join(self, from_item, to_item):
+        from_item.set_peer(self.join_obj, to_item)
+        to_item.set_peer(self.join_obj, from_item)
+
+        offset = from_item.seconds - to_item.seconds
+        self.max_negative_offset = max(offset, self.max_negative_offset)
+        if offset > 0:
+            self.total_negative_offset += offset
+            self.occur_negateve_offset += 1
+        self.cnt_success += 1
+
+    def report(self):
+        print("  success: %d" % self.cnt_success)
+
+        if self.from_cnt_ignored:
+            print("  fromitems ignored: %d" % self.from_cnt_ignored)
+        if self.from_cnt_nomatch:
+            print("  fromitems nomatch: %d" % self.from_cnt_nomatch)
+        if self.from_cnt_novalidmatch:
+            print("  fromitems novalidmatch: %d" % self.from_cnt_novalidmatch)
+        if self.from_occur_matches:
+            print("  fromitems MULTI-MATCH: %d(max %d, evg %.5f)" % (
+                self.from_occur_matches,
+                self.from_cntmax_permatch,
+                self.from_total_matches/float(self.from_occur_matches)))
+
+        if self.to_cnt_ignored:
+            print("  toitems ignored: %d" % self.to_cnt_ignored)
+        if self.to_cnt_nomatch:
+            print("  toitems nomatch: %d" % self.to_cnt_nomatch)
+        if self.to_cnt_novalidmatch:
+            print("  toitems novalidmatch: %d" % self.to_cnt_novalidmatch)
+        if self.to_occur_matches:
+            print("  toitems MULTI-MATCH: %d(max %d, evg %.5f)" % (
+                self.to_occur_matches,
+                self.to_cntmax_permatch,
+                self.to_total_matches/float(self.to_occur_matches)))
+
+        if self.occur_negateve_offset:
+            print("  -OFFSET: %d(max %.5f, evg %.5f)" % (
+                self.occur_negateve_offset,
+                self.max_negative_offset,
+                self.total_negative_offset/float(self.occur_negateve_offset)))
+
+
+class PandasIndexer(ItemIndexerBase):
     def yield_results(self, target_byname):
         print(self.join_obj.name+
               "(%d -> %d): "%(len(self.from_items), len(self.to_items))+
@@ -288,22 +402,19 @@ class PandasIndexer(IndexerBase):
 
         # index from_items columns(seconds, _item, str_schema), ordered by seconds
         # calculate count ignored
-        ## target alias translation: A(target_t) -> B(target), target_t needs translation
         def get_value(item, schema, other):
-            ret = str(item.env[schema])
-            if "target" != schema and "target" == other:
-                if ret not in target_byname:
-                    raise StateError("Cannot translate target %s" % ret)
-                ret = target_byname[ret].target
-            return ret
+            return _get_value(target_byname, item, schema, other)
+        # schema values are joined as integer ids
+        values = Interner()
         str_schema = self.join_obj.str_schema
         columns = ["seconds", "_item", str_schema]
         def generate_from_rows():
             for item in self.from_items:
                 if item.is_joinable(self.join_obj):
                     yield (item.seconds, item,
-                           ",".join(get_value(item, schema, other)
-                               for schema, other in self.schemas))
+                           values.id_of(",".join(
+                               get_value(item, schema, other)
+                               for schema, other in self.schemas)))
                 else:
                     self.from_cnt_ignored += 1
         self.from_items.sort(key=lambda i:i.seconds)
@@ -319,8 +430,9 @@ class PandasIndexer(IndexerBase):
             for item in self.to_items:
                 if item.is_joinable(self.join_obj):
                     yield (item.seconds, item,
-                           ",".join(get_value(item, schema, other)
-                               for other, schema in self.schemas))
+                           values.id_of(",".join(
+                               get_value(item, schema, other)
+                               for other, schema in self.schemas)))
                 else:
                     self.to_cnt_ignored += 1
         to_indexer = pd.DataFrame(
@@ -350,15 +462,7 @@ class PandasIndexer(IndexerBase):
             to_matches.sort(key=lambda i:i.seconds)
             for match in to_matches:
                 if match.is_joinable(self.join_obj):
-                    match.set_peer(self.join_obj, to_item)
-                    to_item.set_peer(self.join_obj, match)
-
-                    offset = match.seconds - to_item.seconds
-                    self.max_negative_offset = max(offset, self.max_negative_offset)
-                    if offset > 0:
-                        self.total_negative_offset += offset
-                        self.occur_negateve_offset += 1
-                    self.cnt_success += 1
+                    self._join(match, to_item)
                     yield self.join_obj, match.item, to_item.item
                     break
 
@@ -399,7 +503,7 @@ class PandasIndexer(IndexerBase):
                     if len(lines) > 1:
                         for index, line in lines.iterrows():
                             to_print.append((line["seconds_from"], #l[0]
-                                             line[str_schema],     #l[1]
+                                             values[line[str_schema]], #l[1]
                                              line["_item_from"],   #l[2]
                                              line["_item_to"]))    #l[3]
                 to_print.sort(key=lambda l:l[0])
@@ -430,35 +534,133 @@ class PandasIndexer(IndexerBase):
 
         self.report()
 
-    def report(self):
-        print("  success: %d" % self.cnt_success)
 
-        if self.from_cnt_ignored:
-            print("  fromitems ignored: %d" % self.from_cnt_ignored)
-        if self.from_cnt_nomatch:
-            print("  fromitems nomatch: %d" % self.from_cnt_nomatch)
-        if self.from_cnt_novalidmatch:
-            print("  fromitems novalidmatch: %d" % self.from_cnt_novalidmatch)
-        if self.from_occur_matches:
-            print("  fromitems MULTI-MATCH: %d(max %d, evg %.5f)" % (
-                self.from_occur_matches,
-                self.from_cntmax_permatch,
-                self.from_total_matches/float(self.from_occur_matches)))
+class HashIndexer(ItemIndexerBase):
+    """ Join items through buckets keyed by schema-value tuples.
 
-        if self.to_cnt_ignored:
-            print("  toitems ignored: %d" % self.to_cnt_ignored)
-        if self.to_cnt_nomatch:
-            print("  toitems nomatch: %d" % self.to_cnt_nomatch)
-        if self.to_cnt_novalidmatch:
-            print("  toitems novalidmatch: %d" % self.to_cnt_novalidmatch)
-        if self.to_occur_matches:
-            print("  toitems MULTI-MATCH: %d(max %d, evg %.5f)" % (
-                self.to_occur_matches,
-                self.to_cntmax_permatch,
-                self.to_total_matches/float(self.to_occur_matches)))
+    Yields the same results as PandasIndexer in a single pass.
+    """
+    def yield_results(self, target_byname):
+        print(self.join_obj.name+
+              "(%d -> %d): "%(len(self.from_items), len(self.to_items))+
+              repr(self.join_obj))
+        join_obj = self.join_obj
+        schemas = self.schemas
 
-        if self.occur_negateve_offset:
-            print("  -OFFSET: %d(max %.5f, evg %.5f)" % (
-                self.occur_negateve_offset,
-                self.max_negative_offset,
-                self.total_negative_offset/float(self.occur_negateve_offset)))
+        # bucket joinable items by schema values, ordered by seconds
+        from_buckets = defaultdict(list)
+        self.from_items.sort(key=lambda i:i.seconds)
+        for item in self.from_items:
+            if item.is_joinable(join_obj):
+                key = tuple(_get_value(target_byname, item, schema, other)
+                            for schema, other in schemas)
+                from_buckets[key].append(item)
+            else:
+                self.from_cnt_ignored += 1
+
+        to_buckets = defaultdict(list)
+        self.to_items.sort(key=lambda i:i.seconds)
+        for item in self.to_items:
+            if item.is_joinable(join_obj):
+                key = tuple(_get_value(target_byname, item, schema, other)
+                            for other, schema in schemas)
+                to_buckets[key].append(item)
+            else:
+                self.to_cnt_ignored += 1
+
+        # list of (to_item, key) ordered by to_item
+        matches_byto = [(to_item, key)
+                        for key, to_bucket in to_buckets.items()
+                        if key in from_buckets
+                        for to_item in to_bucket]
+        matches_byto.sort(key=lambda m:m[0])
+
+        # match each to_item with the first joinable from_item; an item
+        # cannot become joinable again, so skipped ones are passed for good
+        cursor_bykey = defaultdict(int)
+        for to_item, key in matches_byto:
+            from_bucket = from_buckets[key]
+            cursor = cursor_bykey[key]
+            while cursor < len(from_bucket)\
+                    and not from_bucket[cursor].is_joinable(join_obj):
+                cursor += 1
+            cursor_bykey[key] = cursor
+            if cursor < len(from_bucket):
+                match = from_bucket[cursor]
+                self._join(match, to_item)
+                yield join_obj, match.item, to_item.item
+
+        if debug:
+            # evaluate nomatch, multiple matches and novalidmatches
+            for key, from_bucket in from_buckets.items():
+                to_bucket = to_buckets.get(key)
+                if to_bucket is None:
+                    self.from_cnt_nomatch += len(from_bucket)
+                    continue
+                len_m = len(to_bucket)
+                self.from_cntmax_permatch = max(self.from_cntmax_permatch, len_m)
+                for from_item in from_bucket:
+                    if len_m > 1:
+                        self.from_occur_matches += 1
+                        self.from_total_matches += len_m
+                    if len(from_item._peers[join_obj]) == 0:
+                        self.from_cnt_novalidmatch += 1
+            for key, to_bucket in to_buckets.items():
+                from_bucket = from_buckets.get(key)
+                if from_bucket is None:
+                    self.to_cnt_nomatch += len(to_bucket)
+                    continue
+                len_m = len(from_bucket)
+                self.to_cntmax_permatch = max(self.to_cntmax_permatch, len_m)
+                for to_item in to_bucket:
+                    if len_m > 1:
+                        self.to_occur_matches += 1
+                        self.to_total_matches += len_m
+                    if len(to_item._peers[join_obj]) == 0:
+                        self.to_cnt_novalidmatch += 1
+            if debug_more:
+                max_lines = 20
+                # print diagnose details
+                to_print = []
+                for key, from_bucket in from_buckets.items():
+                    to_bucket = to_buckets.get(key)
+                    if to_bucket is None\
+                            or len(from_bucket) * len(to_bucket) <= 1:
+                        continue
+                    str_key = ",".join(key)
+                    for from_item in from_bucket:
+                        for to_item in to_bucket:
+                            to_print.append((from_item.seconds, #l[0]
+                                             str_key,           #l[1]
+                                             from_item,         #l[2]
+                                             to_item))          #l[3]
+                to_print.sort(key=lambda l:(l[0], l[1]))
+                n_lines = 0
+                for l in to_print:
+                    n_lines += 1
+                    if n_lines > max_lines:
+                        print("  ...(%d)..." % (len(to_print)-n_lines+1))
+                        break
+
+                    if l[3] not in l[2]._peers[join_obj]:
+                        label="!"
+                    else:
+                        label=" "
+                    if len(l[2]._peers[join_obj]) == 0:
+                        from_label="!"
+                    else:
+                        from_label=" "
+                    if len(l[3]._peers[join_obj]) == 0:
+                        to_label="!"
+                    else:
+                        to_label=" "
+                    print("  %s%s: %s`%s`%s -> %s`%s`%s" % (
+                        label, l[1],
+                        l[2].seconds, l[2].item.keyword, from_label,
+                        l[3].seconds, l[3].item.keyword, to_label))
+
+        self.report()
+
+
+Indexers = {"hash": HashIndexer,
+            "pandas": PandasIndexer}
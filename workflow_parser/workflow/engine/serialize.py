@@ -0,0 +1,358 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+from collections import defaultdict
+from itertools import chain
+import marshal
+import os
+import zlib
+
+from ... import reserved_vars as rv
+from ...datasource import Interner
+from ...datasource import Source
+from ...graph import Master
+from ...service_registry import Component
+from ...service_registry import ServiceRegistry
+from ...utils import Report
+from ..entities.bases import Pace
+from ..entities.join import CrossjoinActivity
+from ..entities.join import EmptyjoinActivity
+from ..entities.join import InnerjoinActivity
+from ..entities.join import JoinActivityBase
+from ..entities.join import RequestjoinActivity
+from ..entities.threadins import ThreadInstance
+from ..exc import StateError
+from .request import build_requests
+from .schema import JoinInfo
+
+
+DUMP_VERSION = 2
+_MAGIC = b"WFRQ"
+
+
+def _compact_vars(vs):
+    component = vs.get(rv.COMPONENT)
+    if isinstance(component, Component):
+        vs = dict(vs)
+        vs[rv.COMPONENT] = component.name
+    return vs
+
+
+def _expand_vars(vs, sr):
+    component = vs.get(rv.COMPONENT)
+    if component is not None:
+        c_obj = sr.f_to_component(component)
+        if not c_obj:
+            raise StateError("Unrecognized component %s" % component)
+        vs[rv.COMPONENT] = c_obj
+    return vs
+
+
+def _iter_paces(threadins):
+    activity = threadins.start_activity.nxt_thread_activity
+    while activity is not None:
+        yield activity.from_pace
+        activity = activity.nxt_thread_activity
+
+
+def _iter_thread_activities(threadins):
+    activity = threadins.start_activity
+    while activity is not None:
+        yield activity
+        activity = activity.nxt_thread_activity
+
+
+def dump_requests(requestinss, f_dir, mastergraph, driver_hash):
+    """ Save built requests as lines, thread instance steps and joins.
+
+    Thread instances are replayed from their lines on load, joins and
+    groups are restored from the saved pace references. Activity orders
+    are saved so that they are not searched again on load.
+    """
+    assert isinstance(mastergraph, Master)
+    inner_index = {jo: i for i, jo in enumerate(mastergraph.inner_joinobjs)}
+    cross_index = {jo: i for i, jo in enumerate(mastergraph.cross_joinobjs)}
+
+    sources = []
+    source_index = {}
+    def ref_pace(pace):
+        assert isinstance(pace, Pace)
+        line_obj = pace.line_obj
+        source = line_obj.source_obj
+        src_i = source_index.get(source)
+        if src_i is None:
+            src_i = len(sources)
+            source_index[source] = src_i
+            sources.append(source)
+        return (src_i, int(line_obj._index))
+
+    # collect thread instances, including the ones only reached by joins
+    threadinss = []
+    threadins_index = {}
+    def add_threadins(threadins):
+        if threadins not in threadins_index:
+            threadins_index[threadins] = len(threadinss)
+            threadinss.append(threadins)
+
+    for requestins in requestinss.values():
+        for threadins in requestins.threadinss:
+            add_threadins(threadins)
+
+    # collect joins, and the thread instances only reached by joins
+    join_set = set()
+    i_threadins = 0
+    while i_threadins < len(threadinss):
+        threadins = threadinss[i_threadins]
+        i_threadins += 1
+        for pace in _iter_paces(threadins):
+            for acts in chain(pace.prv_activity_bytype.values(),
+                              pace.nxt_activity_bytype.values()):
+                for act in acts:
+                    if isinstance(act, CrossjoinActivity):
+                        joins_ = (act, act.caller)
+                    elif isinstance(act, (JoinActivityBase,
+                                          EmptyjoinActivity)):
+                        joins_ = (act,)
+                    else:
+                        continue
+                    for join in joins_:
+                        if join in join_set:
+                            continue
+                        join_set.add(join)
+                        if isinstance(join, RequestjoinActivity):
+                            add_threadins(join.from_pace_unnested.threadins)
+                            add_threadins(join.to_pace_unnested.threadins)
+                        elif isinstance(join, InnerjoinActivity):
+                            add_threadins(join.from_threadins)
+                            add_threadins(join.to_threadins)
+                        elif isinstance(join, CrossjoinActivity):
+                            add_threadins(join.callee.threadins)
+
+    # replayed in the creation order
+    joins = []
+    join_orders = []
+    join_index = {}
+    for join in sorted(join_set, key=lambda j: j.seq):
+        if isinstance(join, RequestjoinActivity):
+            entry = ("R", inner_index[join.join_obj],
+                     ref_pace(join.from_pace_unnested),
+                     ref_pace(join.to_pace_unnested))
+        elif isinstance(join, InnerjoinActivity):
+            entry = ("I", inner_index[join.join_obj],
+                     ref_pace(join.from_pace), ref_pace(join.to_pace))
+        elif isinstance(join, CrossjoinActivity):
+            entry = ("C", cross_index[join.join_obj],
+                     join_index[join.caller], ref_pace(join.callee))
+        else:
+            assert isinstance(join, EmptyjoinActivity)
+            if join._join_cls is CrossjoinActivity:
+                j_cls, jo_index = "C", cross_index
+            else:
+                j_cls, jo_index = "I", inner_index
+            item = join._pace
+            if isinstance(item, Pace):
+                item_ref = ("p", ref_pace(item))
+            else:
+                item_ref = ("j", join_index[item])
+            entry = ("E", [jo_index[jo] for jo in join.join_objs],
+                     join.is_joins, j_cls, item_ref)
+        join_index[join] = len(joins)
+        joins.append(entry)
+        join_orders.append(join.order)
+
+    # replay in the creation order of each thread
+    order = sorted(range(len(threadinss)), key=lambda i: (
+        ref_pace(threadinss[i].from_pace)))
+    position = [0] * len(threadinss)
+    threadins_entries = []
+    for pos, i in enumerate(order):
+        position[i] = pos
+        threadins = threadinss[i]
+        refs = [ref_pace(pace) for pace in _iter_paces(threadins)]
+        threadins_entries.append((
+            refs[0][0],
+            [ref[1] for ref in refs],
+            threadins.request,
+            dict(threadins.thread_vars),
+            {k: tuple(vs) for k, vs in threadins.thread_vars_dup.items()},
+            [act.order for act in _iter_thread_activities(threadins)]))
+
+    request_entries = []
+    for requestins in requestinss.values():
+        request_entries.append((
+            requestins.request,
+            [position[threadins_index[ti]] for ti in requestins.threadinss]))
+
+    source_entries = []
+    for source in sources:
+        offsets = [(alias, target_obj.offset)
+                   for alias, target_obj in source.targets_byalias.items()]
+        records = [(lino, line, _compact_vars(vs))
+                   for lino, line, vs in source.iter_records()]
+        source_entries.append((source.name, source.where,
+                               _compact_vars(source.vars_), records, offsets))
+
+    payload = zlib.compress(marshal.dumps({
+        "sources": source_entries,
+        "threadinss": threadins_entries,
+        "joins": joins,
+        "join_orders": join_orders,
+        "requests": request_entries}), 1)
+
+    tmp_dir = f_dir + ".tmp"
+    with open(tmp_dir, "wb") as writer:
+        writer.write(_MAGIC)
+        marshal.dump((DUMP_VERSION, driver_hash), writer)
+        writer.write(payload)
+    os.replace(tmp_dir, f_dir)
+
+    print("Saved %d requests, %d thread instances, %d joins to %s" % (
+        len(request_entries), len(threadins_entries), len(joins), f_dir))
+
+
+def load_requests(f_dir, mastergraph, sr, driver_hash, report):
+    assert isinstance(mastergraph, Master)
+    assert isinstance(sr, ServiceRegistry)
+    assert isinstance(report, Report)
+
+    with open(f_dir, "rb") as reader:
+        if reader.read(len(_MAGIC)) != _MAGIC:
+            raise StateError("%s is not a saved requests file" % f_dir)
+        version, hash_ = marshal.load(reader)
+        if version != DUMP_VERSION:
+            raise StateError("%s has version %s, expect %s" % (
+                f_dir, version, DUMP_VERSION))
+        if hash_ != driver_hash:
+            raise StateError("%s is saved with another driver" % f_dir)
+        payload = marshal.loads(zlib.decompress(reader.read()))
+
+    print("Load lines...")
+    targets_byname = {}
+    sources = []
+    cnt_lines = 0
+    interner = Interner()
+    for name, where, vs, records, _ in payload["sources"]:
+        source = Source(name, where, _expand_vars(vs, sr), interner)
+        for lino, line, l_vs in records:
+            source.append_line(lino, line, _expand_vars(l_vs, sr),
+                               targets_byname)
+        cnt_lines += source.len_lineobjs
+        sources.append(source)
+    report.step("read", line=cnt_lines,
+                        target=len(targets_byname))
+
+    print("Replay thread instances...")
+    threadinss = []
+    for (src_i, indexes, request,
+            thread_vars, thread_vars_dup, _) in payload["threadinss"]:
+        store = sources[src_i].store
+        line_objs = [store.line(index) for index in indexes]
+        thread_obj = line_objs[0].thread_obj
+        threadins, _ = ThreadInstance.new(
+                mastergraph, line_objs[0], thread_obj, False)
+        if threadins is None:
+            raise StateError("Cannot replay thread instance from %r"
+                    % line_objs[0])
+        for line_obj in line_objs[1:]:
+            if threadins.do_step(line_obj, False) is None:
+                raise StateError("Cannot replay %r in %r"
+                        % (line_obj, threadins))
+        threadins.set_finish()
+        # vars are collected before they are refreshed, restore them
+        if request is not None:
+            threadins.request = request
+        threadins.thread_vars = thread_vars
+        threadins.thread_vars_dup = defaultdict(set)
+        for key, vals in thread_vars_dup.items():
+            threadins.thread_vars_dup[key].update(vals)
+        threadinss.append(threadins)
+    report.step("build_t", threadins=len(threadinss),
+                pace=sum(ti.len_activities-1 for ti in threadinss))
+
+    inner_joinobjs = list(mastergraph.inner_joinobjs)
+    cross_joinobjs = list(mastergraph.cross_joinobjs)
+    def get_pace(ref):
+        pace = sources[ref[0]].store.line(ref[1])._line_state
+        assert isinstance(pace, Pace)
+        return pace
+
+    joininfo = JoinInfo()
+    joins = []
+    for entry in payload["joins"]:
+        j_type = entry[0]
+        if j_type == "I":
+            join = InnerjoinActivity(inner_joinobjs[entry[1]],
+                                     get_pace(entry[2]),
+                                     get_pace(entry[3]))
+        elif j_type == "R":
+            join = RequestjoinActivity(inner_joinobjs[entry[1]],
+                                       get_pace(entry[2]),
+                                       get_pace(entry[3]))
+        elif j_type == "C":
+            jo = cross_joinobjs[entry[1]]
+            caller = joins[entry[2]]
+            callee = get_pace(entry[3])
+            if jo.is_left:
+                join = CrossjoinActivity(jo, caller, callee)
+            else:
+                join = CrossjoinActivity(jo, callee, caller)
+        elif j_type == "E":
+            _, jo_indexes, is_joins, j_cls, item_ref = entry
+            if j_cls == "C":
+                jos = [cross_joinobjs[i] for i in jo_indexes]
+                j_cls = CrossjoinActivity
+            else:
+                jos = [inner_joinobjs[i] for i in jo_indexes]
+                j_cls = InnerjoinActivity
+            if item_ref[0] == "p":
+                item = get_pace(item_ref[1])
+            else:
+                item = joins[item_ref[1]]
+            join = EmptyjoinActivity(item, is_joins, jos, j_cls)
+        else:
+            raise StateError("Invalid join type %s in %s" % (j_type, f_dir))
+        joins.append(join)
+        joininfo.add_join(join)
+    report.step("join_ps",
+                innerjoin=joininfo.len_inners,
+                innerjoined=joininfo.len_inners,
+                interfacejoin=joininfo.len_requests,
+                interfacejoined=joininfo.len_requests,
+                leftinterface=joininfo.len_crossl,
+                rightinterface=joininfo.len_crossr)
+
+    threadgroup_by_request = []
+    for request, indexes in payload["requests"]:
+        threadgroup_by_request.append(
+            (request, set(threadinss[i] for i in indexes)))
+    requestinss = build_requests(threadgroup_by_request, joininfo, report,
+                                 set_orders=False)
+
+    # restore the saved orders instead of searching them again
+    for threadins, entry in zip(threadinss, payload["threadinss"]):
+        orders = entry[5]
+        if len(orders) != threadins.len_activities:
+            raise StateError("Cannot restore orders of %r" % threadins)
+        for act, order in zip(_iter_thread_activities(threadins), orders):
+            act.order = order
+    for join, order in zip(joins, payload["join_orders"]):
+        join.order = order
+
+    # requests are built before clocks are adjusted
+    for source, source_entry in zip(sources, payload["sources"]):
+        for alias, offset in source_entry[4]:
+            source.targets_byalias[alias].offset = offset
+    return requestinss
@@ -0,0 +1,139 @@
+# Copyright (c) 2017 Yingxin Cheng
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from __future__ import print_function
+
+from ...graph import Master
+from ...utils import Report
+from .request import build_requests
+from .request import group_threads
+from .schema import JoinInfo
+from .schema import SchemaEngine
+from .threadins import TargetParser
+from .threadins import errors
+
+
+class StreamEngine(object):
+    """ Build requests incrementally from targets that keep growing.
+
+    Unjoined paces wait `window` seconds after the newest line before they
+    are given up, and a request is built once none of its thread instances
+    can change any more.
+    """
+    def __init__(self, mastergraph, window, indexer="hash"):
+        assert isinstance(mastergraph, Master)
+        self.mastergraph = mastergraph
+        self.window = float(window)
+        self.schema_engine = SchemaEngine(mastergraph, indexer)
+        self.joininfo = JoinInfo()
+
+        self.target_parsers = []
+        self._parser_bytarget = {}
+        self._len_threadinss_bythread = {}
+        # thread instances not built into requests yet
+        self.threadinss = []
+
+        self.watermark = None
+        self._valid_lineobjs = 0
+        self.len_requestinss = 0
+
+    def _parse_targets(self, target_byname):
+        for target_obj in target_byname.values():
+            if target_obj not in self._parser_bytarget:
+                t_parser = TargetParser(target_obj,
+                                        self.mastergraph,
+                                        self.schema_engine)
+                self._parser_bytarget[target_obj] = t_parser
+                self.target_parsers.append(t_parser)
+
+        valid_lineobjs = 0
+        new_threadinss = 0
+        for t_parser in self.target_parsers:
+            t_parser.proceed()
+            for p in t_parser.thread_parsers:
+                thread_obj = p.thread_obj
+                len_before = self._len_threadinss_bythread.get(thread_obj, 0)
+                self.threadinss.extend(thread_obj.threadinss[len_before:])
+                new_threadinss += len(thread_obj.threadinss) - len_before
+                self._len_threadinss_bythread[thread_obj] =\
+                        len(thread_obj.threadinss)
+                valid_lineobjs += p.valid_lineobjs
+
+            last_lineobj = t_parser.target_obj.last_lineobj
+            if last_lineobj is not None:
+                if self.watermark is None\
+                        or self.watermark < last_lineobj.seconds:
+                    self.watermark = last_lineobj.seconds
+
+        new_lineobjs = valid_lineobjs - self._valid_lineobjs
+        self._valid_lineobjs = valid_lineobjs
+        return new_lineobjs, new_threadinss
+
+    def proceed(self, target_byname, report, flush=False):
+        """ Return the requests completed by the lines added so far.
+
+        With flush, every remaining thread instance is finished and the
+        pending joins are given up.
+        """
+        assert isinstance(report, Report)
+
+        print("Build thread instances...")
+        valid_lineobjs, new_threadinss = self._parse_targets(target_byname)
+        print("%d valid line_objs" % valid_lineobjs)
+        print("%d thread instances" % new_threadinss)
+        print()
+        report.step("build_t",
+                    line=valid_lineobjs,
+                    threadins=new_threadinss)
+        errors.report()
+
+        if flush or self.watermark is None:
+            horizon = float("inf")
+        else:
+            horizon = self.watermark - self.window
+
+        # threads silent for the window won't resume their thread instances
+        open_threadinss = set()
+        for target_parser in self.target_parsers:
+            for t_parser in target_parser.thread_parsers:
+                if t_parser.threadins is None:
+                    continue
+                if t_parser.last_lineobj.seconds < horizon:
+                    t_parser.finish()
+                else:
+                    open_threadinss.add(t_parser.threadins)
+
+        self.schema_engine.proceed_window(
+                self.joininfo, target_byname, horizon)
+        open_threadinss.update(self.schema_engine.iter_pending_threadinss())
+
+        ready_groups = []
+        for request, tgroup in group_threads(
+                self.threadinss, self.joininfo, report):
+            if not (tgroup & open_threadinss):
+                ready_groups.append((request, tgroup))
+        if not ready_groups:
+            return {}
+
+        requestinss = build_requests(ready_groups, self.joininfo, report)
+        self.len_requestinss += len(requestinss)
+
+        built_threadinss = set()
+        for _, tgroup in ready_groups:
+            built_threadinss.update(tgroup)
+        for threadins in built_threadinss:
+            self.joininfo.discard(threadins)
+        self.threadinss = [ti for ti in self.threadinss
+                           if ti not in built_threadinss]
+        return requestinss
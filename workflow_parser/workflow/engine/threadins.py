@@ -212,115 +212,152 @@ errors = Errors()
 cnf_threadparse_proceed_at_failure = False
 
 
-def build_thread_instances(target_objs, mastergraph, schema_engine, report):
-    assert isinstance(mastergraph, Master)
-    assert isinstance(schema_engine, SchemaEngine)
-    assert isinstance(report, Report)
-
-    valid_lineobjs = 0
-    thread_objs = []
-
-    print("Build thread instances...")
-    for target_obj in target_objs:
-        assert isinstance(target_obj, Target)
-        for thread_obj in target_obj.thread_objs.values():
-            assert isinstance(thread_obj, Thread)
-            threadins = None
-            thread_valid_lineobjs = 0
-            last_error = None
-
-            for line_obj in thread_obj.iter_lineobjs():
-                assert isinstance(line_obj, Line)
-
-                pace = None
-                if threadins is not None:
-                    pace = threadins.do_step(line_obj)
-                    if pace is not None:
-                        # success: threadins proceed
-                        last_error = None
-                        # errors.success()
-                    else:
-                        nxt_threadins, pace = ThreadInstance.new(
-                                mastergraph, line_obj, thread_obj)
-                        if not threadins.is_complete:
-                            if nxt_threadins is None:
-                                # failed: renew failed, threadins incomplete
-                                # errors.append_incomplete_failed(line_obj)
-                                if last_error:
-                                    errors.append_failure(
-                                            last_error[0], last_error[1], True)
-                                else:
-                                    errors.append_failure(threadins, line_obj)
-                                    last_error = (threadins, line_obj)
-                                if not cnf_threadparse_proceed_at_failure:
-                                    threadins = None
+class ThreadParser(object):
+    """ Parse the lines of a thread into thread instances.
+
+    The open thread instance is kept between calls, so lines appended to
+    the thread later resume it.
+    """
+    def __init__(self, thread_obj, mastergraph, schema_engine):
+        assert isinstance(thread_obj, Thread)
+        self.thread_obj = thread_obj
+        self.mastergraph = mastergraph
+        self.schema_engine = schema_engine
+
+        self.threadins = None
+        self.last_error = None
+        self.last_lineobj = None
+        self.valid_lineobjs = 0
+
+    def proceed(self):
+        thread_obj = self.thread_obj
+        mastergraph = self.mastergraph
+        threadins = self.threadins
+        last_error = self.last_error
+
+        for line_obj in thread_obj.iter_lineobjs(self.last_lineobj):
+            assert isinstance(line_obj, Line)
+            self.last_lineobj = line_obj
+
+            pace = None
+            if threadins is not None:
+                pace = threadins.do_step(line_obj)
+                if pace is not None:
+                    # success: threadins proceed
+                    last_error = None
+                    # errors.success()
+                else:
+                    nxt_threadins, pace = ThreadInstance.new(
+                            mastergraph, line_obj, thread_obj)
+                    if not threadins.is_complete:
+                        if nxt_threadins is None:
+                            # failed: renew failed, threadins incomplete
+                            # errors.append_incomplete_failed(line_obj)
+                            if last_error:
+                                errors.append_failure(
+                                        last_error[0], last_error[1], True)
                             else:
-                                # ~success: threadins renewed, but incomplete
-                                # errors.append_incomplete_success(line_obj)
                                 errors.append_failure(threadins, line_obj)
-                                last_error = None
-                                threadins.set_finish()
-                                threadins = nxt_threadins
+                                last_error = (threadins, line_obj)
+                            if not cnf_threadparse_proceed_at_failure:
+                                threadins = None
                         else:
-                            if nxt_threadins is None:
-                                # failed: renew failed, threadins complete
-                                # errors.append_start_failed(line_obj)
-                                if last_error:
-                                    errors.append_failure(
-                                            last_error[0],
-                                            last_error[1],
-                                            True)
-                                else:
-                                    errors.append_failure(threadins, line_obj)
-                                    last_error = (threadins, line_obj)
-                                if not cnf_threadparse_proceed_at_failure:
-                                    threadins = None
+                            # ~success: threadins renewed, but incomplete
+                            # errors.append_incomplete_success(line_obj)
+                            errors.append_failure(threadins, line_obj)
+                            last_error = None
+                            threadins.set_finish()
+                            threadins = nxt_threadins
+                    else:
+                        if nxt_threadins is None:
+                            # failed: renew failed, threadins complete
+                            # errors.append_start_failed(line_obj)
+                            if last_error:
+                                errors.append_failure(
+                                        last_error[0],
+                                        last_error[1],
+                                        True)
                             else:
-                                # success: threadins renewed
-                                # errors.success()
-                                last_error = None
-                                threadins.set_finish()
-                                threadins = nxt_threadins
-                else:
-                    threadins, pace = ThreadInstance.new(
-                            mastergraph, line_obj, thread_obj)
-                    if threadins is None:
-                        # failed: new failed
-                        # errors.append_start_failed(line_obj)
-                        if last_error:
-                            errors.append_failure(
-                                    last_error[0],
-                                    last_error[1],
-                                    True)
+                                errors.append_failure(threadins, line_obj)
+                                last_error = (threadins, line_obj)
+                            if not cnf_threadparse_proceed_at_failure:
+                                threadins = None
                         else:
-                            errors.append_failure(
-                                    None, line_obj)
-                            last_error = (None, line_obj)
+                            # success: threadins renewed
+                            # errors.success()
+                            last_error = None
+                            threadins.set_finish()
+                            threadins = nxt_threadins
+            else:
+                threadins, pace = ThreadInstance.new(
+                        mastergraph, line_obj, thread_obj)
+                if threadins is None:
+                    # failed: new failed
+                    # errors.append_start_failed(line_obj)
+                    if last_error:
+                        errors.append_failure(
+                                last_error[0],
+                                last_error[1],
+                                True)
                     else:
-                        # success: new success
-                        # errors.success()
-                        last_error = None
-
-                if pace is None:
-                    thread_obj.dangling_lineobjs.append(line_obj)
-                    assert line_obj._line_state is None
+                        errors.append_failure(
+                                None, line_obj)
+                        last_error = (None, line_obj)
                 else:
-                    thread_valid_lineobjs += 1
-                    schema_engine.load_pace(pace)
-                    assert line_obj._line_state is not None
+                    # success: new success
+                    # errors.success()
+                    last_error = None
 
-            assert len(thread_obj.dangling_lineobjs) + thread_valid_lineobjs\
-                    == thread_obj.len_lineobjs
+            if pace is None:
+                thread_obj.dangling_lineobjs.append(line_obj)
+                assert line_obj._line_state is None
+            else:
+                self.valid_lineobjs += 1
+                self.schema_engine.load_pace(pace)
+                assert line_obj._line_state is not None
 
-            if threadins is not None:
-                threadins.set_finish()
-            thread_objs.append(thread_obj)
-            valid_lineobjs += thread_valid_lineobjs
+        self.threadins = threadins
+        self.last_error = last_error
+        assert len(thread_obj.dangling_lineobjs) + self.valid_lineobjs\
+                == thread_obj.len_lineobjs
+
+    def finish(self):
+        if self.threadins is not None:
+            self.threadins.set_finish()
+            self.threadins = None
+
+
+class TargetParser(object):
+    """ Parse the threads of a target and refresh its line vars.
+
+    Like ThreadParser, only the lines appended since the last call are
+    processed.
+    """
+    def __init__(self, target_obj, mastergraph, schema_engine):
+        assert isinstance(target_obj, Target)
+        self.target_obj = target_obj
+        self.mastergraph = mastergraph
+        self.schema_engine = schema_engine
+
+        self.thread_parsers = []
+        self._parser_bythread = {}
+        self.refresh_vars = defaultdict(lambda: defaultdict(lambda: 0))
+        self.last_lineobj = None
+
+    def proceed(self):
+        for thread_obj in self.target_obj.thread_objs.values():
+            t_parser = self._parser_bythread.get(thread_obj)
+            if t_parser is None:
+                t_parser = ThreadParser(
+                        thread_obj, self.mastergraph, self.schema_engine)
+                self._parser_bythread[thread_obj] = t_parser
+                self.thread_parsers.append(t_parser)
+            t_parser.proceed()
 
-        # per target:
         ## process vars
-        refresh_vars = defaultdict(lambda: defaultdict(lambda: 0))
-        for line_obj in target_obj.iter_lineobjs():
+        refresh_vars = self.refresh_vars
+        for line_obj in self.target_obj.iter_lineobjs(self.last_lineobj):
+            self.last_lineobj = line_obj
             pace = line_obj._line_state
             if pace:
                 for key in pace.refresh_vars:
@@ -335,6 +372,25 @@ def build_thread_instances(target_objs, mastergraph, schema_engine, report):
                     # print("%s=%s !%s %s" % (
                     #     key, ovalue, refresh_vars[key][ovalue], line_obj.keyword))
 
+
+def build_thread_instances(target_objs, mastergraph, schema_engine, report):
+    assert isinstance(mastergraph, Master)
+    assert isinstance(schema_engine, SchemaEngine)
+    assert isinstance(report, Report)
+
+    valid_lineobjs = 0
+    thread_objs = []
+
+    print("Build thread instances...")
+    for target_obj in target_objs:
+        assert isinstance(target_obj, Target)
+        target_parser = TargetParser(target_obj, mastergraph, schema_engine)
+        target_parser.proceed()
+        for t_parser in target_parser.thread_parsers:
+            t_parser.finish()
+            thread_objs.append(t_parser.thread_obj)
+            valid_lineobjs += t_parser.valid_lineobjs
+
     print("-------------------------")
 
     #### collect ####
@@ -347,6 +403,7 @@ def build_thread_instances(target_objs, mastergraph, schema_engine, report):
     complete_threadinss_by_graph = defaultdict(list)
     start_threadinss = []
     duplicated_vars = set()
+    cnt_paces = 0
 
     for thread_obj in thread_objs:
         if thread_obj.dangling_lineobjs:
@@ -366,6 +423,7 @@ def build_thread_instances(target_objs, mastergraph, schema_engine, report):
             if threadins.is_request_start:
                 start_threadinss.append(threadins)
             threadinss.append(threadins)
+            cnt_paces += threadins.len_activities-1
             duplicated_vars.update(threadins.thread_vars_dup.keys())
 
     #### summary ####
@@ -387,6 +445,7 @@ def build_thread_instances(target_objs, mastergraph, schema_engine, report):
                 thread=len(thread_objs),
                 request=len(start_threadinss),
                 threadins=len(threadinss),
+                pace=cnt_paces,
                 innerjoin=len(schema_engine.innerj_proj.from_items),
                 innerjoined=len(schema_engine.innerj_proj.to_items),
                 leftinterface=len(schema_engine.crossj_proj.from_items),
@@ -16,6 +16,7 @@ from abc import ABCMeta
 from abc import abstractproperty
 from collections import defaultdict
 from functools import total_ordering
+from itertools import count
 
 from ... import reserved_vars as rv
 from ...datasource import Line
@@ -363,11 +364,15 @@ class ActivityBase(IntervalBase):
     _act_type = object()
     _act_lim_back = None
     _act_lim_forth = None
+    _act_seq = count()
 
     def __init__(self, from_pace, to_pace, aname):
         assert isinstance(aname, str)
         super(ActivityBase, self).__init__()
 
+        # creation order, to save and replay joins
+        self.seq = next(ActivityBase._act_seq)
+
         if from_pace:
             self.from_pace = from_pace
         if to_pace:
@@ -216,7 +216,7 @@ class ThreadInstance(ThreadinsBase):
         return self.token.is_complete
 
     @classmethod
-    def new(cls, mastergraph, line_obj, thread_obj):
+    def new(cls, mastergraph, line_obj, thread_obj, process_vars=True):
         assert isinstance(line_obj, Line)
         assert isinstance(thread_obj, Thread)
         assert line_obj.thread_obj is thread_obj
@@ -225,7 +225,7 @@ class ThreadInstance(ThreadinsBase):
                           thread_obj.component)
         if token:
             threadins = ThreadInstance(thread_obj, token)
-            pace = threadins._apply_token(line_obj)
+            pace = threadins._apply_token(line_obj, process_vars)
             threadins.from_pace = pace
             thread_obj.threadinss.append(threadins)
             return threadins, pace
@@ -280,7 +280,7 @@ class ThreadInstance(ThreadinsBase):
             activity = activity.nxt_thread_activity
         return ret_str
 
-    def _apply_token(self, line_obj):
+    def _apply_token(self, line_obj, process_vars=True):
         assert not self.is_finish
         assert self.token.len_states == self.len_activities+1
 
@@ -299,17 +299,18 @@ class ThreadInstance(ThreadinsBase):
                         "Apply token failed: duplicated request-end"
                         "node in threadins %r: %r, %r"
                         % (self, self.rend_activity, activity))
-        self._process_vars(line_obj)
+        if process_vars:
+            self._process_vars(line_obj)
         for mark in activity.marks:
             self.activities_bymark[mark].append(activity)
         return pace
 
-    def do_step(self, line_obj):
+    def do_step(self, line_obj, process_vars=True):
         assert isinstance(line_obj, Line)
         assert line_obj.thread_obj is self.thread_obj
 
         if self.token.do_step(line_obj.keyword):
-            return self._apply_token(line_obj)
+            return self._apply_token(line_obj, process_vars)
         else:
             return None
 